@@ -1,4 +1,7 @@
 # command names and paths to scripts that can be run through the standard runner
 CLI_SCRIPTS = {
-    "usermod" : "octopus.modules.account.scripts.UserMod"
+    "usermod" : "octopus.modules.account.scripts.UserMod",
+    "extractmeta" : "octopus.modules.epmc.extract.ExtractMetadata",
+    "reindex" : "octopus.modules.es.scripts.Reindex",
+    "retention" : "octopus.modules.es.scripts.Retention"
 }
\ No newline at end of file
@@ -44,3 +44,10 @@ HTTP_STREAM_CUT_OFF = 0
 # When streaming content, size of chunks to download by (this default is 250Kb)
 HTTP_STREAM_CHUNK_SIZE = 262144
 
+
+# Should outbound requests be recorded in the in-memory request metrics (octopus.lib.http.metrics)?
+# These can be read with metrics.snapshot(), or exposed via the octopus.modules.metrics blueprint
+HTTP_METRICS_ENABLED = True
+
+# Upper bounds (in seconds) of the buckets for the per-host request latency histograms
+HTTP_METRICS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
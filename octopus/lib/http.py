@@ -1,10 +1,187 @@
 from octopus.core import app
-import requests, time, urllib.request, urllib.parse, urllib.error, json
+import os, requests, time, urllib.request, urllib.parse, urllib.error, json, threading, uuid
 from io import BytesIO
 
 class SizeExceededException(Exception):
     pass
 
+######################################################
+# Request metrics
+
+class RequestMetrics(object):
+    """
+    Thread-safe, in-memory record of outbound request statistics, keyed by host.
+
+    For each host this keeps a latency histogram (cumulative buckets, as Prometheus expects them),
+    counts of response status codes, the number of retries, the total time spent backing off, and
+    the number of bytes sent and received.
+    """
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        # must be called with the lock held
+        h = self._hosts.get(host)
+        if h is None:
+            h = {
+                "latency" : {
+                    "buckets" : [0] * len(self.buckets),
+                    "count" : 0,
+                    "sum" : 0.0
+                },
+                "status" : {},
+                "retries" : 0,
+                "backoff_seconds" : 0.0,
+                "bytes_sent" : 0,
+                "bytes_received" : 0
+            }
+            self._hosts[host] = h
+        return h
+
+    def record_request(self, host, status, elapsed, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            h = self._host(host)
+            lat = h["latency"]
+            for i, b in enumerate(self.buckets):
+                if elapsed <= b:
+                    lat["buckets"][i] += 1
+            lat["count"] += 1
+            lat["sum"] += elapsed
+            status = str(status)
+            h["status"][status] = h["status"].get(status, 0) + 1
+            h["bytes_sent"] += bytes_sent
+            h["bytes_received"] += bytes_received
+
+    def record_retry(self, host):
+        with self._lock:
+            self._host(host)["retries"] += 1
+
+    def record_backoff(self, host, seconds):
+        with self._lock:
+            self._host(host)["backoff_seconds"] += seconds
+
+    def record_bytes_received(self, host, n):
+        with self._lock:
+            self._host(host)["bytes_received"] += n
+
+    def reset(self):
+        with self._lock:
+            self._hosts = {}
+
+    def snapshot(self):
+        """
+        Get a copy of the current statistics, suitable for logging or serialising from a batch job
+
+        :return: dict of host to statistics, where the latency buckets are a list of [upper bound, cumulative count] pairs
+        """
+        with self._lock:
+            snap = {}
+            for host, h in self._hosts.items():
+                snap[host] = {
+                    "latency" : {
+                        "buckets" : [[b, c] for b, c in zip(self.buckets, h["latency"]["buckets"])],
+                        "count" : h["latency"]["count"],
+                        "sum" : h["latency"]["sum"]
+                    },
+                    "status" : dict(h["status"]),
+                    "retries" : h["retries"],
+                    "backoff_seconds" : h["backoff_seconds"],
+                    "bytes_sent" : h["bytes_sent"],
+                    "bytes_received" : h["bytes_received"]
+                }
+            return snap
+
+    def prometheus(self, prefix="octopus_http"):
+        """
+        Render the current statistics in the Prometheus text exposition format
+        """
+        snap = self.snapshot()
+        hosts = sorted(snap.keys())
+        lines = []
+
+        def esc(v):
+            return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        name = prefix + "_request_duration_seconds"
+        lines.append("# HELP {n} Time taken by outbound HTTP requests".format(n=name))
+        lines.append("# TYPE {n} histogram".format(n=name))
+        for host in hosts:
+            lat = snap[host]["latency"]
+            for b, c in lat["buckets"]:
+                lines.append('{n}_bucket{{host="{h}",le="{b}"}} {c}'.format(n=name, h=esc(host), b=b, c=c))
+            lines.append('{n}_bucket{{host="{h}",le="+Inf"}} {c}'.format(n=name, h=esc(host), c=lat["count"]))
+            lines.append('{n}_sum{{host="{h}"}} {s}'.format(n=name, h=esc(host), s=lat["sum"]))
+            lines.append('{n}_count{{host="{h}"}} {c}'.format(n=name, h=esc(host), c=lat["count"]))
+
+        name = prefix + "_responses_total"
+        lines.append("# HELP {n} Outbound HTTP request outcomes by status code".format(n=name))
+        lines.append("# TYPE {n} counter".format(n=name))
+        for host in hosts:
+            for status in sorted(snap[host]["status"].keys()):
+                lines.append('{n}{{host="{h}",status="{s}"}} {c}'.format(n=name, h=esc(host), s=esc(status), c=snap[host]["status"][status]))
+
+        counters = [
+            ("retries", "_retries_total", "Outbound HTTP request retries"),
+            ("backoff_seconds", "_backoff_seconds_total", "Time spent backing off between outbound HTTP request retries"),
+            ("bytes_sent", "_sent_bytes_total", "Bytes sent in outbound HTTP request bodies"),
+            ("bytes_received", "_received_bytes_total", "Bytes received in outbound HTTP response bodies")
+        ]
+        for key, suffix, help in counters:
+            name = prefix + suffix
+            lines.append("# HELP {n} {h}".format(n=name, h=help))
+            lines.append("# TYPE {n} counter".format(n=name))
+            for host in hosts:
+                lines.append('{n}{{host="{h}"}} {v}'.format(n=name, h=esc(host), v=snap[host][key]))
+
+        return "\n".join(lines) + "\n"
+
+metrics = RequestMetrics(app.config.get("HTTP_METRICS_BUCKETS"))
+
+def _metrics_enabled():
+    return app.config.get("HTTP_METRICS_ENABLED", True)
+
+def _host(url):
+    try:
+        return urllib.parse.urlsplit(url).netloc or "unknown"
+    except ValueError:
+        return "unknown"
+
+def _request_size(kwargs):
+    # the number of bytes in the body, encoded as requests will send it.  Streamed bodies are counted if their
+    # length can be told without reading them (e.g. files, and MultipartStream); generators can't be
+    data = kwargs.get("data")
+    if data is None and kwargs.get("json") is not None:
+        data = json.dumps(kwargs.get("json"))
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    if isinstance(data, (dict, list, tuple)):
+        return len(urllib.parse.urlencode(data, doseq=True))
+    try:
+        return requests.utils.super_len(data)
+    except Exception:
+        return 0
+
+def _response_size(r, stream):
+    cl = r.headers.get("content-length")
+    if cl is not None:
+        try:
+            return int(cl)
+        except ValueError:
+            pass
+    if stream:
+        # the body has not been read yet, so get_stream will count it as it is downloaded
+        return 0
+    try:
+        return len(r.content)
+    except Exception:
+        return 0
+
 def quote(s, **kwargs):
     try:
         return urllib.parse.quote_plus(s, **kwargs)
@@ -49,37 +226,64 @@ def _make_request(method, url,
     if response_encoding is None:
         response_encoding = app.config.get("HTTP_RESPONSE_ENCODING")
 
+    # requests can be made through a requests.Session, to reuse its connections
+    requester = kwargs.pop("session", None) or requests
+
     attempt = 0
     r = None
 
+    record = _metrics_enabled()
+    host = _host(url)
+    sent = _request_size(kwargs)
+
     while attempt <= retries:
+        start = time.monotonic()
         try:
             if method == "GET":
-                r = requests.get(url, timeout=timeout, **kwargs)
+                r = requester.get(url, timeout=timeout, **kwargs)
             elif method == "POST":
-                r = requests.post(url, timeout=timeout, **kwargs)
+                r = requester.post(url, timeout=timeout, **kwargs)
             elif method == "PUT":
-                r = requests.put(url, timeout=timeout, **kwargs)
+                r = requester.put(url, timeout=timeout, **kwargs)
             elif method == "DELETE":
-                r = requests.delete(url, timeout=timeout, **kwargs)
+                r = requester.delete(url, timeout=timeout, **kwargs)
             else:
                 # FIXME: is this right?  Maybe raising an exception would be better
                 app.logger.debug("Method {method} not allowed".format(method=method))
                 return None
 
+            if record:
+                metrics.record_request(host, r.status_code, time.monotonic() - start,
+                                       bytes_sent=sent, bytes_received=_response_size(r, kwargs.get("stream", False)))
+
             if r.status_code not in retry_codes:
                 break
             else:
                 attempt += 1
                 app.logger.debug("Request to {url} resulted in status {status}, attempt {attempt}".format(status=r.status_code, url=url, attempt=attempt))
         except requests.exceptions.Timeout:
+            if record:
+                metrics.record_request(host, "timeout", time.monotonic() - start, bytes_sent=sent)
             attempt += 1
             app.logger.debug('Request to {url} timeout, attempt {attempt}'.format(url=url, attempt=attempt))
             if not retry_on_timeout:
                 break
+        except requests.exceptions.RequestException:
+            if record:
+                metrics.record_request(host, "error", time.monotonic() - start, bytes_sent=sent)
+            raise
+
+        # don't back off if there are no more attempts to be made
+        if attempt > retries:
+            break
+
+        if record:
+            metrics.record_retry(host)
 
         bo = _backoff(attempt, back_off_factor, max_back_off)
         app.logger.debug('Request to {url} backing off for {bo} seconds'.format(url=url, bo=bo))
+        if record:
+            metrics.record_backoff(host, bo)
         time.sleep(bo)
 
     if response_encoding is not None and r is not None:
@@ -194,8 +398,94 @@ def get_stream(url, retries=None, back_off_factor=None, max_back_off=None, timeo
 
         resp.connection.close()
 
+        # without a content-length header the request metrics could not know the size up-front
+        if _metrics_enabled() and resp.headers.get("content-length") is None:
+            metrics.record_bytes_received(_host(url), downloaded_bytes)
+
     return resp, content, downloaded_bytes
 
+######################################################
+# Streaming multipart request bodies
+
+class MultipartStream(object):
+    """
+    A multipart/form-data request body which reads its files from disk as it is sent, rather than building the
+    whole body in memory as requests does for files=.  Pass it as data=, with the content_type as the Content-Type
+    header.  As the body can only be read once, requests sending it should not be retried.
+
+    :param fields: list of (name, filename, content type, data) for the parts held in memory
+    :param files: list of (name, filename, content type, path) for the parts to be read from disk
+    """
+    def __init__(self, fields=None, files=None, boundary=None):
+        self.boundary = boundary if boundary is not None else uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=" + self.boundary
+
+        # each part is either bytes, or the path to a file
+        self._parts = []
+        self._length = 0
+        for name, filename, content_type, data in (fields or []):
+            self._head(name, filename, content_type)
+            self._add(data.encode("utf-8") if isinstance(data, str) else data)
+            self._add(b"\r\n")
+        for name, filename, content_type, path in (files or []):
+            self._head(name, filename, content_type)
+            self._parts.append(path)
+            self._length += os.path.getsize(path)
+            self._add(b"\r\n")
+        self._add("--{b}--\r\n".format(b=self.boundary).encode("utf-8"))
+
+        self._index = 0
+        self._offset = 0
+        self._file = None
+
+    def _head(self, name, filename, content_type):
+        head = '--{b}\r\nContent-Disposition: form-data; name="{n}"; filename="{f}"\r\nContent-Type: {c}\r\n\r\n'
+        self._add(head.format(b=self.boundary, n=name, f=filename, c=content_type).encode("utf-8"))
+
+    def _add(self, bs):
+        self._parts.append(bs)
+        self._length += len(bs)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(65536)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+    def read(self, size=-1):
+        out = []
+        remaining = size
+        while self._index < len(self._parts) and (size < 0 or remaining > 0):
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                chunk = part[self._offset:] if size < 0 else part[self._offset:self._offset + remaining]
+                self._offset += len(chunk)
+                done = self._offset >= len(part)
+            else:
+                if self._file is None:
+                    self._file = open(part, "rb")
+                chunk = self._file.read(size if size < 0 else remaining)
+                done = size < 0 or len(chunk) == 0
+                if done:
+                    self._file.close()
+                    self._file = None
+            if done:
+                self._index += 1
+                self._offset = 0
+            out.append(chunk)
+            if size >= 0:
+                remaining -= len(chunk)
+        return b"".join(out)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 ######################################################
 # Mock requests Response object - useful for testing
 
@@ -213,6 +503,10 @@ class MockResponse(object):
     def data(self):
         return self._body
 
+    @property
+    def text(self):
+        return self._body.decode("utf-8", "replace") if self._body is not None else ""
+
     @property
     def raw(self):
         return self._stream
@@ -221,11 +515,13 @@ class MockResponse(object):
     def headers(self):
         return self._headers if self._headers is not None else {}
 
+    def close(self):
+        self._stream.close()
+
     def iter_content(self, chunk_size=1024):
         while True:
             b = self._stream.read(chunk_size)
-            if b == "":
+            if len(b) == 0:
                 # we have reached the end of the file
                 break
-            yield b
-        yield ""
\ No newline at end of file
+            yield b
\ No newline at end of file
@@ -0,0 +1,109 @@
+import codecs, json
+
+class JSONStreamException(Exception):
+    pass
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_NUMBER = "0123456789.eE+-"
+
+class _Buffer(object):
+    # a window onto the text of a json document as it arrives in chunks, which is trimmed as values are consumed
+
+    def __init__(self, chunks, encoding="utf-8"):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        # read the next chunk into the buffer, returning False if there is nothing left
+        if self.eof:
+            return False
+        # drop what has already been consumed before growing the buffer
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.decoder.decode(chunk)
+            if len(chunk) > 0:
+                self.text += chunk
+                return True
+        self.text += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return True
+
+    def peek(self):
+        # the next non-whitespace character, or None at the end of the document
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            raise JSONStreamException("Expected one of {x} at position {y}, found {z}".format(x=chars, y=self.pos, z=c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        # decode the next complete value.  A number which runs right up to the end of the buffer, or is followed by
+        # something which could only be more of the number (e.g. "3" of "3.25"), may have been cut short by the
+        # chunking, so we only trust it once there is a delimiter after it
+        self.peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.text, self.pos)
+                if self.eof or (end < len(self.text) and self.text[end] not in _NUMBER):
+                    self.pos = end
+                    return val
+            except ValueError as e:
+                if self.eof:
+                    raise JSONStreamException("Unable to decode json value: {x}".format(x=str(e)))
+            self.more()
+
+
+def iter_array(chunks, key, header=None, encoding="utf-8"):
+    """
+    Incrementally decode a json object from an iterable of chunks (bytes or strings, e.g. the output of a response's
+    iter_content), yielding the members of the array held at the given top-level key one at a time.  Only the
+    member currently being decoded is held in memory, rather than the whole document.
+
+    :param chunks: iterable of bytes or str
+    :param key: the top-level key of the array to stream
+    :param header: optional dict, which will be populated with the other top-level keys and values.  Those
+        which come after the array are only present once the iteration is complete
+    :param encoding: encoding of byte chunks
+    """
+    buf = _Buffer(chunks, encoding)
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+
+    while True:
+        k = buf.value()
+        if not isinstance(k, str):
+            raise JSONStreamException("Expected an object key, found {x}".format(x=k))
+        buf.expect(":")
+
+        if k == key and buf.peek() == "[":
+            buf.expect("[")
+            if buf.peek() == "]":
+                buf.expect("]")
+            else:
+                while True:
+                    yield buf.value()
+                    if buf.expect(",]") == "]":
+                        break
+        else:
+            val = buf.value()
+            if header is not None:
+                header[k] = val
+
+        if buf.expect(",}") == "}":
+            break
@@ -1,7 +1,23 @@
 from lxml import etree
-import re
+from collections import OrderedDict
+import codecs, re, threading
 
 encoding_rx = re.compile('^<\?xml .*encoding=["\'](.+?)["\'].*\?>')
+declaration_rx = re.compile(r'^<\?xml[^>]*\?>')
+
+# the options for the parsers used by fromstring and fromfile
+PARSER_OPTIONS = {"huge_tree" : True, "remove_blank_text" : True, "resolve_entities" : False}
+
+# the xml declaration (and any BOM) must be at the very start of the document, so only this much is ever sniffed
+SNIFF_SIZE = 1024
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be")
+]
 
 def detect_encoding(s):
     m = encoding_rx.match(s)
@@ -9,49 +25,185 @@ def detect_encoding(s):
         return None
     return m.group(1)
 
-def fromstring(s):
-    # first try and parse the string directly
-    error = None
+def detect_bom(bs):
+    for bom, enc in BOMS:
+        if bs.startswith(bom):
+            return enc
+    return None
+
+def _override_encoding(prefix):
+    # Decide from the first few bytes of a document whether lxml needs to be told the encoding: only when the
+    # declaration names an encoding that doesn't exist, in which case we assume utf-8 (or whatever the BOM says).
+    # Otherwise lxml's own detection from the BOM and declaration is usually correct, and None is returned
+    enc = detect_encoding(prefix.decode("latin-1"))
+    if enc is None:
+        return None
+    try:
+        codecs.lookup(enc)
+        return None
+    except LookupError:
+        return detect_bom(prefix) or "utf-8"
+
+def _alternative_encoding(prefix):
+    # libxml2 does not know every alias python does (e.g. "latin-1"), so if a parse fails, python's canonical
+    # name for the declared encoding is the one to try next
+    enc = detect_encoding(prefix.decode("latin-1"))
+    if enc is None:
+        return None
+    try:
+        name = codecs.lookup(enc).name
+    except LookupError:
+        return None
+    return name if name != enc.lower() else None
+
+# parsers are kept per thread and reused, as they are expensive to construct and must not be shared between threads
+_parser_local = threading.local()
+
+def get_parser(encoding=None, **options):
+    """
+    Get a configured etree.XMLParser, built only the first time it is asked for in this thread.  Options not
+    given default to PARSER_OPTIONS.
+    """
+    cache = getattr(_parser_local, "cache", None)
+    if cache is None:
+        cache = {}
+        _parser_local.cache = cache
+
+    opts = dict(PARSER_OPTIONS)
+    opts.update(options)
+    key = (encoding, tuple(sorted(opts.items())))
+    parser = cache.get(key)
+    if parser is None:
+        parser = etree.XMLParser(encoding=encoding, **opts)
+        cache[key] = parser
+    return parser
+
+def fromstring(s, **options):
+    """
+    Parse an XML document from bytes or a string, and return the root element.
+
+    Bytes are given straight to the parser, which reads the BOM and encoding declaration itself; only if the
+    declaration names an unknown encoding is it overridden.  Strings, which lxml refuses to parse if they carry
+    an encoding declaration, have the declaration (and any BOM) sliced off rather than being re-encoded.
+
+    Any keyword arguments are parser options which override PARSER_OPTIONS.
+    """
+    if isinstance(s, str):
+        if s.startswith("\ufeff"):
+            s = s[1:]
+        if s.startswith("<?xml"):
+            m = declaration_rx.match(s[:SNIFF_SIZE])
+            if m is not None:
+                s = s[m.end():]
+        return etree.fromstring(s, get_parser(**options))
+
+    prefix = s[:SNIFF_SIZE]
+    try:
+        return etree.fromstring(s, get_parser(_override_encoding(prefix), **options))
+    except etree.XMLSyntaxError:
+        alt = _alternative_encoding(prefix)
+        if alt is None:
+            raise
+        return etree.fromstring(s, get_parser(alt, **options))
+
+def fromfile(source, **options):
+    """
+    Parse an XML document from a filename or file-like object opened in binary mode, and return the root
+    element.  The document is read by the parser in chunks, so is never held in memory as a whole alongside
+    the tree.
+
+    Any keyword arguments are parser options which override PARSER_OPTIONS.
+    """
+    pos = 0
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            prefix = f.read(SNIFF_SIZE)
+    elif hasattr(source, "seekable") and source.seekable():
+        pos = source.tell()
+        prefix = source.read(SNIFF_SIZE)
+        source.seek(pos)
+    else:
+        return etree.parse(source, get_parser(**options)).getroot()
+
     try:
-        return etree.fromstring(s)
-    except ValueError as e:
-        error = e
-
-    # if this failed, and this is not a unicode string, then just raise
-    # the exception, as there's nothing more to do for now
-    if not isinstance(s, str):
-        raise error
-
-    # our next best bet is to attempt to encode the unicode to a byte-stream
-    # with the relevant encoding
-    enc = detect_encoding(s)
-    if enc is not None:
-        try:
-            bs = s.encode(enc)
-            return etree.fromstring(bs)
-        except LookupError:
-            # this means the detected encoding is junk
-            pass
-        except ValueError as e:
-            # we had a problem parsing with the given encoding
-            pass
-
-    # if we get here, we failed to decode or failed to parse.  Let's therefore strip
-    # the encoding declaration and see if lxml can sort it out (and just let the
-    # error raise as necessary)
-    clean = encoding_rx.sub("", s).strip()
-    return etree.fromstring(clean)
-
-def xp_first_text(element, xpath, default=None):
-    el = element.xpath(xpath)
+        return etree.parse(source, get_parser(_override_encoding(prefix), **options)).getroot()
+    except (etree.XMLSyntaxError, OSError):
+        # lxml reports encoding errors in files read by name as OSError
+        alt = _alternative_encoding(prefix)
+        if alt is None:
+            raise
+        if not isinstance(source, str):
+            source.seek(pos)
+        return etree.parse(source, get_parser(alt, **options)).getroot()
+
+def parse_until(source, tag, **kwargs):
+    """
+    Incrementally parse the source (a filename or file-like object) only as far as the end of the
+    first element with the given tag, and return the root of the partial tree built so far.  Nothing
+    after that element is read from the source or held in memory.
+
+    If the tag is never found, the whole document is parsed.  Any additional keyword arguments are
+    passed on to etree.iterparse, and override PARSER_OPTIONS.
+    """
+    opts = dict(PARSER_OPTIONS)
+    opts.update(kwargs)
+    context = etree.iterparse(source, events=("start", "end"), **opts)
+    root = None
+    for event, el in context:
+        if root is None:
+            root = el
+        if event == "end" and el.tag == tag:
+            break
+    del context
+    return root
+
+# compiled XPath evaluators are kept per thread, as lxml serialises concurrent calls to a single evaluator
+_xpath_local = threading.local()
+
+# most compiled XPath evaluators each thread keeps; beyond that, the least recently used are dropped
+XPATH_CACHE_SIZE = 256
+
+def compile_xpath(xpath, namespaces=None):
+    """
+    Get a compiled etree.XPath evaluator for the expression, compiling it only the first time it is asked for (or
+    again, once it has dropped out of the XPATH_CACHE_SIZE most recently used).
+
+    Expressions which need to vary (e.g. to look up an id) should use XPath variables ("//aff[@id=$rid]"),
+    with the values supplied at evaluation time, rather than building a new expression string each time.
+    """
+    cache = getattr(_xpath_local, "cache", None)
+    if cache is None:
+        cache = OrderedDict()
+        _xpath_local.cache = cache
+
+    key = (xpath, tuple(sorted(namespaces.items())) if namespaces else None)
+    evaluator = cache.get(key)
+    if evaluator is not None:
+        cache.move_to_end(key)
+        return evaluator
+
+    evaluator = etree.XPath(xpath, namespaces=namespaces)
+    cache[key] = evaluator
+    while len(cache) > XPATH_CACHE_SIZE:
+        cache.popitem(last=False)
+    return evaluator
+
+def xp(element, xpath, namespaces=None, **variables):
+    """
+    Evaluate the xpath against the element, using the compiled evaluator cache.  The xpath may
+    also be an already compiled etree.XPath
+    """
+    if isinstance(xpath, etree.XPath):
+        return xpath(element, **variables)
+    return compile_xpath(xpath, namespaces)(element, **variables)
+
+def xp_first_text(element, xpath, default=None, namespaces=None):
+    el = xp(element, xpath, namespaces=namespaces)
     if type(el)==list:
         if len(el) > 0:
             return el[0].text
     # 2018-02-07 TD : adding the case if xpath="string(...)" is passed
-    elif type(el)==etree._ElementUnicodeResult:
-        if len(el) > 0:
-            return el
-    elif type(el)==etree._ElementStringResult:
+    elif isinstance(el, str):
         if len(el) > 0:
             return el
     else:
@@ -59,18 +211,66 @@ def xp_first_text(element, xpath, default=None):
 
     return default
 
-def xp_texts(element, xpath):
-    els = element.xpath(xpath)
+def xp_texts(element, xpath, namespaces=None):
+    els = xp(element, xpath, namespaces=namespaces)
     return [e.text for e in els if e.text is not None]
 
-def objectify(element):
-    obj = {}
-    for c in element.getchildren():
-        # FIXME: does not currently handle attributes
-        #for attr in c.keys():
-        #    obj["@" + attr] = c.get(attr)
-        if len(c.getchildren()) > 0:
-            obj[c.tag] = objectify(c)
-        else:
-            obj[c.tag] = c.text
-    return obj
+def objectify(element, repeated=False, attributes=False, paths=None):
+    """
+    Convert the children of the element into a dict keyed by tag, with elements which have children of their own
+    becoming nested dicts and leaf elements becoming their text.
+
+    The tree is walked iteratively, so there is no limit on its depth, and each node is visited once.
+
+    :param repeated: if True, tags which occur more than once under the same parent become a list of values.
+        Otherwise the last one wins
+    :param attributes: if True, attributes are included with an "@" prefix on their name, and the text of a leaf
+        element which has attributes goes under "#text"
+    :param paths: optional list of "/" separated tag paths, relative to the element (e.g. "journalInfo/journal").
+        Only elements on those paths, and everything beneath them, are included
+    """
+    selected = None
+    prefixes = None
+    if paths is not None:
+        selected = set([tuple(p.strip("/").split("/")) for p in paths])
+        prefixes = set([s[:i] for s in selected for i in range(1, len(s))])
+
+    root = {}
+    stack = [(element, root, (), selected is None)]
+    while len(stack) > 0:
+        el, obj, path, inside = stack.pop()
+        if attributes:
+            for k, v in el.attrib.items():
+                obj["@" + k] = v
+
+        listed = set()
+        for c in el:
+            tag = c.tag
+            if not isinstance(tag, str):
+                # comments and processing instructions
+                continue
+
+            cpath = path + (tag,)
+            cinside = inside
+            if not inside:
+                if cpath in selected:
+                    cinside = True
+                elif cpath not in prefixes:
+                    continue
+
+            if len(c) > 0 or (attributes and len(c.attrib) > 0):
+                value = {}
+                if len(c) == 0 and c.text is not None:
+                    value["#text"] = c.text
+                stack.append((c, value, cpath, cinside))
+            else:
+                value = c.text
+
+            if repeated and tag in obj:
+                if tag not in listed:
+                    obj[tag] = [obj[tag]]
+                    listed.add(tag)
+                obj[tag].append(value)
+            else:
+                obj[tag] = value
+    return root
@@ -0,0 +1,198 @@
+"""
+Benchmarks for the JATS / RSC metadata models.
+
+Run over a directory of real JATS files with
+
+    python -m octopus.modules.epmc.benchmark -d /path/to/jats/files
+
+or generate a synthetic corpus to run against (which also benchmarks the batch extraction pipeline) with
+
+    python -m octopus.modules.epmc.benchmark -g 200 -w 4
+
+"""
+from octopus.lib import xml as xutil
+from octopus.modules.epmc import models, extract
+import os, time, tempfile
+
+# the xpaths evaluated when extracting metadata from a JATS document
+JATS_XPATHS = [
+    "string(//title-group/article-title)",
+    "string(//journal-title)",
+    "//article-meta/volume",
+    "//article-meta/issue",
+    "//article-meta/fpage",
+    "//article-meta/lpage",
+    "//article-id[@pub-id-type='manuscript']",
+    "//license",
+    "//license/license-p",
+    "//copyright-statement",
+    "//article-categories/subj-group/subject",
+    "//contrib-group/contrib[@contrib-type='author']",
+    "//email",
+    "//kwd-group/kwd",
+    "//publisher/publisher-name",
+    "//article-meta/pub-date[@pub-type='epub']",
+    "//history/date[@date-type='accepted']",
+    "//history/date[@date-type='received']",
+    "//journal-meta/issn",
+    "//article-meta/article-id[@pub-id-type='pmcid']",
+    "//article-meta/article-id[@pub-id-type='doi']"
+]
+
+JATS_PROPERTIES = ["title", "journal", "volume", "issue", "fpage", "lpage", "is_aam", "copyright_statement",
+                   "categories", "authors", "contribs", "emails", "keywords", "publisher", "publication_date",
+                   "date_accepted", "date_submitted", "issn", "pmcid", "doi"]
+
+
+def load_corpus(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".xml"):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            corpus.append((name, f.read()))
+    return corpus
+
+
+SYNTHETIC_JATS = """<?xml version="1.0" encoding="UTF-8"?>
+<article xmlns:xlink="http://www.w3.org/1999/xlink">
+<front>
+<journal-meta><journal-title-group><journal-title>Synthetic Journal</journal-title></journal-title-group>
+<issn pub-type="epub">1234-5678</issn><publisher><publisher-name>Synthetic Publisher</publisher-name></publisher></journal-meta>
+<article-meta>
+<article-id pub-id-type="pmcid">PMC{n}</article-id><article-id pub-id-type="doi">10.1234/synthetic.{n}</article-id>
+<article-categories><subj-group><subject>Research Article</subject></subj-group></article-categories>
+<title-group><article-title>Synthetic article number {n}</article-title></title-group>
+<contrib-group>{contribs}</contrib-group>
+{affs}
+<pub-date pub-type="epub"><day>01</day><month>02</month><year>2016</year></pub-date>
+<volume>{n}</volume><issue>1</issue><fpage>1</fpage><lpage>10</lpage>
+<history><date date-type="received"><day>01</day><month>01</month><year>2016</year></date>
+<date date-type="accepted"><day>15</day><month>01</month><year>2016</year></date></history>
+<permissions><copyright-statement>Copyright the authors</copyright-statement>
+<license license-type="open-access" xlink:href="http://creativecommons.org/licenses/by/4.0/"><license-p>CC BY</license-p></license></permissions>
+<kwd-group><kwd>synthetic</kwd><kwd>benchmark</kwd></kwd-group>
+</article-meta>
+</front>
+<body>{body}</body>
+</article>
+"""
+
+SYNTHETIC_CONTRIB = """<contrib contrib-type="author"><name><surname>Author{i}</surname><given-names>Some</given-names></name>
+<email>author{i}@example.com</email><xref ref-type="aff" rid="aff{a}"/></contrib>"""
+
+SYNTHETIC_AFF = """<aff id="aff{a}"><institution>University {a}</institution>, <country>Somewhere</country></aff>"""
+
+SYNTHETIC_PARAGRAPH = "<sec><title>Section {i}</title><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p></sec>"
+
+
+def generate_corpus(directory, count, authors=20, affiliations=5, paragraphs=500):
+    """
+    Write count synthetic JATS documents into the directory, and return their paths
+    """
+    contribs = "".join([SYNTHETIC_CONTRIB.format(i=i, a=i % affiliations) for i in range(authors)])
+    affs = "".join([SYNTHETIC_AFF.format(a=a) for a in range(affiliations)])
+    body = "".join([SYNTHETIC_PARAGRAPH.format(i=i) for i in range(paragraphs)])
+
+    paths = []
+    for n in range(count):
+        path = os.path.join(directory, "synthetic_{n}.xml".format(n=n))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(SYNTHETIC_JATS.format(n=n, contribs=contribs, affs=affs, body=body))
+        paths.append(path)
+    return paths
+
+
+def _time(fn, repeats):
+    start = time.perf_counter()
+    for i in range(repeats):
+        fn()
+    return time.perf_counter() - start
+
+
+def bench_xpaths(corpus, repeats=10):
+    """
+    Compare evaluating the JATS xpaths as strings (compiled on every call) against the compiled evaluator cache
+    """
+    docs = [xutil.fromstring(raw, remove_blank_text=False) for name, raw in corpus]
+
+    def uncompiled():
+        for d in docs:
+            for x in JATS_XPATHS:
+                d.xpath(x)
+
+    def compiled():
+        for d in docs:
+            for x in JATS_XPATHS:
+                xutil.xp(d, x)
+
+    return {"uncompiled" : _time(uncompiled, repeats), "compiled" : _time(compiled, repeats)}
+
+
+def bench_jats(corpus, repeats=10):
+    """
+    Time extracting all the metadata through the JATS model, property by property and with extract_all()
+    """
+    docs = [xutil.fromstring(raw, remove_blank_text=False) for name, raw in corpus]
+
+    def properties():
+        for d in docs:
+            j = models.JATS(xml=d)
+            for p in JATS_PROPERTIES:
+                getattr(j, p)
+            j.get_licence_details()
+
+    def extract_all():
+        for d in docs:
+            models.JATS(xml=d).extract_all()
+
+    return {"properties" : _time(properties, repeats), "extract_all" : _time(extract_all, repeats)}
+
+
+def bench_pipeline(paths, workers=None, front_only=False):
+    """
+    Time extracting the metadata from every file one after the other, against the batch extraction process pool
+    """
+    def serial():
+        for p in paths:
+            extract.extract_file(p, front_only)
+
+    def pool():
+        for source, result in extract.extract_batch(paths, workers=workers, front_only=front_only):
+            pass
+
+    return {"serial" : _time(serial, 1), "pool" : _time(pool, 1)}
+
+
+def report(label, results, docs, repeats):
+    for k, v in results.items():
+        per_doc = (v / (docs * repeats)) * 1000 if docs > 0 else 0
+        print("{l} {k}: {t:.3f}s total, {p:.3f}ms per document".format(l=label, k=k, t=v, p=per_doc))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", help="directory containing the JATS xml files to benchmark against")
+    parser.add_argument("-r", "--repeats", type=int, default=10, help="number of passes to make over the corpus")
+    parser.add_argument("-g", "--generate", type=int, help="generate this many synthetic documents to benchmark against (into --directory if given)")
+    parser.add_argument("-w", "--workers", type=int, help="number of worker processes for the batch extraction benchmark")
+    parser.add_argument("-f", "--front", action="store_true", help="only parse the front matter in the batch extraction benchmark")
+    args = parser.parse_args()
+
+    if not args.directory and not args.generate:
+        parser.print_help()
+        exit()
+
+    directory = args.directory
+    if args.generate:
+        if directory is None:
+            directory = tempfile.mkdtemp()
+        generate_corpus(directory, args.generate)
+        print("Generated", args.generate, "synthetic documents in", directory)
+
+    corpus = load_corpus(directory)
+    print("Loaded", len(corpus), "documents from", directory)
+    report("xpath", bench_xpaths(corpus, args.repeats), len(corpus), args.repeats)
+    report("jats", bench_jats(corpus, args.repeats), len(corpus), args.repeats)
+    report("pipeline", bench_pipeline(extract.list_sources(directory), args.workers, args.front), len(corpus), 1)
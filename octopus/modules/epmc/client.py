@@ -1,8 +1,10 @@
 from octopus.core import app
 from octopus.lib import http
 import urllib.request, urllib.parse, urllib.error, string
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 from octopus.modules.epmc import models
+from octopus.modules.identifiers import doi as doi_ids, pmid as pmid_ids, pmcid as pmcid_ids
 
 def quote(s, **kwargs):
     try:
@@ -27,6 +29,10 @@ def to_keywords(s):
     # normalise the spacing
     return " ".join([x for x in raw.split(" ") if x != ""])
 
+def normalise_doi(doi):
+    # DOIs are case insensitive, so batch results are keyed by the lower case form
+    return doi_ids.normalise(doi).lower()
+
 class EuropePMCException(Exception):
     def __init__(self, httpresponse=None, *args, **kwargs):
         super(EuropePMCException, self).__init__(*args, **kwargs)
@@ -45,6 +51,21 @@ class EuropePMC(object):
     def get_by_doi(cls, doi, page=1):
         return cls.field_search("DOI", doi, page=page)
 
+    @classmethod
+    def get_by_pmcids(cls, pmcids, batch_size=None, workers=None):
+        return cls.batch_lookup("PMCID", pmcids, pmcid_ids.normalise, lambda md: md.pmcid,
+                                batch_size=batch_size, workers=workers)
+
+    @classmethod
+    def get_by_pmids(cls, pmids, batch_size=None, workers=None):
+        return cls.batch_lookup("EXT_ID", pmids, pmid_ids.normalise, lambda md: md.pmid,
+                                batch_size=batch_size, workers=workers)
+
+    @classmethod
+    def get_by_dois(cls, dois, batch_size=None, workers=None):
+        return cls.batch_lookup("DOI", dois, normalise_doi, lambda md: md.doi,
+                                batch_size=batch_size, workers=workers)
+
     @classmethod
     def title_exact(cls, title, page=1):
         return cls.field_search("TITLE", title, page=page)
@@ -64,31 +85,219 @@ class EuropePMC(object):
 
         url = app.config.get("EPMC_REST_API") + "search/query=" + field + ":" + wrap + quoted + wrap
         url += "&resultType=core&format=json&page=" + qpage
+        j = cls._get_json(url)
+
+        results = [models.EPMCMetadata(r) for r in j.get("resultList", {}).get("result", [])]
+        return results
+
+    @classmethod
+    def query(cls, query_string, page=1, page_size=None):
+        """
+        Issue a raw EPMC search query (e.g. 'DOI:"10.1234/abc" OR DOI:"10.1234/def"')
+
+        :return: tuple of the list of EPMCMetadata objects on the requested page and the total number of hits
+        """
+        quoted = quote(query_string, safe="/")
+        qpage = quote(str(page))
+        if quoted is None or qpage is None:
+            raise EuropePMCException(None, "unable to url escape the string")
+
+        url = app.config.get("EPMC_REST_API") + "search/query=" + quoted
+        url += "&resultType=core&format=json&page=" + qpage
+        if page_size is not None:
+            url += "&pageSize=" + quote(str(page_size))
+        j = cls._get_json(url)
+
+        results = [models.EPMCMetadata(r) for r in j.get("resultList", {}).get("result", [])]
+        try:
+            total = int(j.get("hitCount", 0))
+        except (TypeError, ValueError):
+            total = 0
+        return results, total
+
+    @classmethod
+    def query_all(cls, query_string, page_size=None):
+        """
+        Issue a raw EPMC search query, and page through to collect all of the results
+        """
+        results = []
+        page = 1
+        while True:
+            batch, total = cls.query(query_string, page=page, page_size=page_size)
+            results += batch
+            if len(batch) == 0 or len(results) >= total:
+                break
+            page += 1
+        return results
+
+    @classmethod
+    def field_iterate(cls, field, value, fuzzy=False, page_size=None, prefetch=True):
+        """
+        Iterate over all the results of a search on a single field.  See iterate() for details.
+        """
+        wrap = "\"" if not fuzzy else ""
+        return cls.iterate(field + ":" + wrap + value + wrap, page_size=page_size, prefetch=prefetch)
+
+    @classmethod
+    def iterate(cls, query_string, page_size=None, prefetch=True):
+        """
+        Generator over all the results of a raw EPMC search query, using EPMC's cursorMark deep paging, so
+        that it is not limited in how far through the result set it can go.
+
+        :param query_string: the EPMC query
+        :param page_size: number of results to request from EPMC at a time
+        :param prefetch: if True, the next page is requested in a background thread while the
+            current one is being consumed
+        :return: generator of EPMCMetadata objects
+        """
+        if page_size is None:
+            page_size = app.config.get("EPMC_ITERATE_PAGE_SIZE", 100)
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            cursor = "*"
+            results, next_cursor = cls._cursor_page(query_string, cursor, page_size)
+            while len(results) > 0:
+                # EPMC signals the end of the result set by handing back the cursor we sent it
+                last = next_cursor is None or next_cursor == cursor
+                future = None
+                if not last and executor is not None:
+                    future = executor.submit(cls._cursor_page, query_string, next_cursor, page_size)
+
+                for r in results:
+                    yield models.EPMCMetadata(r)
+
+                if last:
+                    break
+                cursor = next_cursor
+                if future is not None:
+                    results, next_cursor = future.result()
+                else:
+                    results, next_cursor = cls._cursor_page(query_string, cursor, page_size)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    @classmethod
+    def _cursor_page(cls, query_string, cursor_mark, page_size):
+        quoted = quote(query_string, safe="/")
+        qcursor = quote(cursor_mark)
+        if quoted is None or qcursor is None:
+            raise EuropePMCException(None, "unable to url escape the string")
+
+        url = app.config.get("EPMC_REST_API") + "search/query=" + quoted
+        url += "&resultType=core&format=json&pageSize=" + quote(str(page_size)) + "&cursorMark=" + qcursor
+        j = cls._get_json(url)
+        return j.get("resultList", {}).get("result", []), j.get("nextCursorMark")
+
+    @classmethod
+    def batch_lookup(cls, field, values, normalise, extract, batch_size=None, workers=None):
+        """
+        Look up many identifiers of the same kind at once.
+
+        Identifiers are combined into OR queries of up to batch_size identifiers each, and these are run across a
+        pool of worker threads.  Any batch which EPMC fails to answer, and any identifier which cannot safely be
+        put into a combined query, is looked up on its own via field_search in the same pool.
+
+        :param field: the EPMC search field (e.g. DOI, PMCID, EXT_ID)
+        :param values: the identifiers to look up
+        :param normalise: function to normalise an identifier; identifiers it raises a ValueError for are skipped
+        :param extract: function to get the identifier back out of an EPMCMetadata result
+        :param batch_size: maximum number of identifiers to combine into a single query
+        :param workers: maximum number of concurrent requests to EPMC
+        :return: dict of normalised identifier to the list of EPMCMetadata records found for it (which may be empty)
+        """
+        if batch_size is None:
+            batch_size = app.config.get("EPMC_BATCH_SIZE", 50)
+        if workers is None:
+            workers = app.config.get("EPMC_BATCH_WORKERS", 4)
+
+        # normalise and de-duplicate the identifiers, preserving their order
+        results = {}
+        for v in values:
+            try:
+                n = normalise(v)
+            except (ValueError, AttributeError):
+                app.logger.info("Skipping unrecognised {f} identifier in EPMC batch lookup: {v}".format(f=field, v=v))
+                continue
+            results[n] = []
+
+        # identifiers which would break out of a quoted term have to go on their own
+        combinable = [n for n in results.keys() if "\"" not in n]
+        singles = [n for n in results.keys() if "\"" in n]
+        batches = [combinable[i:i + batch_size] for i in range(0, len(combinable), batch_size)]
+
+        def run_batch(batch):
+            q = " OR ".join([field + ":\"" + n + "\"" for n in batch])
+            return cls.query_all(q, page_size=batch_size)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(executor.submit(run_batch, b), b) for b in batches]
+            for f, batch in futures:
+                try:
+                    mds = f.result()
+                except EuropePMCException:
+                    app.logger.info("EPMC batch lookup on {f} failed, falling back to single lookups for {x} identifiers".format(f=field, x=len(batch)))
+                    singles += batch
+                    continue
+
+                for md in mds:
+                    ident = extract(md)
+                    if ident is None:
+                        continue
+                    try:
+                        n = normalise(ident)
+                    except ValueError:
+                        continue
+                    if n in results:
+                        results[n].append(md)
+
+            futures = [(executor.submit(cls.field_search, field, n), n) for n in singles]
+            for f, n in futures:
+                try:
+                    results[n] = f.result()
+                except EuropePMCException:
+                    # one identifier which can't be looked up shouldn't lose the results for all the others
+                    app.logger.info("EPMC lookup of {f} {n} failed, treating it as not found".format(f=field, n=n))
+                    results[n] = []
+
+        return results
+
+    @classmethod
+    def _get_json(cls, url):
         app.logger.debug("Requesting EPMC metadata from " + url)
 
         resp = http.get(url)
         if resp is None:
-            raise EuropePMCException(message="could not get a response from EPMC")
+            raise EuropePMCException(None, "could not get a response from EPMC")
         if resp.status_code != 200:
             raise EuropePMCException(resp)
 
         try:
-            j = resp.json()
+            return resp.json()
         except:
-            raise EuropePMCException(message="could not decode JSON from EPMC response")
-
-        results = [models.EPMCMetadata(r) for r in j.get("resultList", {}).get("result", [])]
-        return results
+            raise EuropePMCException(None, "could not decode JSON from EPMC response")
 
     @classmethod
-    def fulltext(cls, pmcid):
+    def fulltext(cls, pmcid, front_only=False):
+        """
+        Get the fulltext XML for the given PMCID.  If front_only is True, the response is streamed and only
+        parsed as far as the end of the front matter (see JATS.from_stream), and the rest is never downloaded
+        """
         url = app.config.get("EPMC_REST_API") + pmcid + "/fullTextXML"
         app.logger.debug("Searching for Fulltext at " + url)
-        resp = http.get(url)
+        resp = http.get(url, stream=front_only)
         if resp is None:
-            raise EuropePMCException(message="could not get a response for fulltext from EPMC")
+            raise EuropePMCException(None, "could not get a response for fulltext from EPMC")
         if resp.status_code != 200:
             raise EuropePMCException(resp)
+
+        if front_only:
+            try:
+                resp.raw.decode_content = True
+                return EPMCFullText.from_stream(resp.raw)
+            finally:
+                resp.close()
         return EPMCFullText(resp.text)
 
 class EPMCFullText(models.JATS):
@@ -0,0 +1,150 @@
+"""
+Batch extraction of metadata from JATS and RSC XML documents, spread across a pool of worker processes.
+
+    from octopus.modules.epmc import extract
+    for source, result in extract.extract_batch(paths):
+        if isinstance(result, extract.MetadataExtractionException):
+            ...
+
+"""
+from octopus.core import app
+from octopus.lib import cli
+from octopus.modules.epmc import models
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from io import BytesIO
+import argparse, json, os, sys
+
+# the RSC format has <art-front> where JATS has <front>, and it appears well before the body of the document
+RSC_MARKER = b"<art-front"
+SNIFF_SIZE = 65536
+
+
+class MetadataExtractionException(Exception):
+    pass
+
+
+def is_rsc(data):
+    return RSC_MARKER in data
+
+
+def extract(data, front_only=False):
+    """
+    Extract the metadata dict from the bytes of a JATS or RSC document
+
+    :param data: the raw document
+    :param front_only: for JATS documents, only parse as far as the end of the front matter
+    :return: dict of metadata, as per JATS.extract_all
+    """
+    if is_rsc(data):
+        return models.RSCMetadataXML(raw=data).extract_all()
+    if front_only:
+        return models.JATS.from_stream(BytesIO(data)).extract_all()
+    return models.JATS(raw=data).extract_all()
+
+
+def extract_file(path, front_only=False):
+    """
+    Extract the metadata dict from a JATS or RSC document on disk.  When front_only is set, JATS documents are
+    only read as far as the end of the front matter.
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+        if not is_rsc(head) and front_only:
+            f.seek(0)
+            return models.JATS.from_stream(f).extract_all()
+        return extract(head + f.read(), front_only)
+
+
+def _work(source, data, front_only):
+    # runs in the worker process.  Exceptions are flattened to strings, as the model exceptions do not survive
+    # being pickled back to the parent
+    try:
+        if data is None:
+            return extract_file(source, front_only), None
+        return extract(data, front_only), None
+    except Exception as e:
+        return None, "{t}: {m}".format(t=type(e).__name__, m=str(e))
+
+
+def _result(source, future):
+    metadata, error = future.result()
+    if error is not None:
+        return source, MetadataExtractionException(error)
+    return source, metadata
+
+
+def extract_batch(sources, workers=None, max_pending=None, front_only=False):
+    """
+    Extract metadata from each of the sources using a pool of worker processes, yielding (source, result) in the
+    order the sources were supplied, where result is the metadata dict or a MetadataExtractionException.
+
+    Paths are passed straight to the workers, which read the files themselves.  File-like objects cannot be
+    shared between processes, so they are read here and their bytes sent over.  At most max_pending documents
+    are in flight at once, so memory use is bounded however long the list of sources is.
+
+    :param sources: iterable of file paths or file-like objects
+    :param workers: number of worker processes (defaults to EPMC_EXTRACT_WORKERS, or the number of cpus)
+    :param max_pending: maximum number of documents submitted but not yet yielded (defaults to twice the workers)
+    :param front_only: for JATS documents, only parse as far as the end of the front matter
+    """
+    if workers is None:
+        workers = app.config.get("EPMC_EXTRACT_WORKERS") or os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = workers * 2
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for source in sources:
+            data = None
+            if hasattr(source, "read"):
+                data = source.read()
+            pending.append((source, executor.submit(_work, source, data, front_only)))
+
+            if len(pending) >= max_pending:
+                yield _result(*pending.popleft())
+
+        while len(pending) > 0:
+            yield _result(*pending.popleft())
+
+
+def list_sources(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".xml")]
+
+
+class ExtractMetadata(cli.Script):
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("paths", nargs="*", help="JATS or RSC xml files to extract metadata from")
+        parser.add_argument("-d", "--directory", help="directory of .xml files to extract metadata from")
+        parser.add_argument("-w", "--workers", type=int, help="number of worker processes")
+        parser.add_argument("-f", "--front", action="store_true", help="only read JATS documents as far as the end of the front matter")
+        parser.add_argument("-o", "--out", help="file to write the results to, one json object per line.  Defaults to stdout")
+        args = parser.parse_args(argv)
+
+        sources = list(args.paths)
+        if args.directory:
+            sources += list_sources(args.directory)
+
+        if len(sources) == 0:
+            print("Please specify some files or a directory to extract metadata from")
+            parser.print_help()
+            exit()
+
+        out = open(args.out, "w") if args.out else sys.stdout
+        errors = 0
+        try:
+            for source, result in extract_batch(sources, workers=args.workers, front_only=args.front):
+                if isinstance(result, MetadataExtractionException):
+                    errors += 1
+                    record = {"source" : source, "error" : str(result)}
+                else:
+                    record = {"source" : source, "metadata" : result}
+                out.write(json.dumps(record) + "\n")
+        finally:
+            if args.out:
+                out.close()
+
+        if errors > 0:
+            print("{x} of {y} documents could not be processed".format(x=errors, y=len(sources)), file=sys.stderr)
@@ -1,6 +1,7 @@
 from octopus.lib import dataobj
 from octopus.lib import xml as xutil
 from lxml import etree
+from io import BytesIO
 
 class JATSException(Exception):
     def __init__(self, message, rawstring, *args, **kwargs):
@@ -25,7 +26,8 @@ class EPMCMetadataXML(object):
         if raw is not None:
             self.raw = raw
             try:
-                self.xml = etree.fromstring(self.raw)
+                # blank text is kept, as in mixed content it is the space between words
+                self.xml = xutil.fromstring(self.raw, remove_blank_text=False)
             except:
                 raise JATSException("Unable to parse XML", self.raw)
         elif xml is not None:
@@ -133,7 +135,7 @@ class EPMCMetadataXML(object):
         <authorId type="ORCID">0000-0000-0000-0000</authorId>
         <affiliation>Biotechnology Department, National Physical Laboratory Teddington, UK.</affiliation>
         """
-        author_elements = self.xml.xpath("//authorList/author")
+        author_elements = xutil.xp(self.xml, "//authorList/author")
         obs = []
         for ael in author_elements:
             ao = {}
@@ -176,7 +178,7 @@ class EPMCMetadataXML(object):
 
     @property
     def grants(self):
-        grant_elements = self.xml.xpath("//grantsList/grant")
+        grant_elements = xutil.xp(self.xml, "//grantsList/grant")
         obs = []
         for ael in grant_elements:
             go = {}
@@ -261,15 +263,217 @@ class JATS(object):
                        "JUL", "AUG", "SEP", "OCT", "NOV", "DEC", "UNA"]
         self.raw = None
         self.xml = None
+        self._extracted = None
+        self._aff_index = None
+        self._aff_details = {}
         if raw is not None:
             self.raw = raw
             try:
-                self.xml = etree.fromstring(self.raw)
+                # blank text is kept, as in mixed content it is the space between words
+                self.xml = xutil.fromstring(self.raw, remove_blank_text=False)
             except:
                 raise JATSException("Unable to parse XML", self.raw)
         elif xml is not None:
             self.xml = xml
 
+    @classmethod
+    def from_stream(cls, source):
+        """
+        Construct the object by streaming the document from a filename or file-like object (such as
+        the handle returned by StoreLocal.get), parsing only as far as the end of the <front> element.
+
+        The body, back matter and floats are never read into memory, so this is much cheaper than
+        parsing the whole document for large full texts - but it also means that anything outside the
+        front matter (e.g. email addresses or licences given in the body) will not be found.
+        """
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        try:
+            root = xutil.parse_until(source, "front", remove_blank_text=False)
+        except (etree.XMLSyntaxError, ValueError, OSError) as e:
+            raise JATSException("Unable to parse XML: " + str(e), None)
+        if root is None:
+            raise JATSException("Unable to parse XML: no content", None)
+
+        # the parser works through the source in chunks, so may already have partially built whatever
+        # follows the front matter, which must not be mistaken for metadata
+        front = root.find("front")
+        if front is not None:
+            for el in list(front.itersiblings()):
+                root.remove(el)
+
+        return cls(xml=root)
+
+    def extract_all(self):
+        """
+        Extract all of the metadata from the document in a single walk over the tree, rather than one
+        scan per property.  The result is memoised, so subsequent calls are free.
+
+        The dict is keyed by the property names on this class, with the same values they would return
+        (so the fields shared with NotificationMetadata - title, journal, volume, issue, fpage, lpage,
+        publisher, publication_date, date_accepted, date_submitted - can be copied straight across), plus
+        "licence" holding the (type, url, paragraphs) tuple from get_licence_details()
+        """
+        if self._extracted is not None:
+            return self._extracted
+
+        ALI = "{http://www.niso.org/schemas/ali/1.0/}license_ref"
+        XLINK = "{http://www.w3.org/1999/xlink}href"
+
+        # the first element found at each of these positions, as for xp_first_text
+        first = {}
+        def take_first(key, el):
+            if key not in first:
+                first[key] = el
+
+        is_aam = False
+        licence_refs = []
+        licence_paras = []
+        categories = []
+        authors = []
+        contribs = []
+        emails = []
+        keywords = []
+        pub_dates = []
+        issns = []
+
+        # only the elements we are interested in are handed back to python by lxml
+        tags = ["volume", "issue", "fpage", "lpage", "pub-date", "article-id", "article-title", "journal-title",
+                "license", ALI, "license-p", "copyright-statement", "subject", "contrib", "email", "kwd",
+                "publisher-name", "date", "issn"]
+        for el in self.xml.iter(*tags):
+            tag = el.tag
+            parent = el.getparent()
+            ptag = parent.tag if parent is not None else None
+
+            if ptag == "article-meta":
+                if tag in ["volume", "issue", "fpage", "lpage"]:
+                    take_first(tag, el)
+                elif tag == "pub-date":
+                    pub_dates.append(el)
+                elif tag == "article-id":
+                    pit = el.get("pub-id-type")
+                    if pit in ["pmcid", "doi"]:
+                        take_first(pit, el)
+
+            if tag == "article-title":
+                if ptag == "title-group":
+                    take_first("title", el)
+            elif tag == "journal-title":
+                take_first("journal", el)
+            elif tag == "article-id":
+                if el.get("pub-id-type") == "manuscript":
+                    is_aam = True
+            elif tag == "license":
+                take_first("license", el)
+            elif tag == ALI:
+                if ptag == "license":
+                    licence_refs.append(el)
+            elif tag == "license-p":
+                if ptag == "license":
+                    licence_paras.append(el)
+            elif tag == "copyright-statement":
+                take_first("copyright_statement", el)
+            elif tag == "subject":
+                if ptag == "subj-group" and parent.getparent() is not None and parent.getparent().tag == "article-categories":
+                    categories.append(el)
+            elif tag == "contrib":
+                if ptag == "contrib-group":
+                    contribs.append(el)
+                    if el.get("contrib-type") == "author":
+                        authors.append(el)
+            elif tag == "email":
+                emails.append(el)
+            elif tag == "kwd":
+                if ptag == "kwd-group":
+                    keywords.append(el)
+            elif tag == "publisher-name":
+                if ptag == "publisher":
+                    take_first("publisher", el)
+            elif tag == "date":
+                if ptag == "history":
+                    dt = el.get("date-type")
+                    if dt in ["accepted", "received"]:
+                        take_first(dt, el)
+            elif tag == "issn":
+                if ptag == "journal-meta":
+                    issns.append(el)
+
+        def text(key):
+            el = first.get(key)
+            return el.text if el is not None else None
+
+        def string_value(key, default):
+            el = first.get(key)
+            if el is None:
+                return default
+            s = "".join(el.itertext())
+            return s if len(s) > 0 else default
+
+        def texts(els):
+            return [e.text for e in els if e.text is not None]
+
+        def make_date(key):
+            el = first.get(key)
+            return self._make_date(el) if el is not None else None
+
+        # the licence, as per get_licence_details
+        licence = (None, None, None)
+        l = first.get("license")
+        if l is not None:
+            url = l.get(XLINK)
+            if not url and len(licence_refs) > 0:
+                url = licence_refs[0].text
+            out = ""
+            for p in licence_paras:
+                out += etree.tostring(p).decode()
+            licence = (l.get("license-type"), url, out)
+
+        # the publication date, in the same order of preference as the publication_date property
+        publication_date = None
+        for attr, val in [("pub-type", "epub"), ("pub-type", "epub-ppub"), ("pub-type", "ppub"), ("date-type", "pub")]:
+            pds = [pd for pd in pub_dates if pd.get(attr) == val]
+            if len(pds) > 0:
+                publication_date = self._make_date(pds[0])
+                break
+        else:
+            if len(pub_dates) == 1:
+                publication_date = self._make_date(pub_dates[0])
+
+        # authors are a subset of the contributors, so each contributor only needs to be processed once
+        cons = {}
+        for c in contribs:
+            cons[c] = self._make_contrib(c)
+
+        pmcid = text("pmcid")
+        if pmcid is not None and not pmcid.startswith("PMC"):
+            pmcid = "PMC" + pmcid
+
+        self._extracted = {
+            "title" : string_value("title", "no title"),
+            "journal" : string_value("journal", "no journal title"),
+            "volume" : text("volume"),
+            "issue" : text("issue"),
+            "fpage" : text("fpage"),
+            "lpage" : text("lpage"),
+            "is_aam" : is_aam,
+            "licence" : licence,
+            "copyright_statement" : text("copyright_statement"),
+            "categories" : texts(categories),
+            "authors" : [dict(cons[c]) for c in authors if len(cons[c]) > 0],
+            "contribs" : [cons[c] for c in contribs if len(cons[c]) > 0],
+            "emails" : texts(emails),
+            "keywords" : texts(keywords),
+            "publisher" : text("publisher"),
+            "publication_date" : publication_date,
+            "date_accepted" : make_date("accepted"),
+            "date_submitted" : make_date("received"),
+            "issn" : texts(issns),
+            "pmcid" : pmcid,
+            "doi" : text("doi")
+        }
+        return self._extracted
+
     @property
     def title(self):
         # 2018-01-31 TD : adding the default value "no title"
@@ -300,12 +504,12 @@ class JATS(object):
 
     @property
     def is_aam(self):
-        manuscripts = self.xml.xpath("//article-id[@pub-id-type='manuscript']")
+        manuscripts = xutil.xp(self.xml, "//article-id[@pub-id-type='manuscript']")
         return len(manuscripts) > 0
 
     def get_licence_details(self):
         # get the licence type
-        l = self.xml.xpath("//license")
+        l = xutil.xp(self.xml, "//license")
         if len(l) > 0:
             l = l[0]
         else:
@@ -314,11 +518,11 @@ class JATS(object):
         url = l.get("{http://www.w3.org/1999/xlink}href")
         # get license href for bmj
         if not url:
-            url_data = self.xml.xpath("//license/ali:license_ref",namespaces={'ali':'http://www.niso.org/schemas/ali/1.0/'})
+            url_data = xutil.xp(self.xml, "//license/ali:license_ref",namespaces={'ali':'http://www.niso.org/schemas/ali/1.0/'})
             if len(url_data) > 0:
                 url = url_data[0].text
         # get the paragraph(s) describing the licence
-        para = self.xml.xpath("//license/license-p")
+        para = xutil.xp(self.xml, "//license/license-p")
         out = ""
         for p in para:
             out += etree.tostring(p).decode()
@@ -335,12 +539,12 @@ class JATS(object):
 
     @property
     def authors(self):
-        aels = self.xml.xpath("//contrib-group/contrib[@contrib-type='author']")
+        aels = xutil.xp(self.xml, "//contrib-group/contrib[@contrib-type='author']")
         return self._make_contribs(aels)
 
     @property
     def contribs(self):
-        cs = self.xml.xpath("//contrib-group/contrib")
+        cs = xutil.xp(self.xml, "//contrib-group/contrib")
         return self._make_contribs(cs)
 
     @property
@@ -360,24 +564,24 @@ class JATS(object):
         # first look for an explicit publication date
         # 2016-10-17 TD : additionally, use @pub-type attribute:
         #                 look first for epub, second for epub-ppub, third ppub
-        pds = self.xml.xpath("//article-meta/pub-date[@pub-type='epub']")
+        pds = xutil.xp(self.xml, "//article-meta/pub-date[@pub-type='epub']")
         if len(pds) > 0:
             return self._make_date(pds[0])
-        pds = self.xml.xpath("//article-meta/pub-date[@pub-type='epub-ppub']")
+        pds = xutil.xp(self.xml, "//article-meta/pub-date[@pub-type='epub-ppub']")
         if len(pds) > 0:
             return self._make_date(pds[0])
-        pds = self.xml.xpath("//article-meta/pub-date[@pub-type='ppub']")
+        pds = xutil.xp(self.xml, "//article-meta/pub-date[@pub-type='ppub']")
         if len(pds) > 0:
             return self._make_date(pds[0])
         # 2016-10-17 TD
         # note: @date-type attrib seems to be marked as deprecated... but, so what? 
 
-        pds = self.xml.xpath("//article-meta/pub-date[@date-type='pub']")
+        pds = xutil.xp(self.xml, "//article-meta/pub-date[@date-type='pub']")
         if len(pds) > 0:
             return self._make_date(pds[0])
 
         # if not, look for exactly one pub-date and use that
-        pds = self.xml.xpath("//article-meta/pub-date")
+        pds = xutil.xp(self.xml, "//article-meta/pub-date")
         if len(pds) == 1:
             return self._make_date(pds[0])
 
@@ -386,13 +590,13 @@ class JATS(object):
 
     @property
     def date_accepted(self):
-        das = self.xml.xpath("//history/date[@date-type='accepted']")
+        das = xutil.xp(self.xml, "//history/date[@date-type='accepted']")
         if len(das) > 0:
             return self._make_date(das[0])
 
     @property
     def date_submitted(self):
-        rcs = self.xml.xpath("//history/date[@date-type='received']")
+        rcs = xutil.xp(self.xml, "//history/date[@date-type='received']")
         if len(rcs) > 0:
             return self._make_date(rcs[0])
 
@@ -432,82 +636,116 @@ class JATS(object):
 
     def _make_contribs(self, elements):
         obs = []
-
         for c in elements:
-            con = {}
-
-            # first see if there is a name we can pull out
-            name = c.find("name")
-            if name is not None:
-                sn = name.find("surname")
-                # 2017-06-07 TD : catch if element tag is really empty!
-                if sn is not None and sn.text is not None:
-                    con["surname"] = sn.text
-
-                gn = name.find("given-names")
-                # 2017-06-07 TD : catch if element tag is really empty!
-                if gn is not None and gn.text is not None:
-                    con["given-names"] = gn.text
+            con = self._make_contrib(c)
+            if len(list(con.keys())) > 0:
+                obs.append(con)
+        return obs
 
-            # 2018-10-17 TD : add the contrib-id with @contrib-id-type="orcid"
-            # see if there's an ORCID
-            orcid = c.find("contrib-id[@contrib-id-type='orcid']")
-            if orcid is not None and orcid.text is not None:
-                con["orcid"] = orcid.text
+    def _make_contrib(self, c):
+        con = {}
 
-            # see if there's an email address
-            email = c.find("email")
+        # first see if there is a name we can pull out
+        name = c.find("name")
+        if name is not None:
+            sn = name.find("surname")
             # 2017-06-07 TD : catch if element tag is really empty!
-            if email is not None and email.text is not None:
-                con["email"] = email.text
-
-            # now do the affiliations 
-            # 2024-09-30 FG: refactoring, affiliation elements are now found via a separate function,
-            # then extracting for each an affiliation string and identifiers.
-            affs = []
-            for ae in self._find_affiliations(c):
-
-                normalized_affiliation_string = " ".join(_create_aff_string(ae).split())
-                affs.append(normalized_affiliation_string)
-
-                # affiliation ids
-                aff_ids = ae.findall("institution-wrap/institution-id")
-                for aff_id in aff_ids:
-                    if aff_id.get("institution-id-type") and aff_id.get("institution-id-type").lower() == "ringgold":
-                        if aff_id.text:
-                            val = con.get("ringgold", [])
-                            val.append(aff_id.text)
-                            con["ringgold"] = val
-                    elif aff_id.get("institution-id-type") and aff_id.get("institution-id-type").lower() == "ror":
-                        if aff_id.text:
-                            txt = aff_id.text.lower().strip("https://ror.org/")
-                            val = con.get("ror", [])
-                            val.append(txt)
-                            con["ror"] = val
-                # affiliation ids for BMJ
-                aff_ids = ae.findall("institution")
-                for aff_id in aff_ids:
-                    r_id = aff_id.get("specific-use")
-                    if r_id is not None and r_id != "":
-                        r_id = r_id.lower()
-                        if r_id.startswith("ringgold_"):
-                            val = con.get("ringgold", [])
-                            val.append(r_id.strip("ringgold_"))
-                            con["ringgold"] = val
-                        elif r_id.startswith("ror_"):
-                            val = con.get("ror", [])
-                            val.append(r_id.strip("ror_"))
-                            con["ror"] = val
-
-            if len(affs) > 0:
-                con["affiliations"] = affs
-            if len(list(con.keys())) > 0:
-                obs.append(con)
+            if sn is not None and sn.text is not None:
+                con["surname"] = sn.text
 
-        return obs
+            gn = name.find("given-names")
+            # 2017-06-07 TD : catch if element tag is really empty!
+            if gn is not None and gn.text is not None:
+                con["given-names"] = gn.text
+
+        # 2018-10-17 TD : add the contrib-id with @contrib-id-type="orcid"
+        # see if there's an ORCID
+        orcid = c.find("contrib-id[@contrib-id-type='orcid']")
+        if orcid is not None and orcid.text is not None:
+            con["orcid"] = orcid.text
+
+        # see if there's an email address
+        email = c.find("email")
+        # 2017-06-07 TD : catch if element tag is really empty!
+        if email is not None and email.text is not None:
+            con["email"] = email.text
+
+        # now do the affiliations 
+        # 2024-09-30 FG: refactoring, affiliation elements are now found via a separate function,
+        # then extracting for each an affiliation string and identifiers.
+        affs = []
+        for ae in self._find_affiliations(c):
+            aff_string, ringgold, ror = self._affiliation_details(ae)
+            affs.append(aff_string)
+            if len(ringgold) > 0:
+                con["ringgold"] = con.get("ringgold", []) + ringgold
+            if len(ror) > 0:
+                con["ror"] = con.get("ror", []) + ror
+
+        if len(affs) > 0:
+            con["affiliations"] = affs
+
+        return con
+
+    def _affiliation_index(self):
+        """
+        index of the aff elements in the document, built on first use: a dict of id to the aff elements
+        with that id, the list of aff elements with no id, and the list of all aff elements
+        """
+        if self._aff_index is None:
+            by_id = {}
+            no_id = []
+            all_affs = []
+            for aff_el in self.xml.iter("aff"):
+                all_affs.append(aff_el)
+                aid = aff_el.get("id")
+                if aid is None:
+                    no_id.append(aff_el)
+                else:
+                    by_id.setdefault(aid, []).append(aff_el)
+            self._aff_index = (by_id, no_id, all_affs)
+        return self._aff_index
+
+    def _affiliation_details(self, aff_element):
+        """
+        the normalised affiliation string, and the ringgold and ror ids, for an aff element.  These are
+        computed once per element, however many contributors reference it.
+        """
+        details = self._aff_details.get(aff_element)
+        if details is not None:
+            return details
+
+        normalized_affiliation_string = " ".join(_create_aff_string(aff_element).split())
+        ringgold = []
+        ror = []
+
+        # affiliation ids
+        aff_ids = aff_element.findall("institution-wrap/institution-id")
+        for aff_id in aff_ids:
+            if aff_id.get("institution-id-type") and aff_id.get("institution-id-type").lower() == "ringgold":
+                if aff_id.text:
+                    ringgold.append(aff_id.text)
+            elif aff_id.get("institution-id-type") and aff_id.get("institution-id-type").lower() == "ror":
+                if aff_id.text:
+                    ror.append(aff_id.text.lower().strip("https://ror.org/"))
+        # affiliation ids for BMJ
+        aff_ids = aff_element.findall("institution")
+        for aff_id in aff_ids:
+            r_id = aff_id.get("specific-use")
+            if r_id is not None and r_id != "":
+                r_id = r_id.lower()
+                if r_id.startswith("ringgold_"):
+                    ringgold.append(r_id.strip("ringgold_"))
+                elif r_id.startswith("ror_"):
+                    ror.append(r_id.strip("ror_"))
+
+        details = (normalized_affiliation_string, ringgold, ror)
+        self._aff_details[aff_element] = details
+        return details
 
     def _find_affiliations(self, contrib):
         """returns all affiliation elements associated with a specific contributor. avoids duplicate affiliation extraction."""
+        by_id, no_id, all_affs = self._affiliation_index()
         aff_elements = []
         # if "aff" is a descendant of contrib
         for aff_el in contrib.findall('aff'):
@@ -515,22 +753,21 @@ class JATS(object):
 
         # if "aff" is somewhere else in document
         # link 1: linked through xref element
-        for rid in contrib.xpath('xref[@ref-type="aff"]/@rid'):
-            for aff_el in self.xml.xpath("//aff[@id='" + rid + "']"):
-                aff_elements.append(aff_el)
+        for rid in xutil.xp(contrib, 'xref[@ref-type="aff"]/@rid'):
+            aff_elements += by_id.get(rid, [])
 
         # link 2: linked via @rid attribute on contrib itself
         for rid in contrib.get("rid", "").split():
-            for aff_el in self.xml.xpath("//aff[@id='" + rid + "']"):
-                aff_elements.append(aff_el)
+            aff_elements += by_id.get(rid, [])
 
+        seen = set(aff_elements)
 
         # lastly: affs not directly related to contrib.
         # "global" aff elements that have no identifier
-        xp = "//aff[not(@id)]" 
-        for aff_el in self.xml.xpath(xp):
-            if aff_el not in aff_elements:
+        for aff_el in no_id:
+            if aff_el not in seen:
                 aff_elements.append(aff_el)
+                seen.add(aff_el)
                 
         # or, if no affiliation at all has been found, take every aff element you can find
         # - as long as the whole file contains three or less affiliations. 
@@ -538,11 +775,8 @@ class JATS(object):
         # when there is only one affiliation and the connection b/w author and affiliation is obvious to the reader.
         # (the limit is a safeguard for articles with many affiliations, where one contributor may genuinely not have an affiliation.)
         if len(aff_elements) == 0:
-            all_affiliations = self.xml.xpath("//aff")
-            if len(all_affiliations) < 4:
-                for aff_el in all_affiliations:
-                    if aff_el not in aff_elements:
-                        aff_elements.append(aff_el)
+            if len(all_affs) < 4:
+                aff_elements += all_affs
         return aff_elements
 
     def tostring(self):
@@ -564,6 +798,7 @@ class RSCMetadataXML(object):
                        "JUL", "AUG", "SEP", "OCT", "NOV", "DEC", "UNA"]
         self.raw = None
         self.xml = None
+        self._extracted = None
         if raw is not None:
             self.raw = raw
             try:
@@ -577,6 +812,40 @@ class RSCMetadataXML(object):
         elif xml is not None:
             self.xml = xml
 
+    def extract_all(self):
+        """
+        Extract all of the metadata into a dict keyed by property name, as per JATS.extract_all.  The result
+        is memoised, so subsequent calls are free.
+        """
+        if self._extracted is not None:
+            return self._extracted
+
+        self._extracted = {
+            "title" : self.title,
+            "journal" : self.journal,
+            "volume" : self.volume,
+            "issue" : self.issue,
+            "fpage" : self.fpage,
+            "lpage" : self.lpage,
+            "is_aam" : self.is_aam,
+            "licence" : self.get_licence_details(),
+            "copyright_statement" : self.copyright_statement,
+            "categories" : self.categories,
+            "authors" : self.authors,
+            "contribs" : self.contribs,
+            "emails" : self.emails,
+            "keywords" : self.keywords,
+            "publisher" : self.publisher,
+            "publication_date" : self.publication_date,
+            "date_accepted" : self.date_accepted,
+            "date_revised" : self.date_revised,
+            "date_submitted" : self.date_submitted,
+            "issn" : self.issn,
+            "pmcid" : self.pmcid,
+            "doi" : self.doi
+        }
+        return self._extracted
+
     @property
     def title(self):
         # 2018-01-31 TD : adding the default value "no title"
@@ -609,7 +878,7 @@ class RSCMetadataXML(object):
     def is_aam(self):
         # 2016-11-29 TD : FIXME: check if this correctly identifies an 
         #                 "author accepted manuscript"
-        manuscripts = self.xml.xpath("//art-admin/date[@role='accepted']")
+        manuscripts = xutil.xp(self.xml, "//art-admin/date[@role='accepted']")
         return len(manuscripts) <= 0
 
     def get_licence_details(self):
@@ -642,12 +911,12 @@ class RSCMetadataXML(object):
 
     @property
     def authors(self):
-        aels = self.xml.xpath("//art-front/authgrp/author/person")
+        aels = xutil.xp(self.xml, "//art-front/authgrp/author/person")
         return self._make_contribs(aels)
 
     @property
     def contribs(self):
-        cs = self.xml.xpath("//art-front/authgrp/author/person")
+        cs = xutil.xp(self.xml, "//art-front/authgrp/author/person")
         return self._make_contribs(cs)
 
     @property
@@ -667,21 +936,21 @@ class RSCMetadataXML(object):
         # first look for an explicit publication date
         # 2016-11-28 TD : additionally, use @type attribute:
         #                 look first for web, second for print (and third, subsyear ?!)
-        pds = self.xml.xpath("//published[@type='web']/pubfront/date")
+        pds = xutil.xp(self.xml, "//published[@type='web']/pubfront/date")
         if len(pds) > 0:
             return self._make_date(pds[0])
-        pds = self.xml.xpath("//published[@type='print']/pubfront/date")
+        pds = xutil.xp(self.xml, "//published[@type='print']/pubfront/date")
         if len(pds) > 0:
             return self._make_date(pds[0])
         # 2016-11-28 TD
         # note: @type='subsyear' attrib seems to be obscure... but, so what? 
 
-        pds = self.xml.xpath("//published[@type='subsyear']/pubfront/date")
+        pds = xutil.xp(self.xml, "//published[@type='subsyear']/pubfront/date")
         if len(pds) > 0:
             return self._make_date(pds[0])
 
         # if not, look for any pub-date and use the first of it
-        pds = self.xml.xpath("//published/pubfront/date")
+        pds = xutil.xp(self.xml, "//published/pubfront/date")
         if len(pds) > 0:
             return self._make_date(pds[0])
 
@@ -690,19 +959,19 @@ class RSCMetadataXML(object):
 
     @property
     def date_accepted(self):
-        das = self.xml.xpath("//art-admin/date[@role='accepted']")
+        das = xutil.xp(self.xml, "//art-admin/date[@role='accepted']")
         if len(das) > 0:
             return self._make_date(das[0])
 
     @property
     def date_revised(self):
-        drs = self.xml.xpath("//art-admin/date[@role='revised']")
+        drs = xutil.xp(self.xml, "//art-admin/date[@role='revised']")
         if len(drs) > 0:
             return self._make_date(drs[0])
 
     @property
     def date_submitted(self):
-        rcs = self.xml.xpath("//art-admin/received/date")
+        rcs = xutil.xp(self.xml, "//art-admin/received/date")
         if len(rcs) > 0:
             return self._make_date(rcs[0])
 
@@ -786,11 +1055,10 @@ class RSCMetadataXML(object):
             arefs = c.getparent().get("aff")
             if arefs is not None:
                 for affid in arefs.split():
-                    xp = "//aff[@id='" + affid + "']"
-                    aff_elements = self.xml.xpath(xp)
+                    aff_elements = xutil.xp(self.xml, "//aff[@id=$affid]", affid=affid)
                     for ae in aff_elements:
-                        org = ae.xpath("org//text()")
-                        adr = ae.xpath("address//text()")
+                        org = xutil.xp(ae, "org//text()")
+                        adr = xutil.xp(ae, "address//text()")
                         norm = ", ".join(org+adr)
                         affs.append(norm)
 
@@ -1,2 +1,14 @@
 
-EPMC_REST_API = "http://www.ebi.ac.uk/europepmc/webservices/rest/"
\ No newline at end of file
+EPMC_REST_API = "http://www.ebi.ac.uk/europepmc/webservices/rest/"
+
+# maximum number of identifiers to combine into a single OR query in the batch lookups (get_by_dois, etc)
+EPMC_BATCH_SIZE = 50
+
+# maximum number of concurrent requests to make to EPMC in the batch lookups
+EPMC_BATCH_WORKERS = 4
+
+# number of results to request from EPMC at a time when iterating over a result set (EuropePMC.iterate)
+EPMC_ITERATE_PAGE_SIZE = 100
+
+# number of worker processes to use for batch metadata extraction (extract.extract_batch).  None uses one per cpu
+EPMC_EXTRACT_WORKERS = None
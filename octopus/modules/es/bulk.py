@@ -0,0 +1,134 @@
+"""
+Helpers for sending documents to the Elasticsearch _bulk endpoint, which know nothing about the connection so that
+ESDAO.bulk_save (and anything else) can supply the transport.
+"""
+from datetime import datetime
+import json, time
+
+# per-item statuses which mean the item may succeed if we try again
+RETRY_STATUSES = [429, 502, 503, 504]
+
+
+def index_lines(id, data):
+    """
+    The two NDJSON lines (action and source) which index the document with the given id, as bytes
+    """
+    action = json.dumps({"index" : {"_id" : id}})
+    source = json.dumps(data)
+    return (action + "\n" + source + "\n").encode("utf-8")
+
+
+def delete_lines(id):
+    """
+    The NDJSON action line which deletes the document with the given id, as bytes
+    """
+    return (json.dumps({"delete" : {"_id" : id}}) + "\n").encode("utf-8")
+
+
+def chunk(entries, chunk_size, max_bytes=None):
+    """
+    Group (id, lines) entries into lists of at most chunk_size entries, and at most max_bytes of lines (unless a
+    single entry is bigger than that on its own).  Entries are only drawn from the iterable as each chunk is needed.
+    """
+    current = []
+    size = 0
+    for id, lines in entries:
+        if len(current) > 0 and (len(current) >= chunk_size or (max_bytes is not None and size + len(lines) > max_bytes)):
+            yield current
+            current = []
+            size = 0
+        current.append((id, lines))
+        size += len(lines)
+    if len(current) > 0:
+        yield current
+
+
+def item_results(resp):
+    """
+    Turn a _bulk response into a list of (id, status, error) in the order of the request.  error is None for
+    items that succeeded
+    """
+    results = []
+    for item in resp.get("items", []):
+        # each item is keyed by its action type ("index", "create", ...)
+        action = list(item.values())[0]
+        error = action.get("error")
+        if isinstance(error, dict):
+            error = "{t}: {r}".format(t=error.get("type"), r=error.get("reason"))
+        results.append((action.get("_id"), action.get("status"), error))
+    return results
+
+
+def send_chunk(send, entries, retries=0, back_off_factor=1, max_back_off=30):
+    """
+    Send one chunk of entries to the _bulk endpoint, retrying only the items which failed with a retryable status
+    (or all of them, if the whole request failed that way).
+
+    :param send: function which takes the request body as bytes and returns (http status, decoded json response)
+    :param entries: list of (id, lines)
+    :return: list of result dicts {"id", "status", "error"} in the order of the entries
+    """
+    results = [None] * len(entries)
+    todo = list(range(len(entries)))
+    attempt = 0
+    while True:
+        body = b"".join([entries[i][1] for i in todo])
+        status, resp = send(body)
+
+        retry = []
+        if status in RETRY_STATUSES or resp is None or "items" not in resp:
+            # the request as a whole failed
+            error = None
+            if isinstance(resp, dict) and resp.get("error") is not None:
+                error = str(resp.get("error"))
+            for i in todo:
+                results[i] = {"id" : entries[i][0], "status" : status, "error" : error or "bulk request failed with status {x}".format(x=status)}
+            if status in RETRY_STATUSES:
+                retry = todo
+        else:
+            for i, (id, istatus, error) in zip(todo, item_results(resp)):
+                results[i] = {"id" : entries[i][0], "status" : istatus, "error" : error}
+                if error is not None and istatus in RETRY_STATUSES:
+                    retry.append(i)
+
+        if len(retry) == 0 or attempt >= retries:
+            return results
+
+        attempt += 1
+        time.sleep(min(back_off_factor * (2 ** (attempt - 1)), max_back_off))
+        todo = retry
+
+
+def save_entries(objects, now=None):
+    """
+    (id, lines) entries which index the DAO objects, drawn from the iterable as they are needed.  Each object is
+    prep()ed and given an id and created/updated dates as its save() would.
+
+    :param now: the timestamp to stamp the objects with (defaults to the time of the first one)
+    """
+    for obj in objects:
+        if now is None:
+            now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        obj.prep()
+        if obj.data.get("id") is None:
+            obj.data["id"] = obj.makeid()
+        obj.data["last_updated"] = now
+        if "created_date" not in obj.data:
+            obj.data["created_date"] = now
+        yield obj.data["id"], index_lines(obj.data["id"], obj.data)
+
+
+def send_all(entries, send_to, write_type, chunk_size, max_bytes=None, retries=0):
+    """
+    Send (id, lines) entries in chunks (see chunk), each to the type named by write_type at the time it is sent, so
+    that a long run of chunks follows a rolling or time boxed type onto its next type.
+
+    :param send_to: function which takes a type name, and returns the send function for send_chunk which posts to
+        that type's _bulk endpoint
+    :param write_type: function of no arguments which returns the type to send the next chunk to
+    :return: list of the results of send_chunk for every entry, in order
+    """
+    results = []
+    for entries_chunk in chunk(entries, chunk_size, max_bytes):
+        results += send_chunk(send_to(write_type()), entries_chunk, retries=retries)
+    return results
@@ -0,0 +1,158 @@
+"""
+An in-process cache of values computed from the index (e.g. facet counts and query results), which expire after a
+time to live, can be invalidated a type at a time when the type is written to, and are evicted least recently used
+first once there are too many.
+
+Invalidation only reaches the cache in the process which made the write; in other processes, entries last until
+they expire, so the time to live is the bound on how stale a value can be.
+
+The index only makes a write searchable once it next refreshes, so a value computed just after a write may not
+include it.  Invalidating with settle stops values being stored for that long after the write.
+"""
+from collections import OrderedDict
+import hashlib, json, threading, time
+
+# the generation of a namespace which is settling, which no value can be stored against
+UNSETTLED = -1
+
+def canonical_hash(obj):
+    """
+    A hash of a json-like object which is the same for equal objects, whatever order their keys are in
+    """
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class TTLCache(object):
+    """
+    Values held against (namespace, key), where the namespace is usually the type the value was computed from.
+
+    Invalidating a namespace drops its entries and moves its generation on, so that a value which was being
+    computed while the namespace was invalidated is not stored when it arrives.  Nor is a value computed while the
+    namespace is settling after an invalidation.
+
+    :param max_size: most entries to hold; beyond that, the least recently used are evicted.  None for no limit
+    """
+    def __init__(self, max_size=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._generations = {}
+        self._settling = {}
+        self._stats = {}
+
+    def get(self, namespace, key):
+        """
+        The value held, or None if there isn't one (or it has expired)
+        """
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is not None and self.clock() >= entry[0]:
+                del self._data[(namespace, key)]
+                entry = None
+            if entry is None:
+                self._count(namespace, "misses")
+                return None
+            self._data.move_to_end((namespace, key))
+            self._count(namespace, "hits")
+            return entry[1]
+
+    def generation(self, namespace):
+        """
+        The namespace's generation, to give to set with a value computed after asking for it.  While the namespace
+        is settling, this is UNSETTLED, which never matches, so the value is not stored
+        """
+        with self._lock:
+            if self._settled(namespace) is False:
+                return UNSETTLED
+            return self._generations.get(namespace, 0)
+
+    def set(self, namespace, key, value, ttl, generation=None):
+        """
+        Hold the value for ttl seconds.  If generation is given and the namespace has been invalidated since it was
+        read, the value is not stored
+        """
+        if ttl is None or ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(namespace, 0):
+                return
+            if self._settled(namespace) is False:
+                return
+            self._data[(namespace, key)] = (self.clock() + ttl, value)
+            self._data.move_to_end((namespace, key))
+            while self.max_size is not None and len(self._data) > self.max_size:
+                evicted = self._data.popitem(last=False)
+                self._count(evicted[0][0], "evictions")
+
+    def get_or_compute(self, namespace, key, compute, ttl):
+        """
+        The value held, or the result of compute(), which is then held for ttl seconds
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+        generation = self.generation(namespace)
+        value = compute()
+        self.set(namespace, key, value, ttl, generation=generation)
+        return value
+
+    def invalidate(self, namespace=None, settle=0):
+        """
+        Drop everything held for the namespace, or everything at all if no namespace is given
+
+        :param settle: seconds after this during which values computed for the namespace are not stored
+        """
+        with self._lock:
+            if settle > 0:
+                self._settling[namespace] = max(self._settling.get(namespace, 0), self.clock() + settle)
+            if namespace is None:
+                self._data = OrderedDict()
+                for ns in list(self._generations.keys()):
+                    self._generations[ns] += 1
+                return
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self._count(namespace, "invalidations")
+            for k in [k for k in self._data.keys() if k[0] == namespace]:
+                del self._data[k]
+
+    def stats(self, namespace=None):
+        """
+        Counts of hits, misses, evictions and invalidations, and the number of entries held, for the namespace or
+        (if none is given) for all of them together
+        """
+        with self._lock:
+            if namespace is not None:
+                counts = dict(self._stats.get(namespace, {}))
+                counts["size"] = len([k for k in self._data.keys() if k[0] == namespace])
+            else:
+                counts = {}
+                for c in self._stats.values():
+                    for k, v in c.items():
+                        counts[k] = counts.get(k, 0) + v
+                counts["size"] = len(self._data)
+        for k in ["hits", "misses", "evictions", "invalidations"]:
+            counts.setdefault(k, 0)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = counts["hits"] / lookups if lookups > 0 else 0
+        return counts
+
+    def _settled(self, namespace):
+        # settling invalidations of everything are held against None
+        now = self.clock()
+        for ns in [namespace, None]:
+            until = self._settling.get(ns)
+            if until is not None:
+                if now < until:
+                    return False
+                del self._settling[ns]
+        return True
+
+    def _count(self, namespace, stat):
+        c = self._stats.setdefault(namespace, {})
+        c[stat] = c.get(stat, 0) + 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -3,16 +3,41 @@ from esprit import mappings
 from octopus.core import app
 import json as jsonlib
 from datetime import datetime
-import dateutil.relativedelta as relativedelta
-import os, threading
+import os, threading, time
 from octopus.lib import plugin
 from octopus.modules.es.initialise import put_mappings, put_example
+from octopus.modules.es import bulk, facets, mget, paging, timebox
+from octopus.modules.es.cache import TTLCache, canonical_hash
+from octopus.modules.es import reindex as reindexing
+from octopus.modules.es.reindex import ReindexException, ReindexProgress, CaptureLog
+from octopus.modules.es.pointers import RollingPointers
+from contextlib import contextmanager
+from copy import deepcopy
+
+# NOTE: requests which esprit has no public call for (_bulk, _mget, _count, _refresh, _mapping, clearing a scroll,
+# etc) are made with its private esprit.raw._do_post, _do_get and _do_delete, so will need revisiting if it changes them
+
+class ESDAOException(Exception):
+    pass
+
+class ScrollException(ESDAOException):
+    pass
 
 class ESDAO(esprit.dao.DomainObject):
     __type__ = 'index'
     __conn__ = esprit.raw.Connection(app.config.get('ELASTIC_SEARCH_HOST'), app.config.get('ELASTIC_SEARCH_INDEX'), index_per_type=app.config['ELASTIC_INDEX_PER_TYPE'])
     __es_version__ = app.config.get("ELASTIC_SEARCH_VERSION")
 
+    # seconds to cache facet values for this class.  None uses ESDAO_FACET_CACHE_TTL
+    __facet_cache_ttl__ = None
+
+    # seconds to cache query results for this class.  None uses ESDAO_QUERY_CACHE_TTL
+    __query_cache_ttl__ = None
+
+    # facet values and query results, shared by all classes and held against their type
+    _facet_cache = TTLCache()
+    _query_cache = TTLCache(max_size=app.config.get("ESDAO_QUERY_CACHE_SIZE", 1000))
+
     #####################################################
     ## overrides on Domain Object
 
@@ -21,38 +46,365 @@ class ESDAO(esprit.dao.DomainObject):
         esv = cls.__es_version__
         if esv is None:
             esv = es_version
-        super(ESDAO, cls).delete_by_query(conn, cls.__type__, query, es_version=esv)
+        super(ESDAO, cls).delete_by_query(conn, type if type is not None else cls.__type__, query, es_version=esv)
+        cls.invalidate_caches()
 
     def save(self, **kwargs):
         self.prep()
         super(ESDAO, self).save(**kwargs)
+        self.invalidate_caches()
+        self._remember(self.id, deepcopy(self.data))
+
+    def delete(self, **kwargs):
+        super(ESDAO, self).delete(**kwargs)
+        self.invalidate_caches()
+        self._remember(self.id, None)
 
     @classmethod
-    def get_all_facet_values(cls, facet, query_filter=None):
-        query = {
-            "query": {
-                "match_all": {}
-            },
-            "aggs": {
-                "facets": {
-                    "terms": {
-                        "field": facet
-                    }
-                }
-            },
-            "size": 0
-        }
-        if query_filter:
-            query["query"] = query_filter
-        res = cls.query(q=query)
-        facets = {}
-        if res.get('hits', {}).get('total', {}).get('value', 0) > 0:
-            for bucket in res.get('aggregations', {}).get('facets', {}).get('buckets', []):
-                key = bucket.get('key', None)
-                count = bucket.get('doc_count', None)
-                if key and count > 0:
-                    facets[key] = count
-        return facets
+    def invalidate_caches(cls):
+        """
+        Drop anything cached from this class's type, in this process (and this request's identity map).  Until the
+        write has had time to become searchable (ESDAO_REFRESH_INTERVAL), query and facet results are not cached
+        """
+        settle = app.config.get("ESDAO_REFRESH_INTERVAL", 1)
+        cls._facet_cache.invalidate(cls.__type__, settle=settle)
+        cls._query_cache.invalidate(cls.__type__, settle=settle)
+        imap = cls._identity_map()
+        if imap is not None:
+            imap.drop(cls.__type__)
+
+    @classmethod
+    def pull(cls, id_, wrap=True, **kwargs):
+        """
+        As the esprit pull, but within a Flask request the record is remembered, so pulling it again (or saving it
+        and then pulling it) doesn't go back to the index
+        """
+        # only pulls from the default connection and types go through the identity map
+        imap = cls._identity_map() if len(kwargs) == 0 else None
+        if imap is not None:
+            held, raw = imap.get(cls.__type__, id_)
+            if held:
+                return cls._wrap_copy(raw, wrap)
+
+        raw = super(ESDAO, cls).pull(id_, wrap=False, **kwargs)
+        if imap is not None:
+            imap.put(cls.__type__, id_, deepcopy(raw))
+        return cls._wrap_copy(raw, wrap, copy=False)
+
+    @classmethod
+    def pull_many(cls, ids, wrap=True, fields=None, chunk_size=None, conn=None, types=None):
+        """
+        Get many records by id, in as few requests as possible: an _mget (or, if the class reads from several types,
+        a search by id) for each chunk_size of them.  Records already pulled within this Flask request come from
+        memory.
+
+        :param ids: list of ids
+        :param fields: only get these fields of each record's source
+        :param chunk_size: most ids to ask for in one request (defaults to ESDAO_MGET_CHUNK_SIZE)
+        :return: list of records in the order of the ids, with None for any which don't exist
+        """
+        if chunk_size is None:
+            chunk_size = app.config.get("ESDAO_MGET_CHUNK_SIZE", 1000)
+
+        # only whole records from the default connection and types go in the identity map
+        imap = cls._identity_map() if fields is None and conn is None and types is None else None
+        if conn is None:
+            conn = cls.__conn__
+        if types is None:
+            types = cls.dynamic_read_types() or cls.__type__
+
+        records = {}
+        todo = []
+        for id in ids:
+            if id in records:
+                continue
+            if imap is not None:
+                held, raw = imap.get(cls.__type__, id)
+                if held:
+                    records[id] = raw
+                    continue
+            records[id] = None
+            todo.append(id)
+
+        # _mget needs a single, concrete type to look in
+        single = types
+        if isinstance(types, list):
+            single = types[0] if len(types) == 1 else None
+        if single is not None and "*" in single:
+            single = None
+
+        for i in range(0, len(todo), chunk_size):
+            chunk = todo[i:i + chunk_size]
+            if single is not None:
+                url = esprit.raw.elasticsearch_url(conn, single, endpoint="_mget")
+                body = mget.mget_body(chunk, fields)
+            else:
+                # time boxes which don't exist (yet, or any more) are skipped rather than failing the whole search
+                url = esprit.raw.elasticsearch_url(conn, types, endpoint="_search", params=mget.IDS_SEARCH_PARAMS)
+                body = mget.ids_query(chunk, fields)
+            resp = esprit.raw._do_post(url, conn, data=jsonlib.dumps(body), headers={"Content-Type" : "application/json"})
+            if resp.status_code == 404 and single is not None:
+                # the type doesn't exist yet, so neither do the records; but that may change at any moment, so
+                # the misses are not remembered
+                continue
+            elif resp.status_code != 200:
+                raise ESDAOException("Unable to get records: {x}".format(x=resp.text))
+            elif single is not None:
+                found = mget.mget_results(resp.json())
+            else:
+                found = mget.search_results(resp.json())
+
+            for id in chunk:
+                records[id] = found.get(id)
+                if imap is not None:
+                    imap.put(cls.__type__, id, deepcopy(records[id]))
+
+        return [cls._wrap_copy(records[id], wrap) for id in ids]
+
+    @classmethod
+    def _wrap_copy(cls, raw, wrap, copy=True):
+        # a copy of the raw record, wrapped in this class if asked, so that no one can change what is remembered
+        if raw is None:
+            return None
+        if copy:
+            raw = deepcopy(raw)
+        return cls(raw) if wrap else raw
+
+    @classmethod
+    def _identity_map(cls):
+        if not app.config.get("ESDAO_IDENTITY_MAP", True):
+            return None
+        return mget.identity_map()
+
+    @classmethod
+    def _remember(cls, id, raw):
+        imap = cls._identity_map()
+        if imap is not None and id is not None:
+            imap.put(cls.__type__, id, raw)
+
+    @classmethod
+    def query(cls, *args, **kwargs):
+        """
+        As the esprit query, but if this class has a query cache time to live (__query_cache_ttl__ or
+        ESDAO_QUERY_CACHE_TTL), identical queries against the same read types are answered from memory until it runs
+        out, or this class saves or deletes a record.  Pass cache=False to go to the index regardless.
+        """
+        cache = kwargs.pop("cache", True)
+        ttl = cls._query_cache_ttl()
+        if not cache or not ttl:
+            return super(ESDAO, cls).query(*args, **kwargs)
+
+        types = kwargs.get("types")
+        if types is None:
+            types = cls.dynamic_read_types()
+        conn = kwargs.get("conn")
+        if conn is None:
+            conn = cls.__conn__
+        params = dict([(k, v) for k, v in kwargs.items() if k != "conn"])
+        key = canonical_hash({"args" : args, "kwargs" : params, "types" : types,
+                              "conn" : [getattr(conn, a, None) for a in ["host", "port", "index"]]})
+
+        res = cls._query_cache.get(cls.__type__, key)
+        if res is not None:
+            # callers are free to change what they get back, so each one gets its own copy
+            return deepcopy(res)
+        generation = cls._query_cache.generation(cls.__type__)
+        res = super(ESDAO, cls).query(*args, **kwargs)
+        cls._query_cache.set(cls.__type__, key, deepcopy(res), ttl, generation=generation)
+        return res
+
+    @classmethod
+    def query_cache_stats(cls):
+        """
+        Hits, misses, evictions, invalidations and size of the query cache for this class's type
+        """
+        return cls._query_cache.stats(cls.__type__)
+
+    @classmethod
+    def _query_cache_ttl(cls):
+        if cls.__query_cache_ttl__ is not None:
+            return cls.__query_cache_ttl__
+        return app.config.get("ESDAO_QUERY_CACHE_TTL", 0)
+
+    @classmethod
+    def bulk_save(cls, objects, chunk_size=None, max_bytes=None, refresh=None, retries=None, conn=None, type=None):
+        """
+        Save many objects through the _bulk endpoint, rather than one request per object.
+
+        Each object is prep()ed and given an id and created/updated dates as save() would, and the objects are
+        sent in chunks of at most chunk_size documents and max_bytes of NDJSON, drawn from the iterable as they are
+        needed.  Items which fail with a retryable status (e.g. 429 when the cluster is busy) are resent on their
+        own, up to retries times.  Each chunk goes to the type given by dynamic_write_type at the time it is sent,
+        so rolling and time-boxed types are written to as they would be by save().
+
+        :param objects: iterable of instances of this class
+        :param refresh: value of the refresh parameter for the requests (e.g. "true" or "wait_for")
+        :return: list of {"id", "status", "error"} dicts in the order of the objects, where error is None on success
+        """
+        if conn is None:
+            conn = cls.__conn__
+        if chunk_size is None:
+            chunk_size = app.config.get("ESDAO_BULK_CHUNK_SIZE", 500)
+        if max_bytes is None:
+            max_bytes = app.config.get("ESDAO_BULK_MAX_BYTES", 5242880)
+        if retries is None:
+            retries = app.config.get("ESDAO_BULK_RETRIES", 3)
+
+        params = {}
+        if refresh is not None:
+            params["refresh"] = refresh
+
+        try:
+            return cls._send_bulk(bulk.save_entries(objects), chunk_size, max_bytes, params, retries, conn, type)
+        finally:
+            cls.invalidate_caches()
+
+    @classmethod
+    def _send_bulk(cls, entries, chunk_size, max_bytes, params, retries, conn, type=None):
+        # send (id, lines) entries to the _bulk endpoint of the given type, or of the write type at the time each
+        # chunk is sent
+        def write_type():
+            if type is not None:
+                return type
+            return cls.dynamic_write_type() or cls.__type__
+
+        def send_to(wt):
+            url = esprit.raw.elasticsearch_url(conn, wt, endpoint="_bulk", params=params)
+
+            def send(body):
+                resp = esprit.raw._do_post(url, conn, data=body, headers={"Content-Type" : "application/x-ndjson"})
+                try:
+                    return resp.status_code, resp.json()
+                except ValueError:
+                    return resp.status_code, None
+            return send
+
+        return bulk.send_all(entries, send_to, write_type, chunk_size, max_bytes, retries)
+
+    @classmethod
+    def iterate(cls, q=None, page_size=None, keepalive=None, wrap=True, prefetch=True, limit=None, conn=None, types=None):
+        """
+        Iterate over every record matching the query, however many there are, using a scroll rather than from/size
+        paging (which gets slower the deeper it goes).  Records are fetched page_size at a time and, if prefetch is
+        set, the next page is requested in the background while the current one is being worked through.
+
+        :param q: query object.  Any from and size are ignored.  Defaults to match_all
+        :param page_size: number of records to fetch at a time (defaults to ESDAO_ITERATE_PAGE_SIZE)
+        :param keepalive: how long ES should keep the scroll open between pages (defaults to ESDAO_ITERATE_KEEPALIVE)
+        :param wrap: yield instances of this class, rather than the raw source
+        :param limit: stop after this many records
+        """
+        if conn is None:
+            conn = cls.__conn__
+        if types is None:
+            types = cls.dynamic_read_types() or cls.__type__
+        if page_size is None:
+            page_size = app.config.get("ESDAO_ITERATE_PAGE_SIZE", 1000)
+        if keepalive is None:
+            keepalive = app.config.get("ESDAO_ITERATE_KEEPALIVE", "1m")
+
+        q = deepcopy(q) if q is not None else {"query" : {"match_all" : {}}}
+        q.pop("from", None)
+        q["size"] = page_size
+
+        def first():
+            resp = esprit.raw.initialise_scroll(conn, types, q, keepalive=keepalive)
+            if resp.status_code != 200:
+                raise ScrollException("Unable to initialise scroll: {x}".format(x=resp.text))
+            return esprit.raw.unpack_scroll(resp)
+
+        def fetch_next(scroll_id):
+            resp = esprit.raw.scroll_next(conn, scroll_id, keepalive=keepalive)
+            if esprit.raw.scroll_timedout(resp):
+                raise ScrollException("Scroll timed out; try a longer keepalive")
+            if resp.status_code != 200:
+                raise ScrollException("Unable to continue scroll: {x}".format(x=resp.text))
+            return esprit.raw.unpack_scroll(resp)
+
+        def clear(scroll_id):
+            # release the scroll now, rather than leaving ES to hold it open until the keepalive runs out
+            url = "{h}:{p}/_search/scroll".format(h=conn.host, p=conn.port)
+            resp = esprit.raw._do_delete(url, conn, data=jsonlib.dumps({"scroll_id" : [scroll_id]}),
+                                         headers={"Content-Type" : "application/json"})
+            if resp.status_code not in [200, 404]:
+                app.logger.warn("Unable to clear scroll: {x}".format(x=resp.text))
+
+        for r in paging.items(first, fetch_next, prefetch=prefetch, limit=limit, clear=clear):
+            yield cls(r) if wrap else r
+
+    @classmethod
+    def count(cls, q=None, conn=None, types=None):
+        """
+        Count the records matching the query using the _count endpoint, which does none of the work of a search
+        """
+        if conn is None:
+            conn = cls.__conn__
+        if types is None:
+            types = cls.dynamic_read_types() or cls.__type__
+
+        body = {"query" : q.get("query", {"match_all" : {}}) if q is not None else {"match_all" : {}}}
+        url = esprit.raw.elasticsearch_url(conn, types, endpoint="_count")
+        resp = esprit.raw._do_post(url, conn, data=jsonlib.dumps(body), headers={"Content-Type" : "application/json"})
+        if resp.status_code != 200:
+            raise ESDAOException("Unable to count records: {x}".format(x=resp.text))
+        return resp.json().get("count", 0)
+
+    @classmethod
+    def get_all_facet_values(cls, facet, query_filter=None, page_size=None, cache=True):
+        """
+        Every value of the facet, with its count, among the records matching the query filter.  The values are paged
+        through with a composite aggregation, so none are left out however many there are.  Results are cached (see
+        ESDAO_FACET_CACHE_TTL) until the time to live runs out or this class saves or deletes a record.
+
+        :return: dict of {value : count}
+        """
+        if page_size is None:
+            page_size = app.config.get("ESDAO_FACET_PAGE_SIZE", 1000)
+
+        def compute():
+            return facets.all_values(lambda q: cls.query(q=q, cache=False), facet, query_filter, page_size)
+
+        if not cache:
+            return compute()
+        key = ("all", facet, facets.filter_hash(query_filter))
+        return cls._facet_cache.get_or_compute(cls.__type__, key, compute, cls._facet_cache_ttl())
+
+    @classmethod
+    def get_facets(cls, facet_fields, query_filter=None, size=None, cache=True):
+        """
+        The top values of each of several facets, among the records matching the query filter, in one request (for
+        the facets which aren't already cached)
+
+        :param size: number of values to get for each facet (defaults to ESDAO_FACET_SIZE)
+        :return: dict of {facet : {value : count}}
+        """
+        if size is None:
+            size = app.config.get("ESDAO_FACET_SIZE", 100)
+        fhash = facets.filter_hash(query_filter)
+        ttl = cls._facet_cache_ttl()
+
+        results = {}
+        if cache:
+            for facet in facet_fields:
+                values = cls._facet_cache.get(cls.__type__, ("top", facet, fhash, size))
+                if values is not None:
+                    results[facet] = values
+
+        todo = [f for f in facet_fields if f not in results]
+        if len(todo) > 0:
+            generation = cls._facet_cache.generation(cls.__type__)
+            res = cls.query(q=facets.batch_query(todo, query_filter, size), cache=False)
+            for facet, values in facets.batch_results(res, todo).items():
+                results[facet] = values
+                if cache:
+                    cls._facet_cache.set(cls.__type__, ("top", facet, fhash, size), values, ttl, generation=generation)
+        return results
+
+    @classmethod
+    def _facet_cache_ttl(cls):
+        if cls.__facet_cache_ttl__ is not None:
+            return cls.__facet_cache_ttl__
+        return app.config.get("ESDAO_FACET_CACHE_TTL", 60)
 
     ######################################################
     ## Octopus specific functions
@@ -109,10 +461,13 @@ class RollingTypeESDAO(ESDAO):
     # the order in which the DAO should look for an index type to query
     __read_preference__ = ["next", "curr", "prev"]
 
-    # create a lock for this DAO to use so that the modifications to the files can
-    # be synchronised
+    # lock for creating the pointer objects below.  Modifications to the files themselves are
+    # synchronised across processes by the lock on the rolling directory
     _lock = threading.RLock()
 
+    # the pointer files, their in-memory cache and their directory lock, one per type
+    _rolling_pointers = {}
+
     @classmethod
     def _mint_next_type(cls):
         return cls.__type__ + datetime.utcnow().strftime("%Y%m%d%H%M%S")
@@ -122,38 +477,108 @@ class RollingTypeESDAO(ESDAO):
         return os.path.join(app.config.get("ESDAO_ROLLING_DIR"), cls.__type__)
 
     @classmethod
-    def _get_cfg(cls, pos):
-        return app.config.get("ESDAO_ROLLING_{x}_{y}".format(x=pos.upper(), y=cls.__type__.upper()))
+    def _rolling(cls):
+        rp = cls._rolling_pointers.get(cls.__type__)
+        if rp is None:
+            with cls._lock:
+                rp = cls._rolling_pointers.get(cls.__type__)
+                if rp is None:
+                    rp = RollingPointers(cls._roll_dir(), interval=app.config.get("ESDAO_ROLLING_POLL_INTERVAL", 1))
+                    cls._rolling_pointers[cls.__type__] = rp
+        return rp
 
     @classmethod
-    def _set_cfg(cls, pos, val):
-        app.config["ESDAO_ROLLING_{x}_{y}".format(x=pos.upper(), y=cls.__type__.upper())] = val
+    def _pointers(cls):
+        return cls._rolling().cache
 
     @classmethod
     def _get_file(cls, pos):
-        dir = cls._roll_dir()
-        f = os.path.join(dir, pos)
-        if os.path.exists(f) and os.path.isfile(f):
-            with open(f) as o:
-                return o.read()
-        return None
+        return cls._rolling().read(pos)
 
     @classmethod
     def _set_file(cls, pos, val):
-        if val is None:
-            cls._drop_file(pos)
-            return
-        dir = cls._roll_dir()
-        f = os.path.join(dir, pos)
-        with open(f, "wb") as o:
-            o.write(val)
+        cls._rolling().write(pos, val)
 
     @classmethod
     def _drop_file(cls, pos):
-        dir = cls._roll_dir()
-        f = os.path.join(dir, pos)
-        if os.path.exists(f) and os.path.isfile(f):
-            os.remove(f)
+        cls._rolling().drop(pos)
+
+    @classmethod
+    def _capture_log(cls):
+        return CaptureLog(os.path.join(cls._roll_dir(), "capture"))
+
+    @classmethod
+    def _reindex_status_path(cls):
+        return os.path.join(cls._roll_dir(), "reindex.json")
+
+    @classmethod
+    def _capture(cls, ids):
+        # while a reindex is running, record what has been written so that it can be copied again
+        if cls._pointers().get("reindex") is not None:
+            cls._capture_log().record(ids)
+
+    @classmethod
+    @contextmanager
+    def _writing(cls):
+        # unless there is a next type and no reindex, which is the usual case, a write holds the writes lock shared
+        # from choosing the type to write to until it has been captured, so that a reindex can't start or finish
+        # part way through it
+        rp = cls._rolling()
+        if rp.cache.get("reindex") is None and rp.cache.get("next") is not None:
+            yield
+            return
+        with rp.writes.shared():
+            yield
+
+    def save(self, **kwargs):
+        with self._writing():
+            super(RollingTypeESDAO, self).save(**kwargs)
+            self._capture([self.id])
+
+    def delete(self, **kwargs):
+        with self._writing():
+            super(RollingTypeESDAO, self).delete(**kwargs)
+            self._capture([self.id])
+
+    @classmethod
+    def bulk_save(cls, objects, *args, **kwargs):
+        with cls._writing():
+            results = super(RollingTypeESDAO, cls).bulk_save(objects, *args, **kwargs)
+            cls._capture([r["id"] for r in results if r["error"] is None])
+            return results
+
+    @classmethod
+    def delete_by_query(cls, query, conn=None, es_version="0.90.13", type=None):
+        with cls._writing():
+            return cls._delete_by_query(query, conn=conn, es_version=es_version, type=type)
+
+    @classmethod
+    def _delete_by_query(cls, query, conn=None, es_version="0.90.13", type=None):
+        if cls._pointers().get("reindex") is None:
+            return super(RollingTypeESDAO, cls).delete_by_query(query, conn=conn, es_version=es_version, type=type)
+        if type is None:
+            type = cls.dynamic_write_type()
+
+        # while a reindex is running, find the ids the query matches and delete those, a chunk at a time, so that
+        # exactly the records deleted are captured and the deletes are replayed into the new type
+        chunk_size = app.config.get("ESDAO_BULK_CHUNK_SIZE", 500)
+        q = deepcopy(query)
+        q["_source"] = ["id"]
+
+        def delete(ids):
+            super(RollingTypeESDAO, cls).delete_by_query({"query" : {"ids" : {"values" : ids}}}, conn=conn, es_version=es_version, type=type)
+            cls._capture(ids)
+
+        ids = []
+        for r in cls.iterate(q, wrap=False, conn=conn):
+            if r.get("id") is None:
+                continue
+            ids.append(r.get("id"))
+            if len(ids) >= chunk_size:
+                delete(ids)
+                ids = []
+        if len(ids) > 0:
+            delete(ids)
 
     @classmethod
     def _init_type(cls, tname):
@@ -174,60 +599,38 @@ class RollingTypeESDAO(ESDAO):
 
         # get what we think the current index is for this position
         i = cls._get_file(pos)
-        # if there's no index at that position, just check the cfg is reset correctly
         if i is None:
-            cls._set_cfg(pos, None)
             return
 
         esv = app.config.get("ELASTIC_SEARCH_VERSION")
 
-        # if there is an index named, we need to check it exists
-        if esprit.raw.type_exists(conn, i, es_version=esv):
-            # if the type does exist, then we just need to check the config is reset correctly
-            cls._set_cfg(pos, i)
-        else:
-            # there is no type corresponding to the file, so reset the config and the file
+        # if there is an index named, we need to check it exists, and if it doesn't, drop the file
+        if not esprit.raw.type_exists(conn, i, es_version=esv):
             cls._drop_file(pos)
-            cls._set_cfg(pos, None)
 
     @classmethod
     def rolling_status(cls):
-        pc = cls._get_cfg("prev")
-        pf = cls._get_file("prev")
-
-        cc = cls._get_cfg("curr")
-        cf = cls._get_file("curr")
-
-        nc = cls._get_cfg("next")
-        nf = cls._get_file("next")
-
-        s = {
-            "prev" : {"cfg" : pc, "file" : pf},
-            "curr" : {"cfg" : cc, "file" : cf},
-            "next" : {"cfg" : nc, "file" : nf}
-        }
+        # "cfg" is what this process is using, from its pointer cache, and "file" is what is on disk now
+        cached = cls._pointers().snapshot()
+        s = {}
+        for pos in ["prev", "curr", "next"]:
+            s[pos] = {"cfg" : cached.get(pos), "file" : cls._get_file(pos)}
         return s
 
     @classmethod
     def rolling_refresh(cls):
-        cls._set_cfg("prev", cls._get_file("prev"))
-        cls._set_cfg("curr", cls._get_file("curr"))
-        cls._set_cfg("next", cls._get_file("next"))
+        cls._pointers().invalidate()
 
     @classmethod
     def drop_next(cls, conn=None):
-        with cls._lock:
+        with cls._rolling().lock:
             if conn is None:
                 conn = cls.__conn__
 
-            # get the canonical name for the index
-            n = cls._get_file("next")
+            # drop the file and then the index type
+            n = cls._rolling().drop_next()
             if n is None:
                 return
-
-            # drop the file, the config and the index type in that order
-            cls._drop_file("next")
-            cls._set_cfg("next", None)
             esprit.raw.delete(conn, n)
 
     @classmethod
@@ -245,17 +648,15 @@ class RollingTypeESDAO(ESDAO):
         rollover = tname is not None
         esv = app.config.get("ELASTIC_SEARCH_VERSION")
 
-        # FIXME: put the lock in here
-        with cls._lock:
+        # hold the directory lock, so that other processes don't change the files underneath us
+        with cls._rolling().lock:
             # now determine the route we're going to go down
             if rollover:
                 # check whether the type to write already exists
                 if not esprit.raw.type_exists(conn, tname, es_version=esv):
                     cls._init_type(tname)
-                # now we know the index exists, we can write the file and the
-                # config
+                # now we know the index exists, we can write the file
                 cls._set_file(write_to, tname)
-                cls._set_cfg(write_to, tname)
             else:
                 # this is the raw application init route, and it needs to make sure that all the
                 # indices, files and config line up
@@ -272,9 +673,7 @@ class RollingTypeESDAO(ESDAO):
                         # if it does not, create the one referenced in the file
                         cls._init_type(curr)
 
-                # synchronise the file and config
                 cls._set_file("curr", curr)
-                cls._set_cfg("curr", curr)
 
                 # finish by ensuring that the other file pointers and the index are in sync
                 cls._straighten_type("prev")
@@ -317,27 +716,16 @@ class RollingTypeESDAO(ESDAO):
 
     @classmethod
     def publish(cls, conn=None):
-        # synchronise access
-        with cls._lock:
+        # synchronise access, across processes
+        with cls._rolling().lock:
             if conn is None:
                 conn = cls.__conn__
 
-            prev = cls._get_file("prev")
-            curr = cls._get_file("curr")
-            next = cls._get_file("next")
-
-            if next is None:
+            # move current to previous and next to current
+            changed, prev = cls._rolling().publish()
+            if not changed:
                 return
 
-            # write current to previous
-            cls._set_file("prev", curr)
-
-            # write next to current
-            cls._set_file("curr", next)
-
-            # get rid of the next file
-            cls._drop_file("next")
-
             # refresh the configuration
             cls.rolling_refresh()
 
@@ -347,28 +735,16 @@ class RollingTypeESDAO(ESDAO):
 
     @classmethod
     def rollback(cls, conn=None):
-         # synchronise access
-        with cls._lock:
+        # synchronise access, across processes
+        with cls._rolling().lock:
             if conn is None:
                 conn = cls.__conn__
 
-            prev = cls._get_file("prev")
-            curr = cls._get_file("curr")
-            next = cls._get_file("next")
-
-            # only continue if prev exists
-            if prev is None:
+            # move current to next and previous to current, if there is a previous
+            changed, next = cls._rolling().rollback()
+            if not changed:
                 return
 
-            # write current to next
-            cls._set_file("next", curr)
-
-            # write previous to current
-            cls._set_file("curr", prev)
-
-            # get rid of the previous file
-            cls._drop_file("prev")
-
             # refresh the configuration
             cls.rolling_refresh()
 
@@ -376,18 +752,140 @@ class RollingTypeESDAO(ESDAO):
             if next is not None:
                 esprit.raw.delete(conn, next)
 
+    @classmethod
+    def reindex_transform(cls, record):
+        """
+        Override to change each record as it is copied by reindex.  Return the record to write, or None to leave
+        it out of the new index
+        """
+        return record
+
+    @classmethod
+    def reindex_status(cls):
+        return ReindexProgress.load(cls._reindex_status_path())
+
+    @classmethod
+    def reindex_running(cls):
+        return cls._get_file("reindex") is not None
+
+    @classmethod
+    def reindex(cls, slices=None, publish=True, batch_size=None, conn=None):
+        """
+        Copy every record from the curr type into a new one, and publish it, without stopping the application.
+
+        The new type is created with the class's mappings, and the records are read from curr with a scroll (in
+        parallel slices, if there is more than one), passed through reindex_transform, and bulk written to it.  While
+        the copy runs, writes still go to curr, and every process records the ids of what it saves or deletes;
+        those records are copied again until few are left, and the last of them are copied with the writes lock
+        held exclusively, so that no write is part way through, while the counts of the two types are compared.  Then the new type becomes next
+        and, if publish is set, is published.  Progress is saved to a file, so reindex_status works from any process.
+
+        :param slices: number of parallel slices to read (defaults to ESDAO_REINDEX_SLICES)
+        :return: the final progress, as a dict
+        """
+        if conn is None:
+            conn = cls.__conn__
+        if slices is None:
+            slices = app.config.get("ESDAO_REINDEX_SLICES", 4)
+        if batch_size is None:
+            batch_size = app.config.get("ESDAO_BULK_CHUNK_SIZE", 500)
+        chunk_size = app.config.get("ESDAO_BULK_CHUNK_SIZE", 500)
+        max_bytes = app.config.get("ESDAO_BULK_MAX_BYTES", 5242880)
+        retries = app.config.get("ESDAO_BULK_RETRIES", 3)
+
+        rp = cls._rolling()
+        log = cls._capture_log()
+        # with the writes lock held exclusively, every write from here on is recorded, and none from before is
+        # still to land in the source after the copy has read past it
+        with rp.writes.exclusive(), rp.lock:
+            if rp.read("reindex") is not None:
+                raise ReindexException("A reindex of {x} is already running".format(x=cls.__type__))
+            if rp.read("next") is not None:
+                raise ReindexException("{x} already has a next type; publish or drop it first".format(x=cls.__type__))
+            source = rp.read("curr")
+            if source is None:
+                raise ReindexException("{x} has no curr type to reindex".format(x=cls.__type__))
+            target = cls._mint_next_type()
+            while target == source:
+                # type names are minted to the second
+                time.sleep(0.1)
+                target = cls._mint_next_type()
+            cls._init_type(target)
+            log.clear()
+            rp.write("reindex", target)
+
+        progress = ReindexProgress(source, target, path=cls._reindex_status_path())
+
+        def write(records):
+            entries = [(r.get("id"), bulk.index_lines(r.get("id"), r)) for r in records]
+            return cls._send_bulk(entries, chunk_size, max_bytes, {}, retries, conn, target)
+
+        def delete(ids):
+            entries = [(id, bulk.delete_lines(id)) for id in ids]
+            return cls._send_bulk(entries, chunk_size, max_bytes, {}, retries, conn, target)
+
+        def fetch(frm):
+            def f(ids):
+                q = {"query" : {"ids" : {"values" : ids}}}
+                return cls.iterate(q, page_size=len(ids), wrap=False, prefetch=False, conn=conn, types=frm)
+            return f
+
+        def refresh(t):
+            esprit.raw._do_post(esprit.raw.elasticsearch_url(conn, t, endpoint="_refresh"), conn)
+
+        try:
+            progress.update(state="copying", total=cls.count(conn=conn, types=source))
+            qs = []
+            for i in range(slices):
+                q = {"query" : {"match_all" : {}}}
+                if slices > 1:
+                    q["slice"] = {"id" : i, "max" : slices}
+                qs.append(cls.iterate(q, page_size=batch_size, wrap=False, conn=conn, types=source))
+            reindexing.copy(qs, write, transform=cls.reindex_transform, progress=progress, batch_size=batch_size)
+
+            progress.update(state="catching up")
+            reindexing.replay(log, fetch(source), write, delete, transform=cls.reindex_transform, progress=progress,
+                              threshold=app.config.get("ESDAO_REINDEX_PAUSE_THRESHOLD", 1000), max_rounds=10)
+
+            # hold up writes while the last records are copied and the counts compared.  Writes after this go to the
+            # new type, as every process re-reads the pointers when it next takes the writes lock
+            with rp.writes.exclusive(), rp.lock:
+                progress.update(state="verifying")
+                reindexing.replay(log, fetch(source), write, delete, transform=cls.reindex_transform, progress=progress)
+                refresh(source)
+                refresh(target)
+                expected = cls.count(conn=conn, types=source) - progress.as_dict()["dropped"]
+                actual = cls.count(conn=conn, types=target)
+                if actual != expected:
+                    raise ReindexException("{t} has {a} records, where {e} were expected".format(t=target, a=actual, e=expected))
+
+                rp.write("next", target)
+                rp.drop("reindex")
+                if publish:
+                    cls.publish(conn=conn)
+                else:
+                    cls.rolling_refresh()
+                log.clear()
+
+            progress.update(state="published" if publish else "complete")
+            return progress.as_dict()
+
+        except Exception as e:
+            progress.update(state="failed", error=str(e))
+            with rp.lock:
+                if rp.read("reindex") == target:
+                    rp.drop("reindex")
+                    esprit.raw.delete(conn, target)
+            log.clear()
+            raise
+
     @classmethod
     def dynamic_read_types(cls):
+        # the pointer cache follows changes made to the files by other processes, which the config does not
+        pointers = cls._pointers()
         for pref in cls.__read_preference__:
-            # first look to see if it is set in the config
-            t = cls._get_cfg(pref)
-            if t is not None:
-                return t
-
-            # if not next check to see if there's a file
-            t = cls._get_file(pref)
+            t = pointers.get(pref)
             if t is not None:
-                cls._set_cfg(pref, t)
                 return t
 
         # if we don't get anything, return the base type
@@ -395,22 +893,7 @@ class RollingTypeESDAO(ESDAO):
 
     @classmethod
     def dynamic_write_type(cls):
-        # look to see if the next index is already set, in which case we
-        # can return
-        next = cls._get_cfg("next")
-        if next is not None:
-            return next
-
-        # since there could be several threads trying to do the same thing, lock
-        # this thread until the file/index has been sorted out
-        with cls._lock:
-            # if not read it from the directory
-            next = cls._get_file("next")
-            if next is not None:
-                cls._set_cfg("next", next)
-                return next
-
-            # if it wasn't in the directory we need to make it
+        def create():
             tname = cls._mint_next_type()
             if cls.__init_dynamic_type__:
                 # find out if this class needs to self-init
@@ -418,16 +901,13 @@ class RollingTypeESDAO(ESDAO):
                     klazz = plugin.load_class(cname)
                     if issubclass(cls, klazz):
                         cls.self_init(type_name=tname, write_to="next")
-
-            # now write the file
-            dir = cls._roll_dir()
-            if not os.path.exists(dir):
-                os.mkdir(dir)
-            cls._set_file("next", tname)
-            cls._set_cfg("next", tname)
-
             return tname
 
+        # the next index is read from the pointer cache if it is set.  If not, only one thread in
+        # one process gets to make it, and the rest wait for the directory lock and then pick up
+        # the one it made.  While a reindex is running, writes go to curr instead
+        return cls._rolling().write_type(create)
+
 class TimeBoxedTypeESDAO(ESDAO):
 
     # FIXME: this is just a placeholder, we're not doing a proper impl of this yet
@@ -435,14 +915,14 @@ class TimeBoxedTypeESDAO(ESDAO):
     # with a mapping or an example document
     __init_dynamic_type__ = True
 
-    FORMAT_MAP = {
-        "year" : "%Y",
-        "month" : "%Y%m",
-        "day" : "%Y%m%d",
-        "hour" : "%Y%m%d%H",
-        "minute" : "%Y%m%d%H%M",
-        "second" : "%Y%m%d%H%M%S"
-    }
+    FORMAT_MAP = timebox.FORMAT_MAP
+
+    # the read types for the current time box, keyed by type name, so they are only worked out
+    # once per box: {type : ((granularity, lookback, boundary), read types)}
+    _read_types_cache = {}
+
+    # the write types which this process has already made sure exist
+    _ensured_types = set()
 
     #####################################################
     ## overrides on Domain Object
@@ -452,8 +932,27 @@ class TimeBoxedTypeESDAO(ESDAO):
         gran = cls._get_time_granularity()
         ts = cls._boundary_timestamp(gran)
         lookback = cls._get_lookback()
+
+        key = (gran, lookback, ts)
+        cached = cls._read_types_cache.get(cls.__type__)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
         tss = cls._lookback_timestamps(lookback, gran, ts)
-        return [cls._format_type(gran, ts) for ts in tss]
+        policy = cls._get_retention()
+        use_patterns = app.config.get("ESDAO_TIME_BOX_PATTERNS", True)
+        if policy is not None:
+            # boxes which have been compacted are read through their archive's pattern (whatever
+            # ESDAO_TIME_BOX_PATTERNS says), and those beyond the horizon not at all
+            types = timebox.retained_read_types(cls.__type__, gran, tss, ts, use_patterns=use_patterns, **policy)
+        elif use_patterns:
+            # cover whole months, years, etc. of the lookback with one index pattern each, so the read is a
+            # short list of patterns however many boxes it spans
+            types = timebox.patterns(cls.__type__, gran, tss, ts)
+        else:
+            types = [cls._format_type(gran, ts) for ts in tss]
+        cls._read_types_cache[cls.__type__] = (key, types)
+        return types
 
     @classmethod
     def dynamic_write_type(cls):
@@ -463,15 +962,122 @@ class TimeBoxedTypeESDAO(ESDAO):
         wt = cls._format_type(gran, ts)
 
         # if might be that the type does not yet exist, in which case we
-        # may need to create it
-        if cls.__init_dynamic_type__:
+        # may need to create it.  Once we have done that, we don't need to check again
+        if cls.__init_dynamic_type__ and wt not in cls._ensured_types:
             # initialising the type with the default dynamic mapping
             put_mappings(cls.__conn__, {wt: {wt: mappings.default_mapping()}})
+            cls._ensured_types.add(wt)
         return wt
 
+    @classmethod
+    def list_types(cls, conn=None):
+        """
+        The names of all the types which exist for this class: its time boxes, and any archives
+        """
+        if conn is None:
+            conn = cls.__conn__
+        url = esprit.raw.elasticsearch_url(conn, cls.__type__ + "*", endpoint="_mapping")
+        resp = esprit.raw._do_get(url, conn)
+        if resp.status_code == 404:
+            return []
+        if resp.status_code != 200:
+            raise ESDAOException("Unable to list types: {x}".format(x=resp.text))
+
+        if conn.index_per_type:
+            prefix = conn.index + "-"
+            names = [k[len(prefix):] for k in resp.json().keys() if k.startswith(prefix)]
+        else:
+            names = list(resp.json().get(conn.index, {}).get("mappings", {}).keys())
+        return [n for n in names if n.startswith(cls.__type__)]
+
+    @classmethod
+    def apply_retention(cls, dry_run=False, conn=None):
+        """
+        Apply the retention policy for this type (see ESDAO_DEFAULT_TIME_BOX_RETENTION): copy the boxes older than
+        those being kept into an archive per month/year, and delete the boxes and archives beyond the horizon
+
+        :param dry_run: just work out what would be done
+        :return: the plan, as from octopus.modules.es.timebox.retention_plan
+        """
+        if conn is None:
+            conn = cls.__conn__
+        policy = cls._get_retention()
+        if policy is None:
+            return {"compact" : {}, "delete" : []}
+
+        gran = cls._get_time_granularity()
+        latest = cls._boundary_timestamp(gran)
+        plan = timebox.retention_plan(cls.__type__, gran, cls.list_types(conn=conn), latest, **policy)
+        if dry_run:
+            return plan
+
+        for archive, boxes in plan["compact"].items():
+            cls._compact(archive, boxes, conn)
+        for name in plan["delete"]:
+            esprit.raw.delete(conn, name)
+            cls._ensured_types.discard(name)
+        return plan
+
+    @classmethod
+    def _compact(cls, archive, boxes, conn):
+        # copy the boxes into the archive, and delete them once the archive holds all their records.  Until
+        # then, reads go to both through the archive's pattern, so if the copy fails what it has written to the
+        # archive is taken out again, or the records would be read twice
+        created = not esprit.raw.type_exists(conn, archive, es_version=app.config.get("ELASTIC_SEARCH_VERSION"))
+        put_mappings(conn, {archive: {archive: mappings.default_mapping()}})
+        chunk_size = app.config.get("ESDAO_BULK_CHUNK_SIZE", 500)
+        max_bytes = app.config.get("ESDAO_BULK_MAX_BYTES", 5242880)
+        retries = app.config.get("ESDAO_BULK_RETRIES", 3)
+
+        def write(records):
+            entries = [(r.get("id"), bulk.index_lines(r.get("id"), r)) for r in records]
+            return cls._send_bulk(entries, chunk_size, max_bytes, {}, retries, conn, archive)
+
+        try:
+            progress = ReindexProgress(",".join(boxes), archive)
+            reindexing.copy([cls.iterate(wrap=False, conn=conn, types=boxes)], write, progress=progress, batch_size=chunk_size)
+            if progress.as_dict()["failed"] > 0:
+                raise ESDAOException("{x} records could not be copied to {a}".format(x=progress.as_dict()["failed"], a=archive))
+
+            esprit.raw._do_post(esprit.raw.elasticsearch_url(conn, archive, endpoint="_refresh"), conn)
+            expected = cls.count(conn=conn, types=boxes)
+            actual = cls.count(conn=conn, types=archive)
+            if actual < expected:
+                raise ESDAOException("{a} has {x} records, but {b} have {y}".format(a=archive, x=actual, b=",".join(boxes), y=expected))
+        except Exception:
+            cls._uncompact(archive, boxes, created, conn)
+            raise
+
+        for box in boxes:
+            esprit.raw.delete(conn, box)
+            cls._ensured_types.discard(box)
+
+    @classmethod
+    def _uncompact(cls, archive, boxes, created, conn):
+        # undo a failed _compact: an archive it created is deleted outright; one which was already there (from
+        # boxes compacted on an earlier run) has the records of these boxes deleted from it
+        if created:
+            esprit.raw.delete(conn, archive)
+            return
+        q = {"query" : {"match_all" : {}}, "_source" : ["id"]}
+        ids = (r.get("id") for r in cls.iterate(q, wrap=False, conn=conn, types=boxes))
+        entries = ((id, bulk.delete_lines(id)) for id in ids if id is not None)
+        cls._send_bulk(entries, app.config.get("ESDAO_BULK_CHUNK_SIZE", 500), app.config.get("ESDAO_BULK_MAX_BYTES", 5242880),
+                       {}, app.config.get("ESDAO_BULK_RETRIES", 3), conn, archive)
+
     ######################################################
     ## Private methods for handling time boxing
 
+    @classmethod
+    def _get_retention(cls):
+        cfarg = "ESDAO_TIME_BOX_RETENTION_" + cls.__type__.upper()
+        policy = app.config.get(cfarg)
+        if policy is None:
+            policy = app.config.get("ESDAO_DEFAULT_TIME_BOX_RETENTION")
+        if policy is None:
+            return None
+        return {"keep" : policy.get("keep"), "compact" : policy.get("compact"), "horizon" : policy.get("horizon")}
+
     @classmethod
     def _get_time_granularity(cls):
         cfarg = "ESDAO_TIME_BOX_" + cls.__type__.upper()
@@ -524,24 +1130,9 @@ class TimeBoxedTypeESDAO(ESDAO):
 
     @classmethod
     def _lookback_timestamps(cls, lookback, granularity, latest_timestamp):
-        rds = []
-        if granularity == "year":
-            rds = [relativedelta.relativedelta(years=x) for x in range(1, lookback + 1)]
-        if granularity == "month":
-            rds = [relativedelta.relativedelta(months=x) for x in range(1, lookback + 1)]
-        if granularity == "day":
-            rds = [relativedelta.relativedelta(days=x) for x in range(1, lookback + 1)]
-        if granularity == "hour":
-            rds = [relativedelta.relativedelta(hours=x) for x in range(1, lookback + 1)]
-        if granularity == "minute":
-            rds = [relativedelta.relativedelta(minutes=x) for x in range(1, lookback + 1)]
-        if granularity == "second":
-            rds = [relativedelta.relativedelta(seconds=x) for x in range(1, lookback + 1)]
-
         tss = [latest_timestamp]
-        for rd in rds:
-            tss.append(latest_timestamp - rd)
-
+        for x in range(1, lookback + 1):
+            tss.append(latest_timestamp - timebox.step(granularity, x))
         return tss
 
     @classmethod
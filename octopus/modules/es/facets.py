@@ -0,0 +1,95 @@
+"""
+Building and reading the aggregation queries behind ESDAO.get_all_facet_values and ESDAO.get_facets, without any
+knowledge of the connection
+"""
+from octopus.modules.es.cache import canonical_hash
+from copy import deepcopy
+
+def filter_hash(query_filter):
+    """
+    A hash of the query filter which is the same for equal filters, whatever order their keys are in
+    """
+    return canonical_hash(query_filter)
+
+
+def _base(query_filter):
+    return {
+        "query" : deepcopy(query_filter) if query_filter else {"match_all" : {}},
+        "size" : 0
+    }
+
+
+def _keep(key, count):
+    # empty keys and buckets are left out of the results
+    return key and count is not None and count > 0
+
+
+def composite_query(facet, query_filter=None, size=1000, after=None):
+    """
+    A query for one page of every value of the facet, using a composite aggregation
+    """
+    q = _base(query_filter)
+    agg = {"size" : size, "sources" : [{"facet" : {"terms" : {"field" : facet}}}]}
+    if after is not None:
+        agg["after"] = after
+    q["aggs"] = {"facets" : {"composite" : agg}}
+    return q
+
+
+def composite_page(resp):
+    """
+    The {value : count} of a page of a composite aggregation, and the key to ask for the page after it (None at the end)
+    """
+    agg = resp.get("aggregations", {}).get("facets", {})
+    buckets = agg.get("buckets", [])
+    values = {}
+    for bucket in buckets:
+        key = bucket.get("key", {}).get("facet")
+        count = bucket.get("doc_count")
+        if _keep(key, count):
+            values[key] = count
+    after = agg.get("after_key") if len(buckets) > 0 else None
+    return values, after
+
+
+def all_values(fetch, facet, query_filter=None, size=1000):
+    """
+    Every value of the facet, paging through the composite aggregation
+
+    :param fetch: function which takes a query and returns the decoded response
+    """
+    values = {}
+    after = None
+    while True:
+        page, after = composite_page(fetch(composite_query(facet, query_filter, size, after)))
+        values.update(page)
+        if after is None:
+            return values
+
+
+def batch_query(facets, query_filter=None, size=10):
+    """
+    A query for the top size values of each of the facets, in one request
+    """
+    q = _base(query_filter)
+    q["aggs"] = {}
+    for i, facet in enumerate(facets):
+        q["aggs"]["facet" + str(i)] = {"terms" : {"field" : facet, "size" : size}}
+    return q
+
+
+def batch_results(resp, facets):
+    """
+    {facet : {value : count}} from the response to batch_query
+    """
+    aggs = resp.get("aggregations", {})
+    results = {}
+    for i, facet in enumerate(facets):
+        values = {}
+        for bucket in aggs.get("facet" + str(i), {}).get("buckets", []):
+            key = bucket.get("key")
+            count = bucket.get("doc_count")
+            if _keep(key, count):
+                values[key] = count
+        results[facet] = values
+    return results
@@ -0,0 +1,96 @@
+"""
+Fetching many records by id at once (ESDAO.pull_many), and the request-scoped identity map which lets repeated pulls
+of the same record within a Flask request be answered from memory
+"""
+from flask import g, has_request_context
+
+def mget_body(ids, fields=None):
+    """
+    The body of an _mget request for the ids, optionally restricting the source to the given fields
+    """
+    docs = []
+    for id in ids:
+        d = {"_id" : id}
+        if fields is not None:
+            d["_source"] = fields
+        docs.append(d)
+    return {"docs" : docs}
+
+
+def mget_results(resp):
+    """
+    {id : source} for the documents an _mget response found
+    """
+    found = {}
+    for doc in resp.get("docs", []):
+        if doc.get("found"):
+            found[doc.get("_id")] = doc.get("_source", {})
+    return found
+
+
+# parameters for a search by id over several types, so that any of them which doesn't exist is left out rather than
+# the search failing with a 404
+IDS_SEARCH_PARAMS = {"ignore_unavailable" : "true", "allow_no_indices" : "true"}
+
+
+def ids_query(ids, fields=None):
+    """
+    A search for the ids, for when they may be in any of several types and so can't be got with _mget
+    """
+    q = {"query" : {"ids" : {"values" : ids}}, "size" : len(ids)}
+    if fields is not None:
+        q["_source"] = fields
+    return q
+
+
+def search_results(resp):
+    """
+    {id : source} for the hits of a search
+    """
+    found = {}
+    for hit in resp.get("hits", {}).get("hits", []):
+        found[hit.get("_id")] = hit.get("_source", {})
+    return found
+
+
+class IdentityMap(object):
+    """
+    Records (or the knowledge that there is no such record) held against (type, id)
+    """
+    def __init__(self):
+        self._records = {}
+
+    def get(self, type, id):
+        """
+        A tuple of whether anything is held for the id, and the record (None if the record is known not to exist)
+        """
+        key = (type, id)
+        if key in self._records:
+            return True, self._records[key]
+        return False, None
+
+    def put(self, type, id, record):
+        self._records[(type, id)] = record
+
+    def drop(self, type, id=None):
+        """
+        Forget the record, or everything held for the type if no id is given
+        """
+        if id is not None:
+            self._records.pop((type, id), None)
+            return
+        for k in [k for k in self._records.keys() if k[0] == type]:
+            del self._records[k]
+
+
+def identity_map():
+    """
+    The identity map for the current Flask request, or None outside of a request
+    """
+    if not has_request_context():
+        return None
+    imap = getattr(g, "_esdao_identity_map", None)
+    if imap is None:
+        imap = IdentityMap()
+        g._esdao_identity_map = imap
+    return imap
@@ -0,0 +1,62 @@
+"""
+Transport-independent paging over cursor-based result sets (e.g. an ES scroll), used by ESDAO.iterate
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+
+def pages(first, fetch_next, prefetch=True, clear=None):
+    """
+    Yield pages of results until an empty one comes back.
+
+    :param first: function of no arguments which returns the first (results, cursor)
+    :param fetch_next: function which takes a cursor and returns the next (results, cursor)
+    :param prefetch: if True, the next page is requested in a background thread while the current one is being
+        worked through
+    :param clear: function which takes the last cursor, called once paging stops for whatever reason (the results
+        running out, the consumer stopping early, or an error) so that the server can release it
+    """
+    cursor = None
+    future = None
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        results, cursor = first()
+        if not prefetch:
+            while len(results) > 0:
+                yield results
+                results, cursor = fetch_next(cursor)
+            return
+
+        while len(results) > 0:
+            future = executor.submit(fetch_next, cursor)
+            yield results
+            results, cursor = future.result()
+            future = None
+    finally:
+        if future is not None and not future.cancel():
+            # a page is already being fetched, and may come back with a newer cursor
+            try:
+                cursor = future.result()[1]
+            except Exception:
+                pass
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if clear is not None and cursor is not None:
+            clear(cursor)
+
+
+def items(first, fetch_next, prefetch=True, limit=None, clear=None):
+    """
+    As pages, but yield the individual results, stopping after limit of them if it is given
+    """
+    count = 0
+    gen = pages(first, fetch_next, prefetch, clear)
+    try:
+        for page in gen:
+            for r in page:
+                if limit is not None and count >= limit:
+                    return
+                yield r
+                count += 1
+    finally:
+        # so the cursor is cleared now, rather than whenever the pages are garbage collected
+        gen.close()
@@ -0,0 +1,372 @@
+"""
+The rolling index pointer files ("prev", "curr", "next") used by RollingTypeESDAO: an in-memory cache of them, so
+that resolving the type to read from or write to does not touch the filesystem on every request, and the operations
+which change them, coordinated between processes with a lock file.
+"""
+from contextlib import contextmanager
+import fcntl, os, threading, time
+
+VERSION_FILE = "version"
+LOCK_FILE = ".lock"
+WRITE_LOCK_FILE = ".writes"
+
+
+def write_atomic(path, val):
+    """
+    Write the string to the file by writing a temporary file and renaming it over the top, so that readers only
+    ever see the old or the new contents
+    """
+    tmp = "{p}.{pid}.{tid}.tmp".format(p=path, pid=os.getpid(), tid=threading.get_ident())
+    with open(tmp, "w") as f:
+        f.write(val)
+    os.replace(tmp, path)
+
+
+class DirectoryLock(object):
+    """
+    An exclusive lock on a directory, held against other threads in this process and, through fcntl.flock on a lock
+    file in the directory, against other processes.  It is re-entrant within a thread.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, LOCK_FILE)
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                if not os.path.exists(self.directory):
+                    os.makedirs(self.directory, exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except:
+                    os.close(fd)
+                    raise
+            except:
+                self._rlock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class WriteLock(object):
+    """
+    A shared/exclusive lock on a directory, across threads and (through fcntl.flock on a file in the directory)
+    processes.  Writers hold it shared for the whole of a write, from choosing the type to write to until the write is
+    done, and a reindex holds it exclusively while it starts and finishes, so that no write can be part way through
+    when the type to write to changes under it.
+
+    Every time the exclusive lock is released the lock file grows by a byte.  So when a process next takes the shared
+    lock it can tell whether anyone has held the exclusive lock since it last did, and on_change is called before any
+    of its writers go on, so that they don't use pointers cached from before.
+
+    :param on_change: function of no arguments called when the exclusive lock is found to have been held
+    """
+    def __init__(self, directory, on_change=None):
+        self.directory = directory
+        self.path = os.path.join(directory, WRITE_LOCK_FILE)
+        self.on_change = on_change
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._shared = 0
+        self._exclusive = False
+        self._seen = None
+        self._fd = None
+        self._pid = None
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield self
+        finally:
+            self.release_shared()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire_exclusive()
+        try:
+            yield self
+        finally:
+            self.release_exclusive()
+
+    def acquire_shared(self):
+        depth = getattr(self._local, "depth", 0)
+        with self._cond:
+            # a thread which already holds it doesn't wait, or it would never let a waiting exclusive holder in
+            while self._exclusive and depth == 0:
+                self._cond.wait()
+            if self._shared == 0:
+                fd = self._open()
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                size = os.fstat(fd).st_size
+                if size != self._seen:
+                    self._seen = size
+                    if self.on_change is not None:
+                        self.on_change()
+            self._shared += 1
+        self._local.depth = depth + 1
+
+    def release_shared(self):
+        self._local.depth -= 1
+        with self._cond:
+            self._shared -= 1
+            if self._shared == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self._cond:
+            while self._exclusive or self._shared > 0:
+                self._cond.wait()
+            self._exclusive = True
+            try:
+                fcntl.flock(self._open(), fcntl.LOCK_EX)
+            except:
+                self._exclusive = False
+                self._cond.notify_all()
+                raise
+
+    def release_exclusive(self):
+        with self._cond:
+            try:
+                os.write(self._fd, b".")
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._exclusive = False
+                self._cond.notify_all()
+
+    def _open(self):
+        # the file is kept open between uses, but not shared with a forked child, whose flocks would be the parent's
+        if self._fd is None or self._pid != os.getpid():
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+
+class PointerCache(object):
+    """
+    Holds the contents of the pointer files in a directory, and re-reads them when they change.
+
+    Whoever changes a pointer file calls bump(), which increments a counter in the version file.  Lookups check the
+    version file (and, for changes made by anything which doesn't bump it, the pointer files' stats) at most once per
+    interval seconds, and reload the pointers if anything has changed.  So a lookup is a memory read, and every
+    process sharing the directory converges on the new pointers within the interval of a publish or rollback.
+    """
+    def __init__(self, directory, positions=("prev", "curr", "next"), interval=1.0, clock=time.monotonic):
+        self.directory = directory
+        self.positions = positions
+        self.interval = interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._values = None
+        self._signature = None
+        self._checked = None
+
+    def get(self, pos):
+        return self._refresh().get(pos)
+
+    def snapshot(self):
+        return dict(self._refresh())
+
+    def invalidate(self):
+        with self._lock:
+            self._values = None
+
+    def bump(self):
+        """
+        Record that the pointers have changed, for this and every other process
+        """
+        with self._lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, VERSION_FILE)
+            version = self._read(path)
+            version = int(version) + 1 if version is not None and version.isdigit() else 1
+            write_atomic(path, str(version))
+            self._values = None
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def _current_signature(self):
+        sig = [self._read(os.path.join(self.directory, VERSION_FILE))]
+        sig += [self._stat(os.path.join(self.directory, pos)) for pos in self.positions]
+        return tuple(sig)
+
+    def _refresh(self):
+        # returns the values dict it checked or loaded, so that callers never see the one held being
+        # reset by bump() or invalidate() in another thread.  The fast path reads into locals, so needs no lock
+        now = self.clock()
+        values, checked = self._values, self._checked
+        if values is not None and checked is not None and now - checked < self.interval:
+            return values
+
+        with self._lock:
+            values = self._values
+            sig = self._current_signature()
+            if values is None or sig != self._signature:
+                values = {}
+                for pos in self.positions:
+                    val = self._read(os.path.join(self.directory, pos))
+                    if val is not None:
+                        values[pos] = val
+                self._values = values
+                self._signature = sig
+            self._checked = now
+            return values
+
+
+class RollingPointers(object):
+    """
+    The pointer files for one rolling type, and the operations which move them.  Every change is made with the
+    directory lock held, so processes sharing the directory cannot interleave them, and each file is written
+    atomically, so readers never see a partial type name.  Reads of the current pointers should go through the
+    cache, which costs nothing between polls.
+
+    As well as prev, curr and next, the cache follows the "reindex" file, which names the type a reindex is copying
+    into while it runs.  While there is one, writes hold the writes lock shared (see WriteLock).
+    """
+    def __init__(self, directory, interval=1.0):
+        self.directory = directory
+        self.lock = DirectoryLock(directory)
+        self.cache = PointerCache(directory, positions=("prev", "curr", "next", "reindex"), interval=interval)
+        self.writes = WriteLock(directory, on_change=self.cache.invalidate)
+
+    def read(self, pos):
+        # read straight from disk, for use with the lock held
+        f = os.path.join(self.directory, pos)
+        if os.path.exists(f) and os.path.isfile(f):
+            with open(f) as o:
+                return o.read()
+        return None
+
+    def write(self, pos, val):
+        if val is None:
+            self.drop(pos)
+            return
+        with self.lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            write_atomic(os.path.join(self.directory, pos), val)
+            self.cache.bump()
+
+    def drop(self, pos):
+        with self.lock:
+            f = os.path.join(self.directory, pos)
+            if os.path.exists(f) and os.path.isfile(f):
+                os.remove(f)
+                self.cache.bump()
+
+    def publish(self):
+        """
+        Move curr to prev and next to curr.
+
+        :return: tuple of whether anything changed, and the type which was prev and is no longer referenced (or None)
+        """
+        with self.lock:
+            prev = self.read("prev")
+            curr = self.read("curr")
+            next = self.read("next")
+            if next is None:
+                return False, None
+            self.write("prev", curr)
+            self.write("curr", next)
+            self.drop("next")
+            return True, prev
+
+    def rollback(self):
+        """
+        Move curr to next and prev to curr.
+
+        :return: tuple of whether anything changed, and the type which was next and is no longer referenced (or None)
+        """
+        with self.lock:
+            prev = self.read("prev")
+            curr = self.read("curr")
+            next = self.read("next")
+            if prev is None:
+                return False, None
+            self.write("next", curr)
+            self.write("curr", prev)
+            self.drop("prev")
+            return True, next
+
+    def drop_next(self):
+        """
+        Remove the next pointer, returning the type it referenced (or None)
+        """
+        with self.lock:
+            next = self.read("next")
+            if next is not None:
+                self.drop("next")
+            return next
+
+    def ensure_next(self, create):
+        """
+        Get the next type, creating it if there isn't one.  Only one process will create it: the others wait on the
+        lock and then find the one it made.
+
+        :param create: function of no arguments which makes the new type and returns its name
+        """
+        next = self.cache.get("next")
+        if next is not None:
+            return next
+        with self.lock:
+            next = self.read("next")
+            if next is not None:
+                return next
+            next = create()
+            self.write("next", next)
+            return next
+
+    def write_type(self, create):
+        """
+        The type to write to: next, created as by ensure_next if there isn't one, or curr while a reindex is running
+        (when the reindex copies what is written across to the type it is making).
+
+        While a reindex runs, writers hold the writes lock shared, which it can't finish under, and which re-reads
+        the cache once it has, so curr is taken from the cache then too.
+        """
+        cached = self.cache.snapshot()
+        if cached.get("reindex") is None:
+            if cached.get("next") is not None:
+                return cached["next"]
+        elif cached.get("curr") is not None:
+            return cached["curr"]
+        with self.lock:
+            if self.read("reindex") is not None:
+                return self.read("curr")
+            return self.ensure_next(create)
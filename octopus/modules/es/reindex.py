@@ -0,0 +1,217 @@
+"""
+The parts of a managed reindex of a RollingTypeESDAO which know nothing about the connection: progress reporting, the
+log of records written while the copy is running, and copying and replaying records through a transform.
+RollingTypeESDAO.reindex supplies the reads from and writes to the index.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from octopus.modules.es.pointers import write_atomic
+import json, os, threading, time
+
+class ReindexException(Exception):
+    pass
+
+
+class ReindexProgress(object):
+    """
+    The state of a reindex, saved (if a path is given) to a json file so that any process can report on it
+    """
+    def __init__(self, source, target, path=None, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._dropped = set()
+        self.data = {
+            "source" : source,
+            "target" : target,
+            "state" : "starting",
+            "total" : None,
+            "copied" : 0,
+            "failed" : 0,
+            "dropped" : 0,
+            "replayed" : 0,
+            "error" : None,
+            "started" : clock(),
+            "updated" : clock()
+        }
+        self.save()
+
+    def update(self, **kwargs):
+        with self._lock:
+            self.data.update(kwargs)
+            self._touch()
+
+    def add(self, copied=0, failed=0, replayed=0, dropped=None):
+        with self._lock:
+            self.data["copied"] += copied
+            self.data["failed"] += failed
+            self.data["replayed"] += replayed
+            if dropped:
+                self._dropped.update(dropped)
+                self.data["dropped"] = len(self._dropped)
+            self._touch()
+
+    def as_dict(self):
+        with self._lock:
+            return self._as_dict()
+
+    def save(self):
+        if self.path is not None:
+            write_atomic(self.path, json.dumps(self.as_dict()))
+
+    def _touch(self):
+        self.data["updated"] = self.clock()
+        if self.path is not None:
+            write_atomic(self.path, json.dumps(self._as_dict()))
+
+    def _as_dict(self):
+        d = dict(self.data)
+        elapsed = d["updated"] - d["started"]
+        d["elapsed"] = elapsed
+        d["rate"] = d["copied"] / elapsed if elapsed > 0 else 0
+        return d
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read the progress saved at the path, or None if there is none
+        """
+        try:
+            with open(path) as f:
+                return json.loads(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+
+class CaptureLog(object):
+    """
+    The ids of records written while a reindex is running, appended to by any process, so that they can be copied
+    again once the bulk of the copy is done
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, ids):
+        if len(ids) == 0:
+            return
+        # a single append of whole lines, so writes from different processes don't interleave
+        with open(self.path, "a") as f:
+            f.write("".join([str(id) + "\n" for id in ids]))
+
+    def drain(self):
+        """
+        Take the ids recorded so far (each once, in the order they were first recorded), leaving the log empty for
+        anything written from now on
+        """
+        draining = "{p}.{pid}.draining".format(p=self.path, pid=os.getpid())
+        try:
+            os.replace(self.path, draining)
+        except OSError:
+            return []
+        with open(draining) as f:
+            lines = f.read().splitlines()
+        os.remove(draining)
+
+        seen = set()
+        ids = []
+        for id in lines:
+            if id != "" and id not in seen:
+                seen.add(id)
+                ids.append(id)
+        return ids
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _batches(records, size):
+    batch = []
+    for r in records:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _apply(records, transform):
+    # run the records through the transform, returning the records to write and the ids of those it dropped
+    if transform is None:
+        return records, []
+    out = []
+    dropped = []
+    for r in records:
+        t = transform(r)
+        if t is None:
+            dropped.append(r.get("id"))
+        else:
+            out.append(t)
+    return out, dropped
+
+
+def _failures(results):
+    return len([r for r in results if r.get("error") is not None])
+
+
+def copy(slices, write, transform=None, progress=None, batch_size=500):
+    """
+    Copy the records from each slice, one thread per slice, through the transform to the writer.
+
+    :param slices: list of iterables of records (e.g. the slices of a sliced scroll)
+    :param write: function which takes a list of records and returns a list of result dicts with an "error" key
+    :param transform: function which takes a record and returns the record to write, or None to leave it out
+    :param progress: ReindexProgress to update as batches are written
+    """
+    def run(records):
+        for batch in _batches(records, batch_size):
+            out, dropped = _apply(batch, transform)
+            results = write(out) if len(out) > 0 else []
+            failed = _failures(results)
+            if progress is not None:
+                progress.add(copied=len(out) - failed, failed=failed, dropped=dropped)
+
+    if len(slices) == 1:
+        run(slices[0])
+        return
+
+    with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+        futures = [executor.submit(run, s) for s in slices]
+        for f in futures:
+            f.result()
+
+
+def replay(log, fetch, write, delete, transform=None, progress=None, threshold=0, max_rounds=None):
+    """
+    Copy again the records written since the copy began, round after round, until a round has no more than
+    threshold of them (so that what is left can be done with writes paused).
+
+    :param log: CaptureLog of the ids written
+    :param fetch: function which takes a list of ids and returns the records from the source which have them
+    :param write: as for copy
+    :param delete: function which takes a list of ids no longer in the source, to be removed from the target
+    :return: number of records replayed
+    """
+    total = 0
+    rounds = 0
+    while True:
+        ids = log.drain()
+        if len(ids) > 0:
+            records = list(fetch(ids))
+            found = set([r.get("id") for r in records])
+            missing = [id for id in ids if id not in found]
+            out, dropped = _apply(records, transform)
+
+            # records the transform drops are removed from the target too, in case an earlier version was copied
+            gone = missing + [d for d in dropped if d is not None]
+            if len(out) > 0:
+                write(out)
+            if len(gone) > 0:
+                delete(gone)
+            if progress is not None:
+                progress.add(replayed=len(ids), dropped=dropped)
+            total += len(ids)
+
+        rounds += 1
+        if len(ids) <= threshold or (max_rounds is not None and rounds >= max_rounds):
+            return total
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, make_response
 from octopus.core import app
 from octopus.lib import webapp, plugin
-import json
+import json, threading
 
 blueprint = Blueprint('rolling', __name__)
 
@@ -44,4 +44,55 @@ def refresh():
     for k, v in map.items():
         klazz = plugin.load_class(v)
         klazz.rolling_refresh()
-    return ""
\ No newline at end of file
+    return ""
+
+def _reindex(klazz, slices, publish):
+    try:
+        klazz.reindex(slices=slices, publish=publish)
+    except Exception:
+        # the failure is recorded in the reindex status too
+        app.logger.exception("Reindex of {x} failed".format(x=klazz.__type__))
+
+def _json_response(obj, status=200):
+    r = make_response(json.dumps(obj), status)
+    r.mimetype = "application/json"
+    return r
+
+@blueprint.route("/reindex", methods=["POST"])
+def reindex():
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict) or not isinstance(params.get("types"), list):
+        return _json_response({"error" : "Expected a JSON object with a list of types"}, 400)
+    types = params.get("types")
+    slices = params.get("slices")
+    publish = params.get("publish", True)
+    map = app.config.get("ESDAO_ROLLING_PLUGINS", {})
+
+    klazzes = [plugin.load_class(map[t]) if isinstance(t, str) and t in map else None for t in types]
+    unknown = [t for t, k in zip(types, klazzes) if k is None]
+    if len(unknown) > 0:
+        return _json_response({"error" : "Unknown rolling types", "types" : unknown}, 400)
+
+    running = [t for t, k in zip(types, klazzes) if k.reindex_running()]
+    if len(running) > 0:
+        return _json_response({"error" : "Reindex already running", "types" : running}, 409)
+
+    # a reindex can take a long time, so it is run in the background and followed with /reindex/status
+    for klazz in klazzes:
+        t = threading.Thread(target=_reindex, args=(klazz, slices, publish))
+        t.daemon = True
+        t.start()
+
+    return _json_response({"started" : types}, 202)
+
+@blueprint.route("/reindex/status", methods=["GET"])
+@webapp.jsonp
+def reindex_status():
+    map = app.config.get("ESDAO_ROLLING_PLUGINS", {})
+    resp = {}
+    for k, v in map.items():
+        klazz = plugin.load_class(v)
+        resp[k] = klazz.reindex_status()
+    r = make_response(json.dumps(resp))
+    r.mimetype = "application/json"
+    return r
@@ -0,0 +1,81 @@
+from octopus.core import app
+from octopus.lib import cli, plugin
+import argparse, sys, threading
+
+class Reindex(cli.Script):
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("type", help="rolling type to reindex, as named in ESDAO_ROLLING_PLUGINS, or the classpath of its DAO")
+        parser.add_argument("-s", "--slices", type=int, help="number of parallel slices to read the records in")
+        parser.add_argument("-n", "--no-publish", action="store_true", help="leave the new type as next, rather than publishing it")
+        parser.add_argument("-i", "--interval", type=float, default=5, help="seconds between progress reports")
+        args = parser.parse_args(argv)
+
+        classpath = app.config.get("ESDAO_ROLLING_PLUGINS", {}).get(args.type, args.type)
+        klazz = plugin.load_class(classpath)
+        if klazz is None:
+            print("Unable to load a DAO for {x}".format(x=args.type))
+            parser.print_help()
+            exit()
+
+        errors = []
+        def work():
+            try:
+                klazz.reindex(slices=args.slices, publish=not args.no_publish)
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=work)
+        t.start()
+        while t.is_alive():
+            t.join(args.interval)
+            self._report(klazz.reindex_status())
+
+        if len(errors) > 0:
+            print("Reindex failed: {x}".format(x=errors[0]), file=sys.stderr)
+            exit(1)
+
+    def _report(self, status):
+        if status is None:
+            return
+        total = status.get("total")
+        print("{s} -> {t}: {state}, {c} of {n} copied ({r:.1f} per second), {f} failed, {d} dropped, {p} replayed".format(
+            s=status.get("source"), t=status.get("target"), state=status.get("state"), c=status.get("copied"),
+            n=total if total is not None else "?", r=status.get("rate", 0), f=status.get("failed"),
+            d=status.get("dropped"), p=status.get("replayed")))
+
+
+class Retention(cli.Script):
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("daos", nargs="*", help="classpaths of the time boxed DAOs to apply retention policies to.  Defaults to ESDAO_TIME_BOX_RETENTION_DAOS")
+        parser.add_argument("-d", "--dry-run", action="store_true", help="only report what would be compacted and deleted")
+        args = parser.parse_args(argv)
+
+        classpaths = args.daos if len(args.daos) > 0 else app.config.get("ESDAO_TIME_BOX_RETENTION_DAOS", [])
+        if len(classpaths) == 0:
+            print("Please specify some DAOs, or set ESDAO_TIME_BOX_RETENTION_DAOS")
+            parser.print_help()
+            exit()
+
+        failed = False
+        for classpath in classpaths:
+            klazz = plugin.load_class(classpath)
+            try:
+                plan = klazz.apply_retention(dry_run=args.dry_run)
+            except Exception as e:
+                # carry on with the others, so one bad type doesn't stop the rest being tidied
+                print("{x}: retention failed: {e}".format(x=classpath, e=e), file=sys.stderr)
+                failed = True
+                continue
+
+            verb = "would" if args.dry_run else "did"
+            for archive, boxes in sorted(plan["compact"].items()):
+                print("{x}: {v} compact {b} into {a}".format(x=classpath, v=verb, b=", ".join(boxes), a=archive))
+            for name in plan["delete"]:
+                print("{x}: {v} delete {n}".format(x=classpath, v=verb, n=name))
+
+        if failed:
+            exit(1)
@@ -58,16 +58,97 @@ ESDAO_DEFAULT_TIME_BOX_LOOKBACK = 0
 # You can also set the look back on a per-type basis with
 # ESDAO_TIME_BOX_LOOKBACK_<UPPER CASE TYPE NAME> = <number of boxes>
 
+# Retention policy for time boxed types.  None keeps every time box forever.  Otherwise a dict of
+#   "keep" : number of time boxes (including the current one) to leave as they are,
+#   "compact" : "month", "year", etc. - once all of a month/year's boxes are older than those being kept,
+#               copy them into one archive type for that month/year (e.g. "mytype201603"), and delete them,
+#   "horizon" : number of time boxes' worth of data to keep at all; older boxes and archives are deleted
+# Any of them can be None.  Policies are applied by the "retention" CLI script, which should be run regularly
+# (e.g. daily from cron)
+ESDAO_DEFAULT_TIME_BOX_RETENTION = None
+# You can also set the policy on a per-type basis with
+# ESDAO_TIME_BOX_RETENTION_<UPPER CASE TYPE NAME> = {"keep" : 30, "compact" : "month", "horizon" : 730}
+
+# DAOs (time boxed types) to which the "retention" CLI script applies their retention policies
+ESDAO_TIME_BOX_RETENTION_DAOS = [
+    # service.dao.MyTimeBoxedDAO
+]
+
+# Should reads over several time boxes use index patterns (e.g. "mytype201603*") for runs of boxes
+# which make up a whole month, year, etc, rather than naming every box.  Turn this off if the name
+# of another type is the name of a time boxed type followed by digits.  Types with a retention policy
+# always read the months/years they have compacted through a pattern, as that covers both the archive
+# and any boxes not yet compacted into it
+ESDAO_TIME_BOX_PATTERNS = True
+
 # path to directory where the "next", "prev" and "curr" files for routing
 # requests to the correct type are placed
 from octopus.lib import paths
 ESDAO_ROLLING_DIR = paths.rel2abs(__file__, "..", "..", "..", "..", "indexdir")
 
+# how often (in seconds) each process checks the rolling pointer files for changes made by other
+# processes.  In between, the pointers are read from memory
+ESDAO_ROLLING_POLL_INTERVAL = 1
+
 # map of type names to DAOs which will have the publish() or rollback()
 # methods called on them
 # {"mytype" : "service.dao.MyDAO"}
 ESDAO_ROLLING_PLUGINS = {}
 
+# maximum number of documents to send in each request by ESDAO.bulk_save
+ESDAO_BULK_CHUNK_SIZE = 500
+
+# maximum size in bytes of the body of each request by ESDAO.bulk_save
+ESDAO_BULK_MAX_BYTES = 5242880
+
+# number of times ESDAO.bulk_save resends documents which failed with a retryable status (e.g. 429)
+ESDAO_BULK_RETRIES = 3
+
+# number of records ESDAO.iterate fetches at a time
+ESDAO_ITERATE_PAGE_SIZE = 1000
+
+# how long ES keeps an ESDAO.iterate scroll open between pages
+ESDAO_ITERATE_KEEPALIVE = "1m"
+
+# number of parallel slices in which RollingTypeESDAO.reindex reads the records to copy
+ESDAO_REINDEX_SLICES = 4
+
+# RollingTypeESDAO.reindex holds up writes to finish off once no more than this many records were written
+# during its last pass
+ESDAO_REINDEX_PAUSE_THRESHOLD = 1000
+
+# most ids ESDAO.pull_many asks for in one request
+ESDAO_MGET_CHUNK_SIZE = 1000
+
+# should ESDAO.pull and ESDAO.pull_many remember the records they get for the rest of the Flask request,
+# so that pulling the same record again is answered from memory
+ESDAO_IDENTITY_MAP = True
+
+# number of seconds ESDAO.get_all_facet_values and ESDAO.get_facets cache their results for (0 turns
+# caching off).  A class's own saves and deletes clear its cached values, but only in the process which
+# made them, so this is how out of date other processes' values can be.  Set __facet_cache_ttl__ on a
+# DAO to override this for that class
+ESDAO_FACET_CACHE_TTL = 60
+
+# number of seconds ESDAO.query caches results for (0 turns caching off).  As with facets, a class's
+# own saves and deletes clear its cached results in that process only.  Set __query_cache_ttl__ on a
+# DAO to override this for that class
+ESDAO_QUERY_CACHE_TTL = 0
+
+# most query results to cache, over all types; the least recently used are dropped first
+ESDAO_QUERY_CACHE_SIZE = 1000
+
+# number of seconds the index takes to make a write searchable (its refresh_interval).  For this long
+# after a class saves or deletes a record, its query and facet results are not cached, as they may not
+# include the change yet
+ESDAO_REFRESH_INTERVAL = 1
+
+# number of facet values ESDAO.get_all_facet_values fetches in each page of its composite aggregation
+ESDAO_FACET_PAGE_SIZE = 1000
+
+# number of values of each facet ESDAO.get_facets returns by default
+ESDAO_FACET_SIZE = 100
+
 ##############################################################
 # Query Endpoint Configuration
 ##############################################################
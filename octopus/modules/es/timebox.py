@@ -0,0 +1,192 @@
+"""
+Time period arithmetic for TimeBoxedTypeESDAO: the type names for each period, the index patterns which cover
+runs of them, so that a read over many periods is made against a few patterns rather than a long list of types, and
+the plan for which periods a retention policy compacts or deletes.
+"""
+from datetime import datetime
+import dateutil.relativedelta as relativedelta
+
+FORMAT_MAP = {
+    "year" : "%Y",
+    "month" : "%Y%m",
+    "day" : "%Y%m%d",
+    "hour" : "%Y%m%d%H",
+    "minute" : "%Y%m%d%H%M",
+    "second" : "%Y%m%d%H%M%S"
+}
+
+# granularities, coarsest first
+ORDER = ["year", "month", "day", "hour", "minute", "second"]
+
+
+def parent(granularity):
+    """
+    The next coarser granularity, or None for a year
+    """
+    i = ORDER.index(granularity)
+    return ORDER[i - 1] if i > 0 else None
+
+
+def step(granularity, n=1):
+    return relativedelta.relativedelta(**{granularity + "s" : n})
+
+
+def truncate(timestamp, granularity):
+    """
+    The start of the period of the given granularity which contains the timestamp
+    """
+    args = [timestamp.year, 1, 1, 0, 0, 0]
+    fields = [timestamp.year, timestamp.month, timestamp.day, timestamp.hour, timestamp.minute, timestamp.second]
+    for i in range(ORDER.index(granularity) + 1):
+        args[i] = fields[i]
+    return datetime(*args)
+
+
+def format_type(type, granularity, timestamp):
+    return type + timestamp.strftime(FORMAT_MAP.get(granularity))
+
+
+def parse_type(type, granularity, name):
+    """
+    The start of the period which a type name is for, or None if it isn't one of this type's names
+    """
+    if not name.startswith(type):
+        return None
+    try:
+        ts = datetime.strptime(name[len(type):], FORMAT_MAP.get(granularity))
+    except ValueError:
+        return None
+    # strptime will take single digits, so e.g. a month name could be read as a day name
+    if format_type(type, granularity, ts) != name:
+        return None
+    return ts
+
+
+def patterns(type, granularity, timestamps, latest):
+    """
+    Names which cover the types for the periods starting at the timestamps, using as few as possible.  Wherever the
+    timestamps include every period of a coarser unit, from its start up to latest, they are replaced by a wildcard
+    pattern for that unit: e.g. every day of 2016-03 becomes "type201603*".  This is repeated up to years.  Most
+    recent first.
+
+    Note that a pattern would also match the types of any other type name which is this one followed by digits.
+    """
+    level = granularity
+    items = set(timestamps)
+    names = []
+    while True:
+        up = parent(level)
+        if up is None:
+            break
+        groups = {}
+        for ts in items:
+            groups.setdefault(truncate(ts, up), []).append(ts)
+
+        promoted = set()
+        for start, members in groups.items():
+            # the periods of this level in the coarser unit, up to the latest
+            expected = 0
+            end = start + step(up)
+            ts = start
+            while ts < end and ts <= latest:
+                expected += 1
+                ts = ts + step(level)
+            if len(members) == expected:
+                promoted.add(start)
+            else:
+                names += [(ts, _name(type, granularity, level, ts)) for ts in members]
+
+        items = promoted
+        level = up
+
+    names += [(ts, _name(type, granularity, level, ts)) for ts in items]
+    names.sort(key=lambda x: x[0], reverse=True)
+    return [n for ts, n in names]
+
+
+def _name(type, granularity, level, timestamp):
+    name = format_type(type, level, timestamp)
+    if level != granularity:
+        name += "*"
+    return name
+
+
+def cutoff(latest, granularity, periods):
+    """
+    The start of the oldest of the given number of periods up to and including the one starting at latest
+    """
+    return latest - step(granularity, periods - 1)
+
+
+def retention_plan(type, granularity, names, latest, keep=None, compact=None, horizon=None):
+    """
+    Work out what a retention policy does to the existing types.
+
+    :param names: the names of the types that exist, both time boxes and archives
+    :param latest: start of the current time box
+    :param keep: number of time boxes (including the current one) to leave as they are
+    :param compact: granularity ("month", "year", ...) of the archives to copy older boxes into.  A unit is only
+        compacted once all of it is older than the boxes being kept
+    :param horizon: number of time boxes' worth of data to keep at all; boxes and archives entirely older are deleted
+    :return: dict of "compact" : {archive name : [box names]} and "delete" : [names]
+    """
+    _check_compact(granularity, compact)
+    plan = {"compact" : {}, "delete" : []}
+    keep_from = cutoff(latest, granularity, keep) if keep is not None else None
+    horizon_from = cutoff(latest, granularity, horizon) if horizon is not None else None
+
+    for name in sorted(names):
+        ts = parse_type(type, granularity, name)
+        if ts is not None:
+            if horizon_from is not None and ts < horizon_from:
+                plan["delete"].append(name)
+            elif compact is not None and keep_from is not None:
+                unit = truncate(ts, compact)
+                if unit + step(compact) <= keep_from:
+                    plan["compact"].setdefault(format_type(type, compact, unit), []).append(name)
+            continue
+
+        if compact is not None and compact != granularity:
+            unit = parse_type(type, compact, name)
+            if unit is not None and horizon_from is not None and unit + step(compact) <= horizon_from:
+                plan["delete"].append(name)
+
+    return plan
+
+
+def retained_read_types(type, granularity, timestamps, latest, keep=None, compact=None, horizon=None, use_patterns=True):
+    """
+    As patterns, but for a type with a retention policy: periods beyond the horizon are left out, and those which
+    belong to a compacted unit are read through that unit's pattern, which covers both its archive and any of its
+    boxes not yet compacted.
+
+    :param use_patterns: if False, the periods which are not compacted are named one by one rather than covered by
+        patterns.  Compacted units are still read through their pattern, as there is no knowing which of their boxes
+        are left without listing them
+    """
+    _check_compact(granularity, compact)
+    keep_from = cutoff(latest, granularity, keep) if keep is not None else None
+    horizon_from = cutoff(latest, granularity, horizon) if horizon is not None else None
+
+    recent = []
+    units = set()
+    for ts in timestamps:
+        if horizon_from is not None and ts < horizon_from:
+            continue
+        if compact is not None and keep_from is not None:
+            unit = truncate(ts, compact)
+            if unit + step(compact) <= keep_from:
+                units.add(unit)
+                continue
+        recent.append(ts)
+
+    if use_patterns:
+        names = patterns(type, granularity, recent, latest) if len(recent) > 0 else []
+    else:
+        names = [format_type(type, granularity, ts) for ts in sorted(recent, reverse=True)]
+    return names + [format_type(type, compact, u) + "*" for u in sorted(units, reverse=True)]
+
+
+def _check_compact(granularity, compact):
+    if compact is not None and ORDER.index(compact) >= ORDER.index(granularity):
+        raise ValueError("Cannot compact {g} time boxes into {c} archives".format(g=granularity, c=compact))
@@ -0,0 +1,113 @@
+"""
+Throughput benchmarks for the JPER client, run against the in-process fake JPER service
+
+    python -m octopus.modules.jper.benchmark -n 500 -l 0.02 -s 1048576 -w 4
+
+"""
+from octopus.modules.jper.client import JPER
+from octopus.modules.jper.fakeserver import FakeJPERServer
+import os, shutil, tempfile, time
+
+SINCE = "2016-01-01T00:00:00Z"
+
+
+def _time(fn):
+    start = time.perf_counter()
+    count = fn()
+    return time.perf_counter() - start, count
+
+
+def bench_listing(client, page_size=100, workers=4):
+    """
+    Time harvesting every routed notification, one page at a time against concurrent page fetching
+    """
+    def sequential():
+        return len([n for n in client.iterate_notifications(SINCE, page_size=page_size, workers=1)])
+
+    def concurrent():
+        return len([n for n in client.iterate_notifications(SINCE, page_size=page_size, workers=workers)])
+
+    return {"sequential" : _time(sequential), "concurrent" : _time(concurrent)}
+
+
+def bench_retrieval(client, count=20, segments=4):
+    """
+    Time fetching notifications and downloading their content packages, in one stream and in parallel segments
+    """
+    notes = []
+    for n in client.iterate_notifications(SINCE, page_size=count, workers=1):
+        notes.append(n)
+        if len(notes) >= count:
+            break
+    urls = [n.links[0]["url"] for n in notes]
+    out = tempfile.mkdtemp()
+
+    def get():
+        for n in notes:
+            client.get_notification(n.id)
+        return len(notes)
+
+    def download(segs):
+        def fn():
+            for i, url in enumerate(urls):
+                client.download_content(url, target_path=os.path.join(out, str(i)), segments=segs)
+            return len(urls)
+        return fn
+
+    try:
+        return {"get_notification" : _time(get), "download" : _time(download(1)), "download_segmented" : _time(download(segments))}
+    finally:
+        shutil.rmtree(out)
+
+
+def bench_submission(client, count=50, payload_size=1048576, workers=4):
+    """
+    Time creating notifications with content, one after another against bulk submission
+    """
+    d = tempfile.mkdtemp()
+    path = os.path.join(d, "content.zip")
+    with open(path, "wb") as f:
+        f.write(os.urandom(payload_size))
+
+    def sequential():
+        for i in range(count):
+            with open(path, "rb") as f:
+                client.create_notification({"event" : "publication"}, file_handle=f)
+        return count
+
+    def bulk():
+        results = client.bulk_create_notifications([({"event" : "publication"}, path)] * count, workers=workers)
+        return len([r for r in results if "error" not in r])
+
+    try:
+        return {"sequential" : _time(sequential), "bulk" : _time(bulk)}
+    finally:
+        shutil.rmtree(d)
+
+
+def report(label, results):
+    for k, (t, count) in results.items():
+        rate = count / t if t > 0 else 0
+        print("{l} {k}: {c} in {t:.3f}s, {r:.1f} per second".format(l=label, k=k, c=count, t=t, r=rate))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--notifications", type=int, default=500, help="number of notifications held by the fake service")
+    parser.add_argument("-l", "--latency", type=float, default=0.01, help="seconds the fake service waits before each response")
+    parser.add_argument("-e", "--error-rate", type=float, default=0, help="fraction of requests the fake service fails")
+    parser.add_argument("-s", "--payload-size", type=int, default=1048576, help="size in bytes of the content packages")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrency for the parallel variants")
+    parser.add_argument("-p", "--page-size", type=int, default=100, help="page size for listing notifications")
+    args = parser.parse_args()
+
+    server = FakeJPERServer(notifications=args.notifications, latency=args.latency, error_rate=args.error_rate,
+                            payload_size=args.payload_size, api_key="benchmark", seed=1).start()
+    try:
+        client = JPER(api_key="benchmark", base_url=server.url)
+        report("listing", bench_listing(client, args.page_size, args.workers))
+        report("retrieval", bench_retrieval(client, segments=args.workers))
+        report("submission", bench_submission(client, payload_size=args.payload_size, workers=args.workers))
+    finally:
+        server.stop()
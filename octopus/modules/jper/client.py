@@ -1,7 +1,9 @@
 from octopus.core import app
 from octopus.modules.jper import models
-from octopus.lib import http, dates
-import json
+from octopus.lib import http, dates, jsonstream
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import hashlib, itertools, json, os, re, requests, shutil, tempfile
 
 class JPERException(Exception):
     pass
@@ -15,6 +17,32 @@ class JPERAuthException(JPERException):
 class ValidationException(JPERException):
     pass
 
+class HarvestCheckpoint(object):
+    """
+    Records, in a json file on disk, how far through a notification harvest we have got, so that
+    JPER.iterate_notifications can pick up where it left off after a crash
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.loads(f.read())
+
+    def save(self, since, page, page_size, repository_id=None):
+        state = {"since" : since, "page" : page, "page_size" : page_size, "repository_id" : repository_id}
+        # write to a temporary file and rename it over the old one, so a crash never leaves a partial checkpoint
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps(state))
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 class JPER(object):
 
     # FilesAndJATS = "http://router.jisc.ac.uk/packages/FilesAndJATS"
@@ -60,7 +88,9 @@ class JPER(object):
 
         return url
 
-    def validate(self, notification, file_handle=None):
+    def _submit(self, endpoint, notification, file_handle=None, file_path=None, session=None):
+        # send the notification, and any content, to the endpoint and check the response for errors
+
         # turn the notification into a json string
         data = None
         if isinstance(notification, models.IncomingNotification):
@@ -69,22 +99,32 @@ class JPER(object):
             data = json.dumps(notification)
 
         # get the url that we are going to send to
-        url = self._url("validate")
+        url = self._url(endpoint)
 
         # 2016-06-20 TD : switch SSL verification off
         verify = False
-        
+
         resp = None
-        if file_handle is None:
+        if file_path is not None:
+            # send both parts as a multipart message, reading the content from disk as it is sent.  The body can only
+            # be read once, so the request is not retried
+            body = http.MultipartStream(fields=[("metadata", "metadata.json", "application/json", data)],
+                                        files=[("content", "content.zip", "application/zip", file_path)])
+            try:
+                resp = http.post(url, data=body, headers={"Content-Type" : body.content_type}, verify=verify,
+                                 retries=0, session=session)
+            finally:
+                body.close()
+        elif file_handle is None:
             # if there is no file handle supplied, send the metadata-only notification
-            resp = http.post(url, data=data, headers={"Content-Type" : "application/json"}, verify=verify)
+            resp = http.post(url, data=data, headers={"Content-Type" : "application/json"}, verify=verify, session=session)
         else:
             # otherwise send both parts as a multipart message
             files = [
                 ("metadata", ("metadata.json", data, "application/json")),
                 ("content", ("content.zip", file_handle, "application/zip"))
             ]
-            resp = http.post(url, files=files, verify=verify)
+            resp = http.post(url, files=files, verify=verify, session=session)
 
         if resp is None:
             raise JPERConnectionException("Unable to communicate with the JPER API")
@@ -95,42 +135,14 @@ class JPER(object):
         if resp.status_code == 400:
             raise ValidationException(resp.json().get("error"))
 
-        return True
-
-    def create_notification(self, notification, file_handle=None):
-        # turn the notification into a json string
-        data = None
-        if isinstance(notification, models.IncomingNotification):
-            data = notification.json()
-        else:
-            data = json.dumps(notification)
-
-        # get the url that we are going to send to
-        url = self._url("notification")
-
-        # 2016-06-20 TD : switch SSL verification off
-        verify = False
-        
-        resp = None
-        if file_handle is None:
-            # if there is no file handle supplied, send the metadata-only notification
-            resp = http.post(url, data=data, headers={"Content-Type" : "application/json"}, verify=verify)
-        else:
-            # otherwise send both parts as a multipart message
-            files = [
-                ("metadata", ("metadata.json", data, "application/json")),
-                ("content", ("content.zip", file_handle, "application/zip"))
-            ]
-            resp = http.post(url, files=files, verify=verify)
-
-        if resp is None:
-            raise JPERConnectionException("Unable to communicate with the JPER API")
+        return resp
 
-        if resp.status_code == 401:
-            raise JPERAuthException("Could not authenticate with JPER with your API key")
+    def validate(self, notification, file_handle=None, file_path=None):
+        self._submit("validate", notification, file_handle=file_handle, file_path=file_path)
+        return True
 
-        if resp.status_code == 400:
-            raise ValidationException(resp.json().get("error"))
+    def create_notification(self, notification, file_handle=None, file_path=None):
+        resp = self._submit("notification", notification, file_handle=file_handle, file_path=file_path)
 
         # extract the useful information from the acceptance response
         acc = resp.json()
@@ -139,6 +151,54 @@ class JPER(object):
 
         return id, loc
 
+    def bulk_create_notifications(self, items, workers=None, validate_only=False):
+        """
+        Submit many notifications concurrently, for bulk loads.
+
+        Each item is either a notification, or a tuple of (notification, path to content zip).  Zips are read from
+        disk as they are sent, so only the files currently being uploaded are open.  All the requests share one
+        connection pool to the JPER host, and at most twice as many items as there are workers are in flight at once.
+
+        :param items: iterable of notifications or (notification, zip path) tuples
+        :param workers: number of concurrent submissions (defaults to JPER_BULK_WORKERS)
+        :param validate_only: send the items to the validate endpoint instead of creating notifications
+        :return: list of results, in the same order as the items, each a dict of "id" and "location" (only "valid"
+            when validating), or of "error" if that item failed
+        """
+        if workers is None:
+            workers = app.config.get("JPER_BULK_WORKERS", 4)
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount(self.base_url, adapter)
+
+        def submit(item):
+            notification, file_path = item if isinstance(item, tuple) else (item, None)
+            try:
+                if validate_only:
+                    self._submit("validate", notification, file_path=file_path, session=session)
+                    return {"valid" : True}
+                resp = self._submit("notification", notification, file_path=file_path, session=session)
+                acc = resp.json()
+                return {"id" : acc.get("id"), "location" : acc.get("location")}
+            except (JPERException, requests.exceptions.RequestException, IOError, ValueError) as e:
+                return {"error" : str(e)}
+
+        results = []
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for item in items:
+                    pending.append(executor.submit(submit, item))
+                    if len(pending) >= workers * 2:
+                        results.append(pending.popleft().result())
+                while len(pending) > 0:
+                    results.append(pending.popleft().result())
+        finally:
+            session.close()
+
+        return results
+
     def get_notification(self, notification_id=None, location=None):
         # get the url that we are going to send to
         if notification_id is not None:
@@ -192,7 +252,194 @@ class JPER(object):
         # return the response object, in case the caller wants access to headers, etc.
         return resp.iter_content(chunk_size=chunk_size), resp.headers
 
-    def list_notifications(self, since, page=None, page_size=None, repository_id=None):
+    def download_content(self, url, target_path=None, store=None, container_id=None, target_name=None,
+                         segments=None, chunk_size=None, checksum=None, algorithm="md5", retries=None):
+        """
+        Download a (potentially very large) content package to a local file, or into a Store.
+
+        The download goes first to a partial file in JPER_DOWNLOAD_DIR, named after the url, so that if the
+        connection drops, or the process dies, the next attempt picks up where the last one left off using an
+        HTTP Range request, rather than starting again.  If segments is more than 1, and the server supports
+        ranges, the package is split into that many byte ranges which are fetched concurrently.
+
+        Next to the partial files is a record of the content's validator (its ETag, or Last-Modified) and how it was
+        split up.  Partial files are only picked up again if both still match, and resumed requests carry If-Range,
+        so bytes of two different versions of the content are never put together.
+
+        :param url: the content url, as found in the notification's links
+        :param target_path: local path to write the completed file to
+        :param store: alternatively, a Store to put the completed file in, under container_id and target_name
+        :param segments: number of byte ranges to download in parallel (defaults to JPER_DOWNLOAD_SEGMENTS)
+        :param chunk_size: size of the chunks read from the response (defaults to JPER_DOWNLOAD_CHUNK_SIZE)
+        :param checksum: optional expected hex digest of the content, checked before the file is handed over
+        :param algorithm: the hashlib algorithm the checksum was made with
+        :param retries: number of times to resume a range after the connection fails (defaults to JPER_DOWNLOAD_RETRIES)
+        :return: tuple of the size of the content in bytes and its hex digest
+        """
+        if target_path is None and (store is None or container_id is None or target_name is None):
+            raise JPERException("You must supply either a target_path, or a store with container_id and target_name")
+
+        if segments is None:
+            segments = app.config.get("JPER_DOWNLOAD_SEGMENTS", 1)
+        if chunk_size is None:
+            chunk_size = app.config.get("JPER_DOWNLOAD_CHUNK_SIZE", 1048576)
+        if retries is None:
+            retries = app.config.get("JPER_DOWNLOAD_RETRIES", 3)
+
+        work_dir = app.config.get("JPER_DOWNLOAD_DIR") or tempfile.gettempdir()
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        part = os.path.join(work_dir, "jper-" + hashlib.sha1(url.encode("utf-8")).hexdigest() + ".part")
+
+        # just sort out the api_key
+        full_url = self._url(url=url)
+
+        total, ranged, validator = self._content_info(full_url)
+        ranges = [(0, None)]
+        if ranged and segments > 1 and total >= segments:
+            size = total // segments
+            ranges = [(i * size, total - 1 if i == segments - 1 else (i + 1) * size - 1) for i in range(segments)]
+        self._prepare_partials(part, {"validator" : validator, "total" : total, "ranges" : ranges})
+
+        if len(ranges) > 1:
+            seg_paths = [part + str(i) for i in range(len(ranges))]
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(self._fetch_range, full_url, sp, start, end, chunk_size, retries, validator, total)
+                           for sp, (start, end) in zip(seg_paths, ranges)]
+                for f in futures:
+                    f.result()
+
+            with open(part, "wb") as out:
+                for sp in seg_paths:
+                    with open(sp, "rb") as f:
+                        shutil.copyfileobj(f, out, chunk_size)
+            for sp in seg_paths:
+                os.remove(sp)
+        else:
+            self._fetch_range(full_url, part, 0, None, chunk_size, retries, validator, total)
+
+        length = os.path.getsize(part)
+        if total is not None and length != total:
+            self._discard_partials(part)
+            raise JPERException("Downloaded {x} bytes from {y}, but expected {z}".format(x=length, y=url, z=total))
+        os.remove(part + ".json")
+
+        digest = hashlib.new(algorithm)
+        with open(part, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+        digest = digest.hexdigest()
+        if checksum is not None and checksum.lower() != digest:
+            self._discard_partials(part)
+            raise JPERException("Checksum mismatch for {y}: expected {x}, got {z}".format(x=checksum, y=url, z=digest))
+
+        if target_path is not None:
+            shutil.move(part, target_path)
+        else:
+            store.store(container_id, target_name, source_path=part)
+            os.remove(part)
+
+        return length, digest
+
+    def _content_info(self, url):
+        # ask for the first byte to find out the full length, whether the server supports ranges, and the validator
+        # to resume with (a strong ETag, or failing that Last-Modified), without reading the body
+        resp, content, downloaded_bytes = http.get_stream(url, read_stream=False, verify=False, headers={"Range" : "bytes=0-0"})
+        if resp is None:
+            return None, False, None
+        try:
+            if resp.status_code == 401:
+                raise JPERAuthException("Could not authenticate with JPER with your API key")
+
+            etag = resp.headers.get("ETag")
+            validator = etag if etag is not None and not etag.startswith("W/") else resp.headers.get("Last-Modified")
+
+            if resp.status_code == 206:
+                m = re.match(r"bytes\s+\d+-\d+/(\d+)", resp.headers.get("Content-Range", ""))
+                if m is not None:
+                    return int(m.group(1)), True, validator
+            elif resp.status_code == 200 and resp.headers.get("Content-Length") is not None:
+                return int(resp.headers.get("Content-Length")), False, validator
+            return None, False, validator
+        finally:
+            resp.close()
+
+    def _prepare_partials(self, part, layout):
+        # keep what earlier attempts downloaded only if it is of the same version of the content, split up the same
+        # way; without a validator there is no telling, so start again
+        meta = part + ".json"
+        layout = json.loads(json.dumps(layout))
+        if layout["validator"] is not None and os.path.exists(meta):
+            with open(meta) as f:
+                if json.loads(f.read()) == layout:
+                    return
+        self._discard_partials(part)
+        with open(meta, "w") as f:
+            f.write(json.dumps(layout))
+
+    def _discard_partials(self, part):
+        work_dir, name = os.path.split(part)
+        for f in os.listdir(work_dir):
+            if f.startswith(name):
+                os.remove(os.path.join(work_dir, f))
+
+    def _fetch_range(self, url, path, start, end, chunk_size, retries, validator=None, total=None):
+        # Download bytes start to end (inclusive, or to the end of the content if end is None) into the file at
+        # path, first skipping over whatever an earlier attempt already wrote there.  Dropped connections are
+        # resumed from where they got to, up to the given number of times.  Resumed requests are conditional on
+        # the validator, and every partial response is checked to start where it was asked to and to be of the
+        # expected total length
+        attempt = 0
+        while True:
+            have = os.path.getsize(path) if os.path.exists(path) else 0
+            if end is not None and start + have > end:
+                return
+
+            headers = {}
+            if start + have > 0 or end is not None:
+                headers["Range"] = "bytes={s}-{e}".format(s=start + have, e="" if end is None else end)
+                if validator is not None:
+                    headers["If-Range"] = validator
+
+            try:
+                resp, content, downloaded_bytes = http.get_stream(url, read_stream=False, verify=False, headers=headers)
+                if resp is None:
+                    raise requests.exceptions.ConnectionError("No response from " + url)
+
+                if resp.status_code == 401:
+                    raise JPERAuthException("Could not authenticate with JPER with your API key")
+
+                if resp.status_code == 416 and end is None:
+                    # we already have all of it
+                    return
+
+                mode = "ab"
+                if resp.status_code == 200 and "Range" in headers:
+                    # the server has ignored the range, or the content has changed, and it is sending the whole thing
+                    if start != 0 or end is not None:
+                        raise JPERException("{y} has changed, or does not support range requests".format(y=url))
+                    mode = "wb"
+                elif resp.status_code == 206:
+                    m = re.match(r"bytes\s+(\d+)-\d+/(\d+|\*)", resp.headers.get("Content-Range", ""))
+                    if m is None or int(m.group(1)) != start + have or (total is not None and m.group(2) != str(total)):
+                        raise JPERException("Asked {y} for bytes from {x}, but got Content-Range '{z}'".format(
+                            x=start + have, y=url, z=resp.headers.get("Content-Range")))
+                elif resp.status_code != 200:
+                    raise JPERException("Received unexpected status code from {y}: {x}".format(x=resp.status_code, y=url))
+
+                with open(path, mode) as f:
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                return
+
+            except requests.exceptions.RequestException as e:
+                attempt += 1
+                if attempt > retries:
+                    raise JPERConnectionException("Download from {y} failed after {x} attempts: {z}".format(x=attempt, y=url, z=str(e)))
+                app.logger.debug("Download from {y} interrupted, resuming (attempt {x})".format(x=attempt, y=url))
+
+    def _routed_url(self, since, page=None, page_size=None, repository_id=None):
         # check that the since date is valid, and get it into the right format
         if not hasattr(since, "strftime"):
             since = dates.parse(since)
@@ -212,14 +459,9 @@ class JPER(object):
                 raise JPERException("Unable to convert page_size argument to string")
 
         # get the url, which may contain the repository id if it is not None
-        url = self._url("routed", id=repository_id, params=params)
-
-        # 2016-06-20 TD : switch SSL verification off
-        verify = False
-        
-        # get the response object
-        resp = http.get(url, verify=verify)
+        return self._url("routed", id=repository_id, params=params)
 
+    def _check_list_response(self, resp, url):
         # check for errors or problems with the response
         if resp is None:
             raise JPERConnectionException("Unable to communicate with the JPER API")
@@ -233,22 +475,138 @@ class JPER(object):
         if resp.status_code != 200:
             raise JPERException("Received unexpected status code from {y}: {x} ".format(x=resp.status_code, y=url))
 
+    def list_notifications(self, since, page=None, page_size=None, repository_id=None):
+        url = self._routed_url(since, page=page, page_size=page_size, repository_id=repository_id)
+
+        # 2016-06-20 TD : switch SSL verification off
+        verify = False
+        
+        # get the response object
+        resp = http.get(url, verify=verify)
+        self._check_list_response(resp, url)
+
         # create the notification list object
         j = resp.json()
         return models.NotificationList(j)
 
-    def iterate_notifications(self, since, repository_id=None, page_size=100):
-        page = 1
+    def stream_notifications(self, since, page=None, page_size=None, repository_id=None, header=None, chunk_size=65536):
+        """
+        As list_notifications, but decode the response as it is downloaded, yielding the notifications one at a
+        time, so that the whole page never needs to be held in memory.
 
-        while True:
-            nl = self.list_notifications(since, page=page, page_size=page_size, repository_id=repository_id)
-            if len(nl.notifications) == 0:
-                break
-            for n in nl.notifications:
+        :param header: optional dict, which will be populated with the other fields of the notification list (total,
+            page, pageSize, etc).  Those which come after the notifications in the response are only present once
+            the iteration is complete
+        """
+        url = self._routed_url(since, page=page, page_size=page_size, repository_id=repository_id)
+
+        # 2016-06-20 TD : switch SSL verification off
+        verify = False
+
+        resp, content, downloaded_bytes = http.get_stream(url, read_stream=False, verify=verify)
+        try:
+            self._check_list_response(resp, url)
+
+            for n in jsonstream.iter_array(resp.iter_content(chunk_size=chunk_size), "notifications", header=header):
+                if "provider" in n:
+                    yield models.ProviderOutgoingNotification(n)
+                else:
+                    yield models.OutgoingNotification(n)
+        finally:
+            # release the connection, even if the caller stops early or the response can't be decoded
+            if resp is not None:
+                resp.close()
+
+    def iterate_notifications(self, since, repository_id=None, page_size=100, workers=None, checkpoint=None):
+        """
+        Iterate over all the notifications routed since the given date, in order.
+
+        With more than one worker, once the first page has told us the total, the following pages are fetched
+        concurrently (with at most twice as many pages in flight as there are workers) while the current one is
+        being worked through.
+
+        If a HarvestCheckpoint is supplied, the page number is recorded in it once all of that page's
+        notifications have been yielded.  If it already holds a checkpoint, the harvest resumes after the last
+        completed page, with the since date and page size it was started with.  The checkpoint is cleared when
+        the harvest completes.  A checkpoint from a harvest for a different repository_id is refused with a
+        JPERException, rather than resuming part way through the wrong notifications.
+
+        :param workers: number of concurrent page requests (defaults to JPER_HARVEST_WORKERS)
+        :param checkpoint: optional HarvestCheckpoint
+        """
+        if workers is None:
+            workers = app.config.get("JPER_HARVEST_WORKERS", 1)
+
+        page = 1
+        if hasattr(since, "strftime"):
+            since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if checkpoint is not None:
+            state = checkpoint.load()
+            if state is not None:
+                if state.get("repository_id") != repository_id:
+                    raise JPERException("Checkpoint at {p} is for a harvest for repository {c}, not {r}; clear it to start again".format(
+                        p=checkpoint.path, c=state.get("repository_id"), r=repository_id))
+                since = state.get("since")
+                page_size = state.get("page_size", page_size)
+                page = state.get("page") + 1
+
+        for number, notes in self._iterate_pages(since, page, page_size, repository_id, workers):
+            for n in notes:
                 yield n
-            if page * page_size >= nl.total:
-                break
-            page += 1
+            if checkpoint is not None:
+                checkpoint.save(since, number, page_size, repository_id)
+
+        if checkpoint is not None:
+            checkpoint.clear()
+
+    def _iterate_pages(self, since, page, page_size, repository_id, workers):
+        # yields (page number, iterable of notifications) for each non-empty page from the given one onwards.  The
+        # caller must have finished with one page's notifications before asking for the next page
+        def fetch(p):
+            return self.list_notifications(since, page=p, page_size=page_size, repository_id=repository_id)
+
+        if workers <= 1:
+            # one page at a time, decoded as it is downloaded
+            while True:
+                header = {}
+                notes = self.stream_notifications(since, page=page, page_size=page_size, repository_id=repository_id, header=header)
+                first = next(notes, None)
+                if first is None:
+                    break
+                yield page, itertools.chain([first], notes)
+                if page * page_size >= int(header.get("total", 0)):
+                    break
+                page += 1
+            return
+
+        nl = fetch(page)
+        notes = nl.notifications
+        if len(notes) == 0:
+            return
+        yield page, notes
+
+        # the last page we know about, which is extended if the total grows while we are harvesting
+        last = (nl.total + page_size - 1) // page_size
+        next_page = page + 1
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while next_page <= last or len(pending) > 0:
+                while next_page <= last and len(pending) < workers * 2:
+                    pending.append((next_page, executor.submit(fetch, next_page)))
+                    next_page += 1
+
+                number, future = pending.popleft()
+                nl = future.result()
+                notes = nl.notifications
+                if len(notes) == 0:
+                    break
+                yield number, notes
+                last = max(last, (nl.total + page_size - 1) // page_size)
+        finally:
+            for number, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def record_retrieval(self, notification_id, content_id=None):
         # FIXME: not yet implemented, while waiting to see how retrieval finally
@@ -0,0 +1,219 @@
+"""
+An in-process stand-in for the JPER API, for testing and load testing the client without touching a real service.
+
+    from octopus.modules.jper.fakeserver import FakeJPERServer
+    from octopus.modules.jper.client import JPER
+
+    server = FakeJPERServer(notifications=1000, latency=0.05, error_rate=0.01, payload_size=10485760)
+    server.start()
+    try:
+        client = JPER(api_key="test", base_url=server.url)
+        for n in client.iterate_notifications("2016-01-01T00:00:00Z"):
+            ...
+    finally:
+        server.stop()
+
+"""
+from flask import Flask, request, jsonify, Response
+from werkzeug.serving import make_server, WSGIRequestHandler
+import json, random, re, threading, time, uuid
+
+class FakeJPER(object):
+    """
+    The state and behaviour of the fake service: the notifications it holds, and how slow and unreliable it is.
+
+    :param notifications: number of routed notifications to start with
+    :param latency: seconds to wait before answering each request, or a (min, max) tuple to pick from at random
+    :param error_rate: fraction of requests (0 - 1) to answer with a 500
+    :param payload_size: size in bytes of each notification's content package
+    :param api_key: if set, requests without this api_key are refused with a 401
+    :param seed: seed for the random latencies and errors, for repeatable runs
+    """
+    def __init__(self, notifications=0, latency=0, error_rate=0, payload_size=1024, api_key=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.api_key = api_key
+        self.random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.notifications = []
+        self.requests = 0
+        self._payload = bytes(bytearray(i % 256 for i in range(payload_size)))
+        for i in range(notifications):
+            self.add_notification({"event" : "publication", "metadata" : {"title" : "Notification " + str(i)}})
+
+    def add_notification(self, data):
+        with self._lock:
+            note = dict(data)
+            note["id"] = uuid.uuid4().hex
+            note["links"] = [{"type" : "package", "format" : "application/zip",
+                              "url" : "/notification/" + note["id"] + "/content",
+                              "packaging" : "https://pubrouter.jisc.ac.uk/FilesAndJATS"}]
+            self.notifications.append(note)
+            return note
+
+    def get_notification(self, notification_id):
+        with self._lock:
+            for n in self.notifications:
+                if n["id"] == notification_id:
+                    return n
+        return None
+
+    def payload(self):
+        return self._payload
+
+    def delay(self):
+        if isinstance(self.latency, tuple):
+            return self.random.uniform(*self.latency)
+        return self.latency
+
+    def fail(self):
+        with self._lock:
+            self.requests += 1
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def _error(status, message):
+    resp = jsonify({"error" : message})
+    resp.status_code = status
+    return resp
+
+
+def _outgoing(note):
+    # the links are held relative to the service, and made absolute for whoever is asking
+    note = dict(note)
+    root = request.url_root.rstrip("/")
+    note["links"] = [dict(l, url=root + l["url"]) for l in note.get("links", [])]
+    return note
+
+
+def make_app(fake):
+    """
+    Make the Flask app which serves the JPER API endpoints the client uses, backed by the given FakeJPER
+    """
+    app = Flask("fakejper")
+
+    @app.before_request
+    def behave():
+        d = fake.delay()
+        if d > 0:
+            time.sleep(d)
+        if fake.fail():
+            return _error(500, "Simulated server error")
+        if fake.api_key is not None and request.values.get("api_key") != fake.api_key:
+            return _error(401, "Invalid api key")
+
+    def incoming():
+        # the metadata of an incoming notification, from either a json body or the metadata part of a multipart one
+        if "metadata" in request.files:
+            md = request.files["metadata"].read()
+            if "content" not in request.files:
+                raise ValueError("Multipart request must contain content")
+            request.files["content"].read()
+        else:
+            md = request.get_data()
+        return json.loads(md)
+
+    @app.route("/validate", methods=["POST"])
+    def validate():
+        try:
+            incoming()
+        except ValueError as e:
+            return _error(400, str(e))
+        return "", 204
+
+    @app.route("/notification", methods=["POST"])
+    def create():
+        try:
+            data = incoming()
+        except ValueError as e:
+            return _error(400, str(e))
+        note = fake.add_notification(data)
+        resp = jsonify({"status" : "accepted", "id" : note["id"], "location" : request.url_root + "notification/" + note["id"]})
+        resp.status_code = 202
+        return resp
+
+    @app.route("/notification/<notification_id>")
+    def notification(notification_id):
+        note = fake.get_notification(notification_id)
+        if note is None:
+            return _error(404, "Not found")
+        return jsonify(_outgoing(note))
+
+    @app.route("/routed", defaults={"repository_id" : None})
+    @app.route("/routed/<repository_id>")
+    def routed(repository_id):
+        since = request.values.get("since")
+        if since is None:
+            return _error(400, "Missing since parameter")
+        try:
+            page = int(request.values.get("page", 1))
+            page_size = int(request.values.get("pageSize", 25))
+        except ValueError:
+            return _error(400, "page and pageSize must be integers")
+
+        with fake._lock:
+            total = len(fake.notifications)
+            notes = fake.notifications[(page - 1) * page_size:page * page_size]
+        return jsonify({"since" : since, "page" : page, "pageSize" : page_size,
+                        "timestamp" : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                        "total" : total, "notifications" : [_outgoing(n) for n in notes]})
+
+    @app.route("/notification/<notification_id>/content")
+    def content(notification_id):
+        if fake.get_notification(notification_id) is None:
+            return _error(404, "Not found")
+
+        payload = fake.payload()
+        total = len(payload)
+        # the payload only depends on its size, so that will do for a validator
+        etag = '"payload-{t}"'.format(t=total)
+        rng = request.headers.get("Range")
+        if rng is None or request.headers.get("If-Range", etag) != etag:
+            return Response(payload, mimetype="application/zip", headers={"Accept-Ranges" : "bytes", "ETag" : etag})
+
+        m = re.match(r"bytes=(\d+)-(\d*)", rng)
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else total - 1
+        if start >= total:
+            return Response(status=416, headers={"Content-Range" : "bytes */{t}".format(t=total)})
+        end = min(end, total - 1)
+        return Response(payload[start:end + 1], status=206, mimetype="application/zip",
+                        headers={"Content-Range" : "bytes {s}-{e}/{t}".format(s=start, e=end, t=total),
+                                 "Accept-Ranges" : "bytes", "ETag" : etag})
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class FakeJPERServer(object):
+    """
+    Runs a FakeJPER on a local port (by default, any free one) in a background thread.  Takes the same keyword
+    arguments as FakeJPER.  Requests are not logged unless log_requests is set.
+    """
+    def __init__(self, host="127.0.0.1", port=0, log_requests=False, **kwargs):
+        self.fake = FakeJPER(**kwargs)
+        handler = WSGIRequestHandler if log_requests else _QuietRequestHandler
+        self._server = make_server(host, port, make_app(self.fake), threaded=True, request_handler=handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{h}:{p}".format(h=self._server.host, p=self._server.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -689,9 +689,8 @@ class NotificationList(dataobj.DataObj):
     def notifications(self):
         notes = self._get_list("notifications")
         if len(notes) > 0:
-            if "provider" in notes[0]:
-                return [ProviderOutgoingNotification(n) for n in self._get_list("notifications")]
-            return [OutgoingNotification(n) for n in self._get_list("notifications")]
+            klazz = ProviderOutgoingNotification if "provider" in notes[0] else OutgoingNotification
+            return [klazz(n) for n in notes]
         return []
 
     @notifications.setter
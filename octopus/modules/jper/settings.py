@@ -7,3 +7,23 @@ JPER_BASE_URL = "https://www.oa-deepgreen.de/api/v1"
 # API key to use for authenticated requests against JPER API
 JPER_API_KEY = ""
 
+
+# number of pages of notifications to request concurrently when harvesting with iterate_notifications.
+# With 1, each page is decoded as it is downloaded, so only one notification need be held at a time
+JPER_HARVEST_WORKERS = 1
+
+# directory in which content packages are downloaded by download_content, before being moved to their final
+# location.  Partial downloads are left here to be resumed.  None uses the system temporary directory
+JPER_DOWNLOAD_DIR = None
+
+# size of the chunks read from the connection when downloading content
+JPER_DOWNLOAD_CHUNK_SIZE = 1048576
+
+# number of byte ranges to download concurrently for each content package
+JPER_DOWNLOAD_SEGMENTS = 1
+
+# number of times to resume a download after the connection drops
+JPER_DOWNLOAD_RETRIES = 3
+
+# number of notifications to submit concurrently in bulk_create_notifications
+JPER_BULK_WORKERS = 4
@@ -0,0 +1,20 @@
+from flask import Blueprint, make_response
+from octopus.lib import http, webapp
+import json
+
+blueprint = Blueprint('metrics', __name__)
+
+@blueprint.route("/http", methods=["GET"])
+def http_metrics():
+    # Prometheus text exposition format
+    r = make_response(http.metrics.prometheus())
+    r.mimetype = "text/plain"
+    r.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return r
+
+@blueprint.route("/http.json", methods=["GET"])
+@webapp.jsonp
+def http_metrics_json():
+    r = make_response(json.dumps(http.metrics.snapshot()))
+    r.mimetype = "application/json"
+    return r
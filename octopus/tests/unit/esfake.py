@@ -0,0 +1,468 @@
+"""
+An in-memory stand-in for Elasticsearch, for testing the ESDAO wiring (the urls and parameters it sends, how it reads
+the responses, its caches) without a cluster.  It patches the esprit.raw calls which octopus.modules.es.dao makes, and
+the record-level calls of esprit's DomainObject, so that every type, record and request is held in a FakeES.
+
+Where esprit itself is not installed, load_esprit puts a minimal stand-in for it in sys.modules, with just enough for
+the DAO modules to import: every call the DAO makes on it is patched by FakeES.
+"""
+from contextlib import ExitStack
+from fnmatch import fnmatch
+from unittest import mock
+from octopus.core import app
+from octopus.lib import http
+import json, sys, threading, types, urllib.parse, uuid, zlib
+
+# the esprit.raw calls which FakeES answers
+RAW_CALLS = ["elasticsearch_url", "_do_post", "_do_get", "_do_delete", "type_exists", "delete", "put_mapping",
+             "initialise_scroll", "unpack_scroll", "scroll_next", "scroll_timedout"]
+
+# the DomainObject calls which FakeES answers
+RECORD_CALLS = ["save", "delete", "pull", "query", "delete_by_query"]
+
+
+def load_esprit():
+    """
+    The esprit package, or a stand-in for it if it is not installed.  Also gives the app the configuration the ES
+    module needs to be imported.
+    """
+    from octopus.modules.es import settings
+    for k in dir(settings):
+        if k.isupper():
+            app.config.setdefault(k, getattr(settings, k))
+    app.config.setdefault("ELASTIC_INDEX_PER_TYPE", True)
+
+    try:
+        import esprit
+        return esprit
+    except ImportError:
+        pass
+
+    esprit = types.ModuleType("esprit")
+    raw = types.ModuleType("esprit.raw")
+    dao = types.ModuleType("esprit.dao")
+    mappings = types.ModuleType("esprit.mappings")
+
+    class Connection(object):
+        def __init__(self, host, index, port=9200, auth=None, verify_ssl=True, index_per_type=False):
+            self.host = host if host is None or host.startswith("http") else "http://" + host
+            self.index = index
+            self.port = port
+            self.auth = auth
+            self.verify_ssl = verify_ssl
+            self.index_per_type = index_per_type
+
+    def unpatched(name):
+        def call(*args, **kwargs):
+            raise NotImplementedError("esprit is not installed, and {x} has not been patched by FakeES".format(x=name))
+        return call
+
+    raw.Connection = Connection
+    raw.INDEX_PER_TYPE_SUBSTITUTE = "_doc"
+    for name in RAW_CALLS:
+        setattr(raw, name, unpatched(name))
+
+    class DomainObject(object):
+        __type__ = None
+        __conn__ = None
+
+        def __init__(self, raw=None):
+            self.data = raw if raw is not None else {}
+
+        @property
+        def id(self):
+            return self.data.get("id")
+
+        @classmethod
+        def makeid(cls):
+            return uuid.uuid4().hex
+
+        @classmethod
+        def dynamic_read_types(cls):
+            return None
+
+        @classmethod
+        def dynamic_write_type(cls):
+            return None
+
+    for name in RECORD_CALLS:
+        setattr(DomainObject, name, unpatched(name))
+    dao.DomainObject = DomainObject
+
+    mappings.default_mapping = lambda: {"properties" : {}}
+    mappings.mappings = lambda t: {t : {t : mappings.default_mapping()}}
+
+    esprit.raw = raw
+    esprit.dao = dao
+    esprit.mappings = mappings
+    sys.modules["esprit"] = esprit
+    sys.modules["esprit.raw"] = raw
+    sys.modules["esprit.dao"] = dao
+    sys.modules["esprit.mappings"] = mappings
+    return esprit
+
+
+def _response(status, obj=None):
+    return http.MockResponse(status, json.dumps(obj).encode("utf-8") if obj is not None else b"")
+
+
+class FakeES(object):
+    """
+    Types of records, and the requests made against them.
+
+    :ivar types: {type name : {id : source}}
+    :ivar requests: list of (method, endpoint, types, params, body) for every request made through esprit.raw
+    :ivar cleared: the scroll ids which have been cleared
+    :ivar hooks: {endpoint : function(types, body)} called before each request to the endpoint; if it returns a
+        response, that is sent instead
+    :ivar on_save: function(type, source) called by DomainObject.save once it has worked out the type to write to,
+        and before it writes
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.types = {}
+        self.requests = []
+        self.cleared = []
+        self.hooks = {}
+        self.on_save = None
+        self._scrolls = {}
+
+    def patch(self):
+        """
+        A context manager in which esprit is answered by this FakeES
+        """
+        esprit = load_esprit()
+        stack = ExitStack()
+        for name in RAW_CALLS:
+            stack.enter_context(mock.patch.object(esprit.raw, name, getattr(self, name)))
+        stack.enter_context(mock.patch.object(esprit.dao.DomainObject, "save", self._save_method()))
+        stack.enter_context(mock.patch.object(esprit.dao.DomainObject, "delete", self._delete_method()))
+        stack.enter_context(mock.patch.object(esprit.dao.DomainObject, "pull", classmethod(self._pull_method())))
+        stack.enter_context(mock.patch.object(esprit.dao.DomainObject, "query", classmethod(self._query_method())))
+        stack.enter_context(mock.patch.object(esprit.dao.DomainObject, "delete_by_query", classmethod(self._delete_by_query_method())))
+        return stack
+
+    ######################################################
+    # The records
+
+    def put(self, type, records):
+        with self.lock:
+            docs = self.types.setdefault(type, {})
+            for r in records:
+                docs[r["id"]] = json.loads(json.dumps(r))
+
+    def ids(self, type):
+        with self.lock:
+            return sorted(self.types.get(type, {}).keys())
+
+    def resolve(self, spec, ignore_unavailable=False):
+        """
+        The existing types named by a type, list of types, comma separated list or pattern, or None if any named
+        type doesn't exist (and ignore_unavailable is not set)
+        """
+        if isinstance(spec, list):
+            spec = ",".join(spec)
+        names = []
+        for name in spec.split(","):
+            if "*" in name:
+                names += sorted([t for t in self.types.keys() if fnmatch(t, name)])
+            elif name in self.types:
+                names.append(name)
+            elif not ignore_unavailable:
+                return None
+        return names
+
+    def search(self, names, body):
+        """
+        The hits in the types for the query (match_all, ids, term or bool of those), in id order
+        """
+        body = body or {}
+        query = body.get("query", {"match_all" : {}})
+        hits = []
+        with self.lock:
+            for t in names:
+                for id, source in sorted(self.types.get(t, {}).items()):
+                    if not _matches(query, id, source):
+                        continue
+                    sl = body.get("slice")
+                    if sl is not None and zlib.crc32(id.encode("utf-8")) % sl["max"] != sl["id"]:
+                        continue
+                    hits.append({"_index" : t, "_id" : id, "_source" : _fields(source, body.get("_source"))})
+        return hits
+
+    ######################################################
+    # esprit.raw
+
+    def elasticsearch_url(self, conn, type=None, endpoint=None, params=None, omit_index=False):
+        if isinstance(type, list):
+            type = ",".join(type)
+        url = "{h}:{p}/{i}/{t}/{e}".format(h=conn.host, p=conn.port, i=conn.index, t=type or "", e=endpoint or "")
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        return url
+
+    def _parse(self, url):
+        parts = urllib.parse.urlparse(url)
+        path = [p for p in parts.path.split("/") if p]
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        if len(path) >= 3:
+            return path[-1], urllib.parse.unquote(path[-2]), params
+        return "/".join(path), None, params
+
+    def _request(self, method, url, data):
+        endpoint, type, params = self._parse(url)
+        body = data
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        if body and endpoint != "_bulk":
+            body = json.loads(body)
+        with self.lock:
+            self.requests.append((method, endpoint, type, params, body))
+        hook = self.hooks.get(endpoint)
+        if hook is not None:
+            resp = hook(type, body)
+            if resp is not None:
+                return resp
+        return endpoint, type, params, body
+
+    def _do_post(self, url, conn, data=None, headers=None, **kwargs):
+        req = self._request("POST", url, data)
+        if not isinstance(req, tuple):
+            return req
+        endpoint, type, params, body = req
+        if endpoint == "_bulk":
+            return self._bulk(type, body)
+        if endpoint == "_refresh":
+            return _response(200, {})
+
+        ignore = params.get("ignore_unavailable") == "true"
+        with self.lock:
+            names = self.resolve(type, ignore_unavailable=ignore)
+            if names is None:
+                return _response(404, {"error" : "no such index"})
+            if endpoint == "_count":
+                return _response(200, {"count" : len(self.search(names, body))})
+            if endpoint == "_mget":
+                docs = []
+                for d in body.get("docs", []):
+                    source = self.types[names[0]].get(d["_id"])
+                    doc = {"_id" : d["_id"], "found" : source is not None}
+                    if source is not None:
+                        doc["_source"] = _fields(source, d.get("_source"))
+                    docs.append(doc)
+                return _response(200, {"docs" : docs})
+            if endpoint == "_search":
+                return _response(200, self._search_response(names, body))
+        return _response(400, {"error" : "unsupported endpoint " + endpoint})
+
+    def _do_get(self, url, conn, **kwargs):
+        req = self._request("GET", url, None)
+        if not isinstance(req, tuple):
+            return req
+        endpoint, type, params, body = req
+        if endpoint == "_mapping":
+            with self.lock:
+                names = self.resolve(type, ignore_unavailable=True)
+                if len(names) == 0:
+                    return _response(404, {"error" : "no such index"})
+                if conn.index_per_type:
+                    return _response(200, dict([(conn.index + "-" + n, {"mappings" : {}}) for n in names]))
+                return _response(200, {conn.index : {"mappings" : dict([(n, {}) for n in names])}})
+        return _response(400, {"error" : "unsupported endpoint " + endpoint})
+
+    def _do_delete(self, url, conn, data=None, headers=None, **kwargs):
+        req = self._request("DELETE", url, data)
+        if not isinstance(req, tuple):
+            return req
+        endpoint, type, params, body = req
+        if endpoint == "_search/scroll":
+            with self.lock:
+                for sid in body.get("scroll_id", []):
+                    self.cleared.append(sid)
+                    self._scrolls.pop(sid, None)
+            return _response(200, {"succeeded" : True})
+        return _response(400, {"error" : "unsupported endpoint " + endpoint})
+
+    def type_exists(self, conn, type, es_version=None):
+        with self.lock:
+            return type in self.types
+
+    def delete(self, conn, type=None, id=None):
+        with self.lock:
+            self.requests.append(("DELETE", None, type, {}, None))
+            self.types.pop(type, None)
+        return _response(200, {})
+
+    def put_mapping(self, conn, type=None, mapping=None, make_index=True, es_version=None):
+        with self.lock:
+            self.types.setdefault(type, {})
+        return _response(200, {})
+
+    def initialise_scroll(self, conn, type=None, query=None, keepalive="1m"):
+        if isinstance(type, list):
+            type = ",".join(type)
+        with self.lock:
+            self.requests.append(("POST", "_search?scroll", type, {"scroll" : keepalive}, query))
+        hook = self.hooks.get("_search?scroll")
+        if hook is not None:
+            resp = hook(type, query)
+            if resp is not None:
+                return resp
+        with self.lock:
+            names = self.resolve(type)
+            if names is None:
+                return _response(404, {"error" : "no such index"})
+            hits = self.search(names, query)
+            sid = uuid.uuid4().hex
+            size = query.get("size", 10)
+            self._scrolls[sid] = (hits[size:], size)
+            return _response(200, {"_scroll_id" : sid, "hits" : {"hits" : hits[:size]}})
+
+    def unpack_scroll(self, resp):
+        j = resp.json()
+        return [h["_source"] for h in j.get("hits", {}).get("hits", [])], j.get("_scroll_id")
+
+    def scroll_next(self, conn, scroll_id, keepalive="1m"):
+        with self.lock:
+            if scroll_id not in self._scrolls:
+                return _response(404, {"error" : "no such scroll"})
+            hits, size = self._scrolls[scroll_id]
+            self._scrolls[scroll_id] = (hits[size:], size)
+            return _response(200, {"_scroll_id" : scroll_id, "hits" : {"hits" : hits[:size]}})
+
+    def scroll_timedout(self, resp):
+        return False
+
+    def _bulk(self, type, body):
+        lines = [l for l in body.split("\n") if l]
+        items = []
+        with self.lock:
+            docs = self.types.setdefault(type, {})
+            i = 0
+            while i < len(lines):
+                action = json.loads(lines[i])
+                if "index" in action:
+                    id = action["index"]["_id"]
+                    docs[id] = json.loads(lines[i + 1])
+                    items.append({"index" : {"_id" : id, "status" : 201}})
+                    i += 2
+                else:
+                    id = action["delete"]["_id"]
+                    found = docs.pop(id, None) is not None
+                    items.append({"delete" : {"_id" : id, "status" : 200 if found else 404}})
+                    i += 1
+        return _response(200, {"errors" : False, "items" : items})
+
+    def _search_response(self, names, body):
+        hits = self.search(names, body)
+        resp = {"hits" : {"total" : {"value" : len(hits)}, "hits" : hits[:body.get("size", 10)]}}
+        aggs = body.get("aggs")
+        if aggs:
+            resp["aggregations"] = dict([(name, _aggregate(agg, hits)) for name, agg in aggs.items()])
+        return resp
+
+    ######################################################
+    # esprit.dao.DomainObject
+
+    def _save_method(self):
+        es = self
+        def save(obj, conn=None, type=None, **kwargs):
+            if obj.data.get("id") is None:
+                obj.data["id"] = obj.makeid()
+            t = type or obj.dynamic_write_type() or obj.__type__
+            if es.on_save is not None:
+                es.on_save(t, obj.data)
+            es.put(t, [obj.data])
+        return save
+
+    def _delete_method(self):
+        es = self
+        def delete(obj, conn=None, type=None, **kwargs):
+            t = type or obj.dynamic_write_type() or obj.__type__
+            with es.lock:
+                es.types.get(t, {}).pop(obj.id, None)
+        return delete
+
+    def _pull_method(self):
+        es = self
+        def pull(cls, id_, conn=None, wrap=True, types=None, **kwargs):
+            with es.lock:
+                names = es.resolve(types or cls.dynamic_read_types() or cls.__type__, ignore_unavailable=True)
+                hits = es.search(names, {"query" : {"ids" : {"values" : [id_]}}})
+            if len(hits) == 0:
+                return None
+            return cls(hits[0]["_source"]) if wrap else hits[0]["_source"]
+        return pull
+
+    def _query_method(self):
+        es = self
+        def query(cls, q=None, conn=None, types=None, **kwargs):
+            with es.lock:
+                es.requests.append(("POST", "_search", types, {}, q))
+                names = es.resolve(types or cls.dynamic_read_types() or cls.__type__, ignore_unavailable=True)
+                return es._search_response(names, q or {})
+        return query
+
+    def _delete_by_query_method(self):
+        es = self
+        def delete_by_query(cls, conn, type, query, es_version=None):
+            with es.lock:
+                es.requests.append(("DELETE", "_query", type, {}, query))
+                names = es.resolve(type, ignore_unavailable=True)
+                for hit in es.search(names, query):
+                    es.types[hit["_index"]].pop(hit["_id"], None)
+        return delete_by_query
+
+
+def _matches(query, id, source):
+    if "match_all" in query:
+        return True
+    if "ids" in query:
+        return id in query["ids"].get("values", [])
+    if "term" in query:
+        field, value = list(query["term"].items())[0]
+        v = source.get(field)
+        return value in v if isinstance(v, list) else v == value
+    if "bool" in query:
+        clauses = query["bool"].get("must", []) + query["bool"].get("filter", [])
+        return all([_matches(c, id, source) for c in clauses])
+    raise ValueError("FakeES doesn't understand the query {x}".format(x=query))
+
+
+def _fields(source, fields):
+    if fields is None or fields is True:
+        return source
+    if fields is False:
+        return {}
+    return dict([(k, v) for k, v in source.items() if k in fields])
+
+
+def _values(hits, field):
+    counts = {}
+    for h in hits:
+        v = h["_source"].get(field)
+        for x in (v if isinstance(v, list) else [v]):
+            if x is not None:
+                counts[x] = counts.get(x, 0) + 1
+    return counts
+
+
+def _aggregate(agg, hits):
+    if "terms" in agg:
+        counts = _values(hits, agg["terms"]["field"])
+        keys = sorted(counts.keys(), key=lambda k: (-counts[k], k))[:agg["terms"].get("size", 10)]
+        return {"buckets" : [{"key" : k, "doc_count" : counts[k]} for k in keys]}
+    if "composite" in agg:
+        comp = agg["composite"]
+        name, source = list(comp["sources"][0].items())[0]
+        counts = _values(hits, source["terms"]["field"])
+        keys = sorted(counts.keys())
+        after = comp.get("after")
+        if after is not None:
+            keys = [k for k in keys if k > after[name]]
+        keys = keys[:comp.get("size", 10)]
+        result = {"buckets" : [{"key" : {name : k}, "doc_count" : counts[k]} for k in keys]}
+        if len(keys) > 0:
+            result["after_key"] = {name : keys[-1]}
+        return result
+    raise ValueError("FakeES doesn't understand the aggregation {x}".format(x=agg))
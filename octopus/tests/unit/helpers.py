@@ -0,0 +1,10 @@
+"""
+Things shared between the unit tests
+"""
+
+class Clock(object):
+    # a clock which only moves when it is told to, to stand in for time.monotonic
+    def __init__(self, now=0.0):
+        self.now = now
+    def __call__(self):
+        return self.now
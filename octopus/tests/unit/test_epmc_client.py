@@ -0,0 +1,99 @@
+from unittest import TestCase
+from unittest import mock
+from octopus.core import app
+from octopus.lib import http
+from octopus.modules.epmc import client
+import json, urllib.parse
+
+def _result(doi=None, pmid=None, pmcid=None):
+    r = {}
+    if doi is not None:
+        r["doi"] = doi
+    if pmid is not None:
+        r["pmid"] = pmid
+    if pmcid is not None:
+        r["pmcid"] = pmcid
+    return r
+
+class TestEPMCClient(TestCase):
+    def setUp(self):
+        self.old_api = app.config.get("EPMC_REST_API")
+        app.config["EPMC_REST_API"] = "http://epmc/"
+        self.urls = []
+
+    def tearDown(self):
+        app.config["EPMC_REST_API"] = self.old_api
+
+    def _responder(self, records, fail_batches=False, fail_singles=None):
+        def get(url, *args, **kwargs):
+            self.urls.append(url)
+            q = urllib.parse.unquote_plus(url.split("search/query=")[1].split("&")[0])
+            if fail_batches and " OR " in q:
+                return http.MockResponse(500, b"")
+            if fail_singles is not None and any(v in q for v in fail_singles):
+                return http.MockResponse(500, b"")
+            found = [r for r in records if any('"' + v + '"' in q or ':' + v in q for v in r.values())]
+            body = {"hitCount" : len(found), "resultList" : {"result" : found}}
+            return http.MockResponse(200, json.dumps(body).encode("utf-8"))
+        return get
+
+    def test_01_get_by_dois(self):
+        records = [_result(doi="10.1234/ABC"), _result(doi="10.1234/def")]
+        with mock.patch("octopus.lib.http.get", side_effect=self._responder(records)):
+            res = client.EuropePMC.get_by_dois(["10.1234/abc", "doi:10.1234/def", "10.1234/ghi", "notadoi"], batch_size=10)
+
+        assert sorted(res.keys()) == ["10.1234/abc", "10.1234/def", "10.1234/ghi"]
+        assert len(res["10.1234/def"]) == 1
+        assert res["10.1234/def"][0].doi == "10.1234/def"
+        assert res["10.1234/ghi"] == []
+        assert len(self.urls) == 1
+
+    def test_02_batches(self):
+        records = [_result(pmid=str(i)) for i in range(1, 6)]
+        with mock.patch("octopus.lib.http.get", side_effect=self._responder(records)):
+            res = client.EuropePMC.get_by_pmids([str(i) for i in range(1, 6)], batch_size=2, workers=2)
+
+        assert len(self.urls) == 3
+        for i in range(1, 6):
+            assert len(res[str(i)]) == 1
+
+    def test_03_fallback(self):
+        records = [_result(pmcid="PMC12345"), _result(pmcid="PMC23456")]
+        with mock.patch("octopus.lib.http.get", side_effect=self._responder(records, fail_batches=True)):
+            res = client.EuropePMC.get_by_pmcids(["12345", "PMC23456"])
+
+        # one failed batch, then one request per identifier
+        assert len(self.urls) == 3
+        assert res["PMC12345"][0].pmcid == "PMC12345"
+        assert res["PMC23456"][0].pmcid == "PMC23456"
+
+    def test_04_iterate(self):
+        pages = {
+            "*" : ([_result(pmid="1"), _result(pmid="2")], "AAA"),
+            "AAA" : ([_result(pmid="3"), _result(pmid="4")], "BBB"),
+            "BBB" : ([_result(pmid="5")], "BBB")
+        }
+
+        def get(url, *args, **kwargs):
+            self.urls.append(url)
+            assert "pageSize=2" in url
+            cursor = urllib.parse.unquote_plus(url.split("cursorMark=")[1])
+            results, nxt = pages[cursor]
+            body = {"hitCount" : 5, "nextCursorMark" : nxt, "resultList" : {"result" : results}}
+            return http.MockResponse(200, json.dumps(body).encode("utf-8"))
+
+        for prefetch in [True, False]:
+            self.urls = []
+            with mock.patch("octopus.lib.http.get", side_effect=get):
+                pmids = [md.pmid for md in client.EuropePMC.iterate("ISSN:1234-5678", page_size=2, prefetch=prefetch)]
+            assert pmids == ["1", "2", "3", "4", "5"]
+            assert len(self.urls) == 3
+
+    def test_05_fallback_failure(self):
+        records = [_result(pmcid="PMC12345"), _result(pmcid="PMC23456")]
+        with mock.patch("octopus.lib.http.get", side_effect=self._responder(records, fail_batches=True, fail_singles=["PMC12345"])):
+            res = client.EuropePMC.get_by_pmcids(["12345", "PMC23456"])
+
+        # the identifier whose own lookup failed is reported as not found, without losing the other
+        assert res["PMC12345"] == []
+        assert res["PMC23456"][0].pmcid == "PMC23456"
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from octopus.modules.es import bulk
+import json
+
+def _entries(n):
+    return [(str(i), bulk.index_lines(str(i), {"id" : str(i), "value" : "x" * i})) for i in range(n)]
+
+class TestESBulk(TestCase):
+    def test_01_index_lines(self):
+        lines = bulk.index_lines("abc", {"id" : "abc", "title" : "café"}).decode("utf-8").split("\n")
+        assert json.loads(lines[0]) == {"index" : {"_id" : "abc"}}
+        assert json.loads(lines[1]) == {"id" : "abc", "title" : "café"}
+        assert lines[2] == ""
+
+    def test_02_chunk(self):
+        entries = _entries(10)
+        chunks = list(bulk.chunk(iter(entries), 4))
+        assert [len(c) for c in chunks] == [4, 4, 2]
+
+        # the byte limit splits chunks early, but never leaves one empty
+        sizes = [len(l) for i, l in entries]
+        chunks = list(bulk.chunk(iter(entries), 100, max_bytes=sizes[9] - 1))
+        assert sum([len(c) for c in chunks]) == 10
+        for c in chunks:
+            assert len(c) == 1 or sum([len(l) for i, l in c]) <= sizes[9] - 1
+        assert chunks[-1] == [entries[9]]
+
+    def test_03_send_chunk_retries_failed_items(self):
+        entries = _entries(4)
+        bodies = []
+
+        def send(body):
+            ids = [json.loads(l)["index"]["_id"] for l in body.decode("utf-8").split("\n")[0::2] if l]
+            bodies.append(ids)
+            items = []
+            for id in ids:
+                if id == "1" and len(bodies) == 1:
+                    items.append({"index" : {"_id" : id, "status" : 429, "error" : {"type" : "es_rejected_execution_exception", "reason" : "busy"}}})
+                elif id == "2":
+                    items.append({"index" : {"_id" : id, "status" : 400, "error" : {"type" : "mapper_parsing_exception", "reason" : "bad"}}})
+                else:
+                    items.append({"index" : {"_id" : id, "status" : 201}})
+            return 200, {"errors" : True, "items" : items}
+
+        results = bulk.send_chunk(send, entries, retries=2, back_off_factor=0)
+        assert bodies == [["0", "1", "2", "3"], ["1"]]
+        assert [r["id"] for r in results] == ["0", "1", "2", "3"]
+        assert [r["status"] for r in results] == [201, 201, 400, 201]
+        assert results[2]["error"] == "mapper_parsing_exception: bad"
+        assert results[1]["error"] is None
+
+    def test_04_send_chunk_whole_request_fails(self):
+        calls = []
+        def send(body):
+            calls.append(body)
+            return 503, None
+
+        results = bulk.send_chunk(send, _entries(2), retries=2, back_off_factor=0)
+        assert len(calls) == 3
+        assert [r["status"] for r in results] == [503, 503]
+        assert results[0]["error"] is not None
+
+    def test_05_save_entries(self):
+        class Obj(object):
+            def __init__(self, data):
+                self.data = data
+                self.prepped = False
+            def prep(self):
+                self.prepped = True
+            def makeid(self):
+                return "new"
+
+        objs = [Obj({"id" : "a", "created_date" : "2015-01-01T00:00:00Z"}), Obj({})]
+        entries = list(bulk.save_entries(objs, now="2016-01-01T00:00:00Z"))
+
+        assert all([o.prepped for o in objs])
+        assert [id for id, lines in entries] == ["a", "new"]
+        assert objs[0].data == {"id" : "a", "created_date" : "2015-01-01T00:00:00Z", "last_updated" : "2016-01-01T00:00:00Z"}
+        assert objs[1].data == {"id" : "new", "created_date" : "2016-01-01T00:00:00Z", "last_updated" : "2016-01-01T00:00:00Z"}
+        assert entries[1][1] == bulk.index_lines("new", objs[1].data)
+
+    def test_06_send_all_routes_each_chunk(self):
+        # the write type moves on part way through, as a time boxed type's would
+        types = iter(["box1", "box1", "box2"])
+        sent = []
+
+        def send_to(type):
+            def send(body):
+                ids = [json.loads(l)["index"]["_id"] for l in body.decode("utf-8").split("\n")[0::2] if l]
+                sent.append((type, ids))
+                return 200, {"errors" : False, "items" : [{"index" : {"_id" : id, "status" : 201}} for id in ids]}
+            return send
+
+        results = bulk.send_all(_entries(5), send_to, lambda: next(types), 2)
+        assert sent == [("box1", ["0", "1"]), ("box1", ["2", "3"]), ("box2", ["4"])]
+        assert [r["id"] for r in results] == ["0", "1", "2", "3", "4"]
+        assert all([r["error"] is None for r in results])
@@ -0,0 +1,113 @@
+from unittest import TestCase
+from octopus.modules.es.cache import TTLCache
+from helpers import Clock
+
+class TestCache(TestCase):
+    def test_01_ttl(self):
+        clock = Clock()
+        c = TTLCache(clock=clock)
+        assert c.get("type1", "a") is None
+        c.set("type1", "a", {"x" : 1}, 10)
+        c.set("type1", "b", {"x" : 2}, 0)
+        assert c.get("type1", "a") == {"x" : 1}
+        assert c.get("type1", "b") is None
+        clock.now = 10
+        assert c.get("type1", "a") is None
+        assert len(c) == 0
+
+    def test_02_invalidate(self):
+        c = TTLCache()
+        c.set("type1", "a", 1, 60)
+        c.set("type2", "a", 2, 60)
+        c.invalidate("type1")
+        assert c.get("type1", "a") is None
+        assert c.get("type2", "a") == 2
+        c.invalidate()
+        assert c.get("type2", "a") is None
+
+    def test_03_compute(self):
+        c = TTLCache()
+        calls = []
+        def compute():
+            calls.append(1)
+            return {"x" : len(calls)}
+        assert c.get_or_compute("type1", "a", compute, 60) == {"x" : 1}
+        assert c.get_or_compute("type1", "a", compute, 60) == {"x" : 1}
+        assert len(calls) == 1
+
+        # a value computed while the type was written to is returned, but not kept
+        def racing():
+            c.invalidate("type1")
+            return {"x" : "stale"}
+        assert c.get_or_compute("type1", "b", racing, 60) == {"x" : "stale"}
+        assert c.get("type1", "b") is None
+
+    def test_04_settle(self):
+        clock = Clock()
+        c = TTLCache(clock=clock)
+        c.invalidate("type1", settle=1)
+
+        # while the write may not be searchable, nothing computed for the type is kept
+        c.set("type1", "a", 1, 60)
+        assert c.get("type1", "a") is None
+        generation = c.generation("type1")
+        clock.now = 2
+        c.set("type1", "b", 2, 60, generation=generation)
+        assert c.get("type1", "b") is None
+
+        # other types are unaffected, and once it has settled the type is cached again
+        c.set("type2", "a", 1, 60)
+        assert c.get("type2", "a") == 1
+        assert c.get_or_compute("type1", "a", lambda: 3, 60) == 3
+        assert c.get("type1", "a") == 3
+
+        # settling everything
+        c.invalidate(settle=1)
+        c.set("type2", "a", 1, 60)
+        assert c.get("type2", "a") is None
+        clock.now = 3
+        c.set("type2", "a", 1, 60)
+        assert c.get("type2", "a") == 1
+
+    def test_05_lru(self):
+        c = TTLCache(max_size=2)
+        c.set("type1", "a", 1, 60)
+        c.set("type1", "b", 2, 60)
+        assert c.get("type1", "a") == 1
+        c.set("type2", "c", 3, 60)
+        # b was the least recently used
+        assert c.get("type1", "b") is None
+        assert c.get("type1", "a") == 1
+        assert c.get("type2", "c") == 3
+        assert len(c) == 2
+
+    def test_06_stats(self):
+        c = TTLCache(max_size=2)
+        c.get("type1", "a")
+        c.set("type1", "a", 1, 60)
+        c.get("type1", "a")
+        c.get("type1", "a")
+        c.set("type2", "b", 2, 60)
+        c.set("type2", "c", 3, 60)
+        c.invalidate("type2")
+
+        s = c.stats("type1")
+        assert s["hits"] == 2
+        assert s["misses"] == 1
+        assert s["evictions"] == 1
+        assert s["invalidations"] == 0
+        assert s["size"] == 0
+        assert s["hit_rate"] == 2 / 3
+
+        s = c.stats()
+        assert s["evictions"] == 1
+        assert s["invalidations"] == 1
+        assert s["size"] == 0
+        assert c.stats("type3") == {"hits" : 0, "misses" : 0, "evictions" : 0, "invalidations" : 0, "size" : 0, "hit_rate" : 0}
+
+    def test_07_canonical_hash(self):
+        from octopus.modules.es.cache import canonical_hash
+        q1 = {"query" : {"bool" : {"must" : [{"term" : {"a" : 1}}], "filter" : []}}, "size" : 10}
+        q2 = {"size" : 10, "query" : {"bool" : {"filter" : [], "must" : [{"term" : {"a" : 1}}]}}}
+        assert canonical_hash(q1) == canonical_hash(q2)
+        assert canonical_hash(q1) != canonical_hash(dict(q2, size=11))
@@ -0,0 +1,350 @@
+from unittest import TestCase
+from flask import Flask
+from octopus.core import app
+from octopus.lib import http
+from esfake import FakeES, load_esprit
+from helpers import Clock
+load_esprit()
+from octopus.modules.es import dao, timebox
+from octopus.modules.es.reindex import CaptureLog
+from octopus.modules.es.cache import TTLCache
+import json, os, shutil, tempfile, threading
+
+class Thing(dao.ESDAO):
+    __type__ = "thing"
+
+class Boxed(dao.TimeBoxedTypeESDAO):
+    __type__ = "boxed"
+
+class Rolling(dao.RollingTypeESDAO):
+    __type__ = "rolling"
+
+CONFIG = {
+    "ESDAO_ROLLING_POLL_INTERVAL" : 0.01,
+    "ESDAO_QUERY_CACHE_TTL" : 0,
+    "ESDAO_FACET_CACHE_TTL" : 60,
+    "ESDAO_IDENTITY_MAP" : True,
+    "ESDAO_TIME_BOX_BOXED" : "day",
+    "ESDAO_TIME_BOX_LOOKBACK_BOXED" : 0,
+    "ESDAO_TIME_BOX_RETENTION_BOXED" : None,
+    "ESDAO_REINDEX_SLICES" : 2,
+    "ESDAO_BULK_RETRIES" : 0,
+    "ESDAO_REFRESH_INTERVAL" : 1
+}
+
+class TestESDAO(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.old_config = dict([(k, app.config.get(k)) for k in list(CONFIG.keys()) + ["ESDAO_ROLLING_DIR"]])
+        app.config.update(CONFIG)
+        app.config["ESDAO_ROLLING_DIR"] = self.dir
+
+        self.es = FakeES()
+        self.patch = self.es.patch()
+        self.patch.__enter__()
+
+        # fresh caches, which only see time pass when the tests move the clock on
+        self.clock = Clock()
+        self.old_caches = (dao.ESDAO._facet_cache, dao.ESDAO._query_cache)
+        dao.ESDAO._facet_cache = TTLCache(clock=self.clock)
+        dao.ESDAO._query_cache = TTLCache(clock=self.clock)
+        dao.RollingTypeESDAO._rolling_pointers.clear()
+        dao.TimeBoxedTypeESDAO._read_types_cache.clear()
+        dao.TimeBoxedTypeESDAO._ensured_types.clear()
+
+    def tearDown(self):
+        self.patch.__exit__(None, None, None)
+        dao.ESDAO._facet_cache, dao.ESDAO._query_cache = self.old_caches
+        app.config.update(self.old_config)
+        shutil.rmtree(self.dir)
+
+    def _requests(self, endpoint):
+        return [r for r in self.es.requests if r[1] == endpoint]
+
+    def test_01_bulk_save(self):
+        objs = [Thing({"id" : "a"}), Thing({"value" : 1}), Thing({"id" : "c", "created_date" : "2015-01-01T00:00:00Z"})]
+        results = Thing.bulk_save(objs, chunk_size=2, refresh="wait_for")
+
+        assert [r["error"] for r in results] == [None, None, None]
+        assert objs[1].id is not None
+        assert self.es.ids("thing") == sorted(["a", "c", objs[1].id])
+        assert self.es.types["thing"]["c"]["created_date"] == "2015-01-01T00:00:00Z"
+        assert self.es.types["thing"]["a"]["last_updated"] == self.es.types["thing"]["a"]["created_date"]
+
+        bulks = self._requests("_bulk")
+        assert len(bulks) == 2
+        assert all([r[2] == "thing" and r[3] == {"refresh" : "wait_for"} for r in bulks])
+
+    def test_02_bulk_save_routes_each_chunk(self):
+        # the time box moves on between chunks, and the next chunk goes to the new box
+        boxes = iter(["boxed20160101", "boxed20160102"])
+        old = Boxed.dynamic_write_type
+        Boxed.dynamic_write_type = classmethod(lambda cls: next(boxes))
+        try:
+            Boxed.bulk_save([Boxed({"id" : str(i)}) for i in range(3)], chunk_size=2)
+        finally:
+            Boxed.dynamic_write_type = old
+        assert self.es.ids("boxed20160101") == ["0", "1"]
+        assert self.es.ids("boxed20160102") == ["2"]
+
+    def test_03_iterate_and_count(self):
+        self.es.put("thing", [{"id" : str(i), "even" : i % 2 == 0} for i in range(25)])
+
+        ids = [t.id for t in Thing.iterate(page_size=10)]
+        assert ids == sorted([str(i) for i in range(25)])
+        assert len(self.es.cleared) == 1
+
+        # stopping early still clears the scroll
+        it = Thing.iterate(page_size=10, prefetch=False)
+        next(it)
+        it.close()
+        assert len(self.es.cleared) == 2
+
+        q = {"query" : {"term" : {"even" : True}}, "from" : 5}
+        assert [r["id"] for r in Thing.iterate(q, wrap=False, limit=3)] == ["0", "10", "12"]
+        assert self._requests("_search?scroll")[-1][4]["size"] == app.config.get("ESDAO_ITERATE_PAGE_SIZE")
+        assert "from" not in self._requests("_search?scroll")[-1][4]
+
+        assert Thing.count() == 25
+        assert Thing.count(q) == 13
+        assert self._requests("_count")[-1][2] == "thing"
+        with self.assertRaises(dao.ESDAOException):
+            Thing.count(types="missing")
+
+    def test_04_pull_many(self):
+        self.es.put("thing", [{"id" : "a"}, {"id" : "b"}])
+        with Flask(__name__).test_request_context():
+            res = Thing.pull_many(["b", "x", "a", "b"], chunk_size=2)
+            assert [r.id if r is not None else None for r in res] == ["b", None, "a", "b"]
+            assert len(self._requests("_mget")) == 2
+
+            # answered from the identity map, misses included
+            res = Thing.pull_many(["a", "x"])
+            assert res[0].id == "a" and res[1] is None
+            assert len(self._requests("_mget")) == 2
+
+            # a copy, so changing it doesn't change what is remembered
+            res[0].data["changed"] = True
+            assert "changed" not in Thing.pull("a").data
+
+            assert Thing.pull_many(["a"], fields=["id"], wrap=False) == [{"id" : "a"}]
+
+    def test_05_pull_many_missing_types(self):
+        with Flask(__name__).test_request_context():
+            # the type doesn't exist yet, so nothing is found, but that isn't remembered
+            assert Thing.pull_many(["a"]) == [None]
+            self.es.put("thing", [{"id" : "a"}])
+            assert Thing.pull_many(["a"])[0].id == "a"
+
+        # several types, some of which don't exist, are searched by id, skipping the missing ones
+        self.es.put("boxed20160102", [{"id" : "a"}])
+        res = Boxed.pull_many(["a", "b"], types=["boxed20160101", "boxed20160102", "boxed2015*"])
+        assert res[0].id == "a" and res[1] is None
+        search = self._requests("_search")[-1]
+        assert search[2] == "boxed20160101,boxed20160102,boxed2015*"
+        assert search[3] == {"ignore_unavailable" : "true", "allow_no_indices" : "true"}
+
+        self.es.hooks["_search"] = lambda types, body: http.MockResponse(500, b"broken")
+        with self.assertRaises(dao.ESDAOException):
+            Boxed.pull_many(["a"], types=["boxed20160101", "boxed20160102"])
+
+    def test_06_facets(self):
+        self.es.put("thing", [{"id" : str(i), "colour" : ["red", "green", "blue"][i % 3]} for i in range(10)])
+
+        values = Thing.get_all_facet_values("colour", page_size=2)
+        assert values == {"red" : 4, "green" : 3, "blue" : 3}
+        assert len(self._requests("_search")) == 3
+
+        # cached, until a save to the type
+        assert Thing.get_all_facet_values("colour", page_size=2) == values
+        assert len(self._requests("_search")) == 3
+        Thing({"id" : "x", "colour" : "red"}).save()
+        assert Thing.get_all_facet_values("colour", page_size=2)["red"] == 5
+
+        # which isn't cached again until the index has had time to make the save searchable
+        searches = len(self._requests("_search"))
+        Thing.get_all_facet_values("colour", page_size=2)
+        assert len(self._requests("_search")) == searches + 3
+        self.clock.now = 1
+        Thing.get_all_facet_values("colour", page_size=2)
+        Thing.get_all_facet_values("colour", page_size=2)
+        assert len(self._requests("_search")) == searches + 6
+
+        top = Thing.get_facets(["colour", "id"], size=1)
+        assert top == {"colour" : {"red" : 5}, "id" : {"0" : 1}}
+        searches = len(self._requests("_search"))
+        assert Thing.get_facets(["colour", "id"], size=1) == top
+        assert len(self._requests("_search")) == searches
+
+    def test_07_query_cache(self):
+        self.es.put("thing", [{"id" : "a"}])
+        Thing.__query_cache_ttl__ = 60
+        try:
+            q = {"query" : {"match_all" : {}}}
+            res = Thing.query(q=q)
+            assert res["hits"]["total"]["value"] == 1
+            res["hits"]["hits"] = []
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 1
+            assert len(Thing.query(q=q)["hits"]["hits"]) == 1
+            assert Thing.query_cache_stats()["hits"] == 2
+
+            # a result from before the index has made a save searchable is not kept
+            Thing({"id" : "b"}).save()
+            self.es.types["thing"].pop("b")
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 1
+            self.es.types["thing"]["b"] = {"id" : "b"}
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 2
+            self.clock.now = 1
+            Thing.query(q=q)
+            assert Thing.query_cache_stats()["size"] == 1
+
+            Thing({"id" : "b"}).delete()
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 1
+            Thing.delete_by_query({"query" : {"match_all" : {}}})
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 0
+            assert Thing.query(q=q, cache=False)["hits"]["total"]["value"] == 0
+
+            # the same query on another connection is a different result
+            self.clock.now = 2
+            self.es.put("thing", [{"id" : "a"}])
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 1
+            other = dao.esprit.raw.Connection("otherhost", "otherindex")
+            self.es.types["thing"] = {}
+            assert Thing.query(q=q, conn=other)["hits"]["total"]["value"] == 0
+            assert Thing.query(q=q)["hits"]["total"]["value"] == 1
+        finally:
+            Thing.__query_cache_ttl__ = None
+
+    def _boxes(self, days):
+        # a box of one record for each of the days before today
+        latest = Boxed._boundary_timestamp("day")
+        names = []
+        for d in range(days):
+            name = timebox.format_type("boxed", "day", latest - timebox.step("day", d))
+            self.es.put(name, [{"id" : name}])
+            names.append(name)
+        return latest, names
+
+    def test_08_apply_retention(self):
+        latest, names = self._boxes(100)
+        app.config["ESDAO_TIME_BOX_RETENTION_BOXED"] = {"keep" : 10, "compact" : "month", "horizon" : 80}
+
+        plan = Boxed.apply_retention(dry_run=True)
+        assert len(self.es.types) == 100
+        assert len(plan["delete"]) == 20
+
+        plan = Boxed.apply_retention()
+        archives = sorted(plan["compact"].keys())
+        assert len(archives) > 0
+        for archive, boxes in plan["compact"].items():
+            assert self.es.ids(archive) == sorted(boxes)
+            assert all([b not in self.es.types for b in boxes])
+        assert all([n not in self.es.types for n in plan["delete"]])
+        assert names[0] in self.es.types
+
+        # what is left is read through the retained read types
+        Boxed._read_types_cache.clear()
+        app.config["ESDAO_TIME_BOX_LOOKBACK_BOXED"] = 99
+        assert Boxed.count() == 80
+
+    def test_09_compact_failure(self):
+        latest, names = self._boxes(3)
+        archive = "boxedarchive"
+
+        def fail(types, body):
+            if types == archive:
+                return http.MockResponse(400, b"")
+
+        # the archive this run made is deleted again
+        self.es.hooks["_bulk"] = fail
+        with self.assertRaises(dao.ESDAOException):
+            Boxed._compact(archive, names, Boxed.__conn__)
+        assert archive not in self.es.types
+        assert all([n in self.es.types for n in names])
+
+        # an archive which was already there has the copied records taken out of it again
+        self.es.put(archive, [{"id" : "old"}])
+        def short_count(types, body):
+            if types == archive:
+                return http.MockResponse(200, json.dumps({"count" : 0}).encode("utf-8"))
+        del self.es.hooks["_bulk"]
+        self.es.hooks["_count"] = short_count
+        with self.assertRaises(dao.ESDAOException):
+            Boxed._compact(archive, names, Boxed.__conn__)
+        assert self.es.ids(archive) == ["old"]
+        assert all([n in self.es.types for n in names])
+
+    def test_10_reindex(self):
+        # curr is minted now, so the reindex has to wait for a different name
+        Rolling.self_init()
+        curr = Rolling._rolling().read("curr")
+        self.es.put(curr, [{"id" : str(i)} for i in range(20)])
+
+        progress = Rolling.reindex(batch_size=5)
+        assert progress["state"] == "published"
+        assert progress["copied"] == 20
+
+        new = Rolling._rolling().read("curr")
+        assert new != curr
+        assert Rolling._rolling().read("prev") == curr
+        assert Rolling.rolling_status()["curr"] == {"cfg" : new, "file" : new}
+        assert self.es.ids(new) == sorted([str(i) for i in range(20)])
+        assert Rolling.reindex_running() is False
+
+    def test_11_reindex_captures_writes(self):
+        curr = "rolling20150101000000"
+        Rolling.self_init(type_name=curr)
+        self.es.put(curr, [{"id" : str(i)} for i in range(5)])
+
+        # write once the copy has started: the writes go to curr, and are captured and copied across
+        def during_copy(types, body):
+            if types == curr and body.get("slice", {}).get("id") == 0:
+                Rolling({"id" : "new"}).save()
+                Rolling({"id" : "0"}).delete()
+                Rolling.delete_by_query({"query" : {"ids" : {"values" : ["1"]}}})
+        self.es.hooks["_search?scroll"] = during_copy
+
+        Rolling.reindex(batch_size=5)
+        new = Rolling._rolling().read("curr")
+        assert self.es.ids(curr) == ["2", "3", "4", "new"]
+        assert self.es.ids(new) == ["2", "3", "4", "new"]
+        assert list(CaptureLog(os.path.join(self.dir, "rolling", "capture")).drain()) == []
+
+    def test_12_reindex_waits_for_writes(self):
+        curr = "rolling20150101000000"
+        Rolling.self_init(type_name=curr)
+        self.es.put(curr, [{"id" : str(i)} for i in range(5)])
+
+        # a write which has chosen curr, but not yet reached it, when the reindex comes to finish
+        saving = threading.Event()
+        go = threading.Event()
+        def on_save(t, source):
+            if source.get("id") == "late":
+                assert t == curr
+                saving.set()
+                go.wait(5)
+        self.es.on_save = on_save
+
+        writer = threading.Thread(target=lambda: Rolling({"id" : "late"}).save())
+        def during_copy(types, body):
+            if body.get("slice", {}).get("id") == 0 and not saving.is_set():
+                writer.start()
+                saving.wait(5)
+        self.es.hooks["_search?scroll"] = during_copy
+
+        result = {}
+        reindex = threading.Thread(target=lambda: result.update(Rolling.reindex(batch_size=5)))
+        reindex.start()
+        assert saving.wait(5)
+
+        # the reindex can't finish while the write is part way through
+        reindex.join(0.5)
+        assert reindex.is_alive()
+        go.set()
+        writer.join(5)
+        reindex.join(5)
+
+        assert result["state"] == "published"
+        new = Rolling._rolling().read("curr")
+        assert new != curr
+        assert self.es.ids(new) == ["0", "1", "2", "3", "4", "late"]
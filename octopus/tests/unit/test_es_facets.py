@@ -0,0 +1,43 @@
+from unittest import TestCase
+from octopus.modules.es import facets
+
+class TestFacets(TestCase):
+    def test_01_filter_hash(self):
+        assert facets.filter_hash({"a" : 1, "b" : [1, 2]}) == facets.filter_hash({"b" : [1, 2], "a" : 1})
+        assert facets.filter_hash({"a" : 1}) != facets.filter_hash({"a" : 2})
+        assert facets.filter_hash(None) == facets.filter_hash(None)
+
+    def test_02_all_values(self):
+        values = [("v" + str(i), i) for i in range(25)]
+        queries = []
+        def fetch(q):
+            queries.append(q)
+            agg = q["aggs"]["facets"]["composite"]
+            start = agg.get("after", {}).get("facet")
+            start = [v for v, c in values].index(start) + 1 if start is not None else 0
+            page = values[start:start + agg["size"]]
+            resp = {"aggregations" : {"facets" : {"buckets" : [{"key" : {"facet" : v}, "doc_count" : c} for v, c in page]}}}
+            if len(page) > 0:
+                resp["aggregations"]["facets"]["after_key"] = {"facet" : page[-1][0]}
+            return resp
+
+        result = facets.all_values(fetch, "status.exact", {"term" : {"owner" : "me"}}, size=10)
+        # v0 has no records, so isn't included
+        assert result == dict(values[1:])
+        assert len(queries) == 4
+        assert queries[0]["query"] == {"term" : {"owner" : "me"}}
+        assert queries[0]["size"] == 0
+        assert queries[0]["aggs"]["facets"]["composite"]["sources"] == [{"facet" : {"terms" : {"field" : "status.exact"}}}]
+        assert "after" not in queries[0]["aggs"]["facets"]["composite"]
+        assert queries[1]["aggs"]["facets"]["composite"]["after"] == {"facet" : "v9"}
+
+    def test_03_batch(self):
+        q = facets.batch_query(["a.exact", "b.exact"], size=5)
+        assert q["query"] == {"match_all" : {}}
+        assert q["aggs"] == {"facet0" : {"terms" : {"field" : "a.exact", "size" : 5}}, "facet1" : {"terms" : {"field" : "b.exact", "size" : 5}}}
+
+        resp = {"aggregations" : {
+            "facet0" : {"buckets" : [{"key" : "x", "doc_count" : 3}, {"key" : "", "doc_count" : 1}]},
+            "facet1" : {"buckets" : []}
+        }}
+        assert facets.batch_results(resp, ["a.exact", "b.exact"]) == {"a.exact" : {"x" : 3}, "b.exact" : {}}
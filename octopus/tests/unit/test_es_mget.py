@@ -0,0 +1,44 @@
+from unittest import TestCase
+from flask import Flask
+from octopus.modules.es import mget
+
+class TestMget(TestCase):
+    def test_01_mget(self):
+        assert mget.mget_body(["a", "b"]) == {"docs" : [{"_id" : "a"}, {"_id" : "b"}]}
+        assert mget.mget_body(["a"], fields=["title"]) == {"docs" : [{"_id" : "a", "_source" : ["title"]}]}
+
+        resp = {"docs" : [
+            {"_id" : "a", "found" : True, "_source" : {"id" : "a", "title" : "A"}},
+            {"_id" : "b", "found" : False}
+        ]}
+        assert mget.mget_results(resp) == {"a" : {"id" : "a", "title" : "A"}}
+
+    def test_02_search(self):
+        assert mget.ids_query(["a", "b"], fields=["title"]) == {"query" : {"ids" : {"values" : ["a", "b"]}}, "size" : 2, "_source" : ["title"]}
+        resp = {"hits" : {"hits" : [{"_id" : "b", "_source" : {"id" : "b"}}]}}
+        assert mget.search_results(resp) == {"b" : {"id" : "b"}}
+
+    def test_03_identity_map(self):
+        imap = mget.IdentityMap()
+        assert imap.get("type1", "a") == (False, None)
+        imap.put("type1", "a", {"id" : "a"})
+        imap.put("type1", "b", None)
+        imap.put("type2", "a", {"id" : "other"})
+        assert imap.get("type1", "a") == (True, {"id" : "a"})
+        assert imap.get("type1", "b") == (True, None)
+
+        imap.drop("type1", "a")
+        assert imap.get("type1", "a") == (False, None)
+        imap.drop("type1")
+        assert imap.get("type1", "b") == (False, None)
+        assert imap.get("type2", "a") == (True, {"id" : "other"})
+
+    def test_04_request_scope(self):
+        assert mget.identity_map() is None
+        app = Flask("test")
+        with app.test_request_context("/"):
+            imap = mget.identity_map()
+            imap.put("type1", "a", {"id" : "a"})
+            assert mget.identity_map() is imap
+        with app.test_request_context("/"):
+            assert mget.identity_map().get("type1", "a") == (False, None)
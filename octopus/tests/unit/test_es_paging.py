@@ -0,0 +1,78 @@
+from unittest import TestCase
+from octopus.modules.es import paging
+import threading
+
+def _source(n, page_size):
+    # pages of a result set of n integers, with the cursor being the offset of the next page
+    calls = []
+    def first():
+        calls.append(0)
+        return list(range(0, min(page_size, n))), page_size
+    def fetch_next(cursor):
+        calls.append(cursor)
+        return list(range(cursor, min(cursor + page_size, n))), cursor + page_size
+    return first, fetch_next, calls
+
+class TestESPaging(TestCase):
+    def test_01_pages(self):
+        for prefetch in [True, False]:
+            first, fetch_next, calls = _source(25, 10)
+            pages = list(paging.pages(first, fetch_next, prefetch=prefetch))
+            assert pages == [list(range(0, 10)), list(range(10, 20)), list(range(20, 25))]
+            assert calls == [0, 10, 20, 30]
+
+    def test_02_items_limit(self):
+        first, fetch_next, calls = _source(100, 10)
+        assert list(paging.items(first, fetch_next, limit=15)) == list(range(15))
+
+        first, fetch_next, calls = _source(0, 10)
+        assert list(paging.items(first, fetch_next)) == []
+        assert calls == [0]
+
+    def test_03_prefetch_in_background(self):
+        # the second page is requested before the consumer has finished with the first
+        requested = threading.Event()
+        def first():
+            return [1, 2], "a"
+        def fetch_next(cursor):
+            if cursor == "a":
+                requested.set()
+                return [3], "b"
+            return [], None
+
+        gen = paging.items(first, fetch_next, prefetch=True)
+        assert next(gen) == 1
+        assert requested.wait(5)
+        assert list(gen) == [2, 3]
+
+    def test_04_clear(self):
+        # the last cursor is cleared whether the results run out or the consumer stops early
+        for prefetch in [True, False]:
+            cleared = []
+            first, fetch_next, calls = _source(25, 10)
+            assert len(list(paging.items(first, fetch_next, prefetch=prefetch, clear=cleared.append))) == 25
+            assert cleared == [40]
+
+            cleared = []
+            first, fetch_next, calls = _source(100, 10)
+            assert list(paging.items(first, fetch_next, prefetch=prefetch, limit=15, clear=cleared.append)) == list(range(15))
+            assert len(cleared) == 1
+            assert cleared[0] in [20, 30]
+
+            cleared = []
+            first, fetch_next, calls = _source(100, 10)
+            gen = paging.items(first, fetch_next, prefetch=prefetch, clear=cleared.append)
+            assert next(gen) == 0
+            gen.close()
+            assert len(cleared) == 1
+
+    def test_05_clear_on_error(self):
+        cleared = []
+        def first():
+            return [1], "a"
+        def fetch_next(cursor):
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            list(paging.items(first, fetch_next, prefetch=True, clear=cleared.append))
+        assert cleared == ["a"]
@@ -0,0 +1,268 @@
+from unittest import TestCase
+from octopus.modules.es.pointers import PointerCache, RollingPointers, WriteLock
+import multiprocessing, os, random, re, shutil, tempfile, threading, time
+from helpers import Clock
+
+NAME = re.compile(r"^idx-\d+-\d+$")
+
+def _log(path, line):
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+def _minter(log, pid, counter):
+    # stands in for minting and initialising a new index type
+    def create():
+        counter[0] += 1
+        name = "idx-{p}-{c}".format(p=pid, c=counter[0])
+        time.sleep(0.01)
+        _log(log, "mint " + name)
+        return name
+    return create
+
+def _ensure_next_worker(directory, log, barrier, results):
+    rp = RollingPointers(directory, interval=0)
+    barrier.wait()
+    results.put(rp.ensure_next(_minter(log, os.getpid(), [0])))
+
+def _stress_worker(directory, log, seed, ops):
+    rng = random.Random(seed)
+    rp = RollingPointers(directory, interval=0)
+    create = _minter(log, os.getpid(), [0])
+    for i in range(ops):
+        action = rng.choice(["publish", "rollback", "write", "read"])
+        if action == "publish":
+            changed, dropped = rp.publish()
+            if dropped is not None:
+                _log(log, "drop " + dropped)
+        elif action == "rollback":
+            changed, dropped = rp.rollback()
+            if dropped is not None:
+                _log(log, "drop " + dropped)
+        elif action == "write":
+            rp.ensure_next(create)
+        else:
+            for pos in ["prev", "curr", "next"]:
+                val = rp.cache.get(pos)
+                if val is not None and NAME.match(val) is None:
+                    _log(log, "torn " + val)
+
+def _shared_worker(directory, held, release):
+    with WriteLock(directory).shared():
+        held.set()
+        release.wait(10)
+
+class TestPointerCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, pos, val):
+        with open(os.path.join(self.dir, pos), "w") as f:
+            f.write(val)
+
+    def test_01_read_and_poll(self):
+        self._write("curr", "index1")
+        clock = Clock()
+        pc = PointerCache(self.dir, interval=5, clock=clock)
+        assert pc.get("curr") == "index1"
+        assert pc.get("next") is None
+
+        # another process publishes: nothing is seen until the interval has passed
+        other = PointerCache(self.dir, interval=5, clock=clock)
+        self._write("next", "index2")
+        other.bump()
+        clock.now = 1
+        assert pc.get("next") is None
+        clock.now = 6
+        assert pc.get("next") == "index2"
+        assert pc.snapshot() == {"curr" : "index1", "next" : "index2"}
+
+    def test_02_bump_is_immediate_locally(self):
+        clock = Clock()
+        pc = PointerCache(self.dir, interval=5, clock=clock)
+        assert pc.get("curr") is None
+        self._write("curr", "index1")
+        pc.bump()
+        assert pc.get("curr") == "index1"
+        with open(os.path.join(self.dir, "version")) as f:
+            assert f.read() == "1"
+        pc.bump()
+        with open(os.path.join(self.dir, "version")) as f:
+            assert f.read() == "2"
+
+    def test_03_changes_without_bump(self):
+        # files changed by something that doesn't know about the version file are still noticed
+        self._write("curr", "index1")
+        clock = Clock()
+        pc = PointerCache(self.dir, interval=0, clock=clock)
+        assert pc.get("curr") == "index1"
+        os.remove(os.path.join(self.dir, "curr"))
+        self._write("prev", "index1")
+        assert pc.get("curr") is None
+        assert pc.get("prev") == "index1"
+
+    def test_04_rolling_operations(self):
+        rp = RollingPointers(self.dir, interval=0)
+        assert rp.publish() == (False, None)
+        assert rp.rollback() == (False, None)
+
+        rp.write("curr", "index1")
+        assert rp.ensure_next(lambda: "index2") == "index2"
+        assert rp.ensure_next(lambda: "index3") == "index2"
+        assert rp.publish() == (True, None)
+        assert rp.cache.snapshot() == {"prev" : "index1", "curr" : "index2"}
+
+        assert rp.ensure_next(lambda: "index3") == "index3"
+        assert rp.publish() == (True, "index1")
+        assert rp.cache.snapshot() == {"prev" : "index2", "curr" : "index3"}
+
+        assert rp.rollback() == (True, None)
+        assert rp.cache.snapshot() == {"curr" : "index2", "next" : "index3"}
+        assert rp.drop_next() == "index3"
+        assert rp.drop_next() is None
+        assert rp.cache.snapshot() == {"curr" : "index2"}
+
+        # the lock is re-entrant within a thread
+        with rp.lock:
+            with rp.lock:
+                rp.write("next", "index4")
+        assert rp.read("next") == "index4"
+
+    def test_05_write_type(self):
+        rp = RollingPointers(self.dir, interval=0)
+        rp.write("curr", "index1")
+
+        # while a reindex runs, writes go to curr and no next is made
+        rp.write("reindex", "index2")
+        assert rp.write_type(lambda: "index3") == "index1"
+        assert rp.read("next") is None
+
+        # and curr comes from the cache, without reading the files
+        cached = RollingPointers(self.dir, interval=60)
+        assert cached.write_type(lambda: "index3") == "index1"
+        rp.write("curr", "index5")
+        assert cached.write_type(lambda: "index3") == "index1"
+        rp.write("curr", "index1")
+
+        rp.drop("reindex")
+        assert rp.write_type(lambda: "index3") == "index3"
+        assert rp.write_type(lambda: "index4") == "index3"
+        assert rp.cache.snapshot() == {"curr" : "index1", "next" : "index3"}
+
+    def test_06_one_next_across_processes(self):
+        ctx = multiprocessing.get_context("fork")
+        log = os.path.join(self.dir, "log")
+        barrier = ctx.Barrier(4)
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_ensure_next_worker, args=(os.path.join(self.dir, "rolling"), log, barrier, results)) for i in range(4)]
+        for p in procs:
+            p.start()
+        names = [results.get(timeout=30) for p in procs]
+        for p in procs:
+            p.join()
+
+        with open(log) as f:
+            mints = f.read().splitlines()
+        assert len(mints) == 1
+        assert names == [mints[0][len("mint "):]] * 4
+
+    def test_07_stress(self):
+        # several processes publish, roll back, mint and read the pointers at random: every index which is dropped
+        # must be dropped once, and must not still be pointed to at the end
+        ctx = multiprocessing.get_context("fork")
+        directory = os.path.join(self.dir, "rolling")
+        log = os.path.join(self.dir, "log")
+        RollingPointers(directory).write("curr", "idx-0-0")
+
+        procs = [ctx.Process(target=_stress_worker, args=(directory, log, i, 100)) for i in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            assert p.exitcode == 0
+
+        with open(log) as f:
+            lines = [l.split(" ", 1) for l in f.read().splitlines()]
+        assert len([l for l in lines if l[0] == "torn"]) == 0
+        minted = [n for a, n in lines if a == "mint"]
+        dropped = [n for a, n in lines if a == "drop"]
+        assert len(minted) > 0
+        assert len(minted) == len(set(minted))
+        assert len(dropped) == len(set(dropped))
+
+        final = RollingPointers(directory, interval=0).cache.snapshot()
+        assert "curr" in final
+        assert len(set(final.values())) == len(final)
+        for name in final.values():
+            assert name not in dropped
+            assert name == "idx-0-0" or name in minted
+
+        # nothing is left half written
+        assert [f for f in os.listdir(directory) if f.endswith(".tmp")] == []
+
+    def test_08_concurrent_reads_and_bumps(self):
+        # readers must never see the values being reset underneath them by a bump or invalidate
+        self._write("curr", "index1")
+        pc = PointerCache(self.dir, interval=0)
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    assert pc.get("curr") == "index1"
+                    assert pc.snapshot()["curr"] == "index1"
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for i in range(4)]
+        for t in readers:
+            t.start()
+        for i in range(500):
+            pc.bump()
+            pc.invalidate()
+        stop.set()
+        for t in readers:
+            t.join()
+        assert errors == []
+
+    def test_09_write_lock(self):
+        changes = []
+        wl = WriteLock(self.dir, on_change=lambda: changes.append(1))
+
+        # the first shared hold always counts as a change, and holding it again does not
+        with wl.shared():
+            with wl.shared():
+                pass
+        with wl.shared():
+            pass
+        assert len(changes) == 1
+
+        # the exclusive lock waits for a shared holder in another process
+        ctx = multiprocessing.get_context("fork")
+        held = ctx.Event()
+        release = ctx.Event()
+        proc = ctx.Process(target=_shared_worker, args=(self.dir, held, release))
+        proc.start()
+        assert held.wait(10)
+        got = threading.Event()
+        def exclusive():
+            wl.acquire_exclusive()
+            got.set()
+        t = threading.Thread(target=exclusive)
+        t.start()
+        assert not got.wait(0.3)
+        release.set()
+        proc.join()
+        assert got.wait(10)
+        wl.release_exclusive()
+
+        # and once it has been held, the next shared holder is told
+        other = WriteLock(self.dir, on_change=lambda: changes.append(2))
+        with other.shared():
+            pass
+        with wl.shared():
+            pass
+        assert changes == [1, 2, 1]
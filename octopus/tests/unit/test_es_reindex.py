@@ -0,0 +1,120 @@
+from unittest import TestCase
+from octopus.modules.es.reindex import ReindexProgress, CaptureLog, copy, replay
+import os, shutil, tempfile, threading
+from helpers import Clock
+
+class TestReindex(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_01_progress(self):
+        path = os.path.join(self.dir, "reindex.json")
+        clock = Clock(100.0)
+        p = ReindexProgress("type1", "type2", path=path, clock=clock)
+        assert ReindexProgress.load(path)["state"] == "starting"
+
+        p.update(state="copying", total=10)
+        clock.now = 102.0
+        p.add(copied=4, failed=1, dropped=["a"])
+        p.add(dropped=["a", "b"], replayed=3)
+
+        saved = ReindexProgress.load(path)
+        assert saved == p.as_dict()
+        assert saved["source"] == "type1"
+        assert saved["target"] == "type2"
+        assert saved["state"] == "copying"
+        assert saved["total"] == 10
+        assert saved["copied"] == 4
+        assert saved["failed"] == 1
+        assert saved["dropped"] == 2
+        assert saved["replayed"] == 3
+        assert saved["elapsed"] == 2.0
+        assert saved["rate"] == 2.0
+
+        assert ReindexProgress.load(os.path.join(self.dir, "missing.json")) is None
+
+    def test_02_capture_log(self):
+        log = CaptureLog(os.path.join(self.dir, "capture"))
+        assert log.drain() == []
+        log.record(["a", "b"])
+        log.record([])
+        log.record(["a", "c"])
+        assert log.drain() == ["a", "b", "c"]
+        assert log.drain() == []
+
+        log.record(["d"])
+        log.clear()
+        assert log.drain() == []
+
+    def test_03_copy(self):
+        written = []
+        lock = threading.Lock()
+        def write(records):
+            with lock:
+                written.extend(records)
+            return [{"id" : r["id"], "error" : "bad" if r["id"] == "s1-3" else None} for r in records]
+
+        def transform(r):
+            if r["n"] % 5 == 0:
+                return None
+            return dict(r, moved=True)
+
+        slices = [[{"id" : "s{s}-{i}".format(s=s, i=i), "n" : i} for i in range(12)] for s in range(3)]
+        p = ReindexProgress("type1", "type2")
+        copy(slices, write, transform=transform, progress=p, batch_size=5)
+
+        # 0, 5 and 10 are dropped from each slice
+        assert len(written) == 27
+        assert all([r["moved"] for r in written])
+        d = p.as_dict()
+        assert d["copied"] == 26
+        assert d["failed"] == 1
+        assert d["dropped"] == 9
+
+        # and a single slice is copied without a pool
+        written[:] = []
+        copy([iter(slices[0])], write)
+        assert [r["id"] for r in written] == ["s0-{i}".format(i=i) for i in range(12)]
+
+    def test_04_replay(self):
+        log = CaptureLog(os.path.join(self.dir, "capture"))
+        source = {"a" : {"id" : "a", "v" : 2}, "b" : {"id" : "b", "v" : 2, "drop" : True}}
+        target = {"a" : {"id" : "a", "v" : 1}, "b" : {"id" : "b", "v" : 1}, "c" : {"id" : "c", "v" : 1}}
+
+        rounds = []
+        def fetch(ids):
+            rounds.append(ids)
+            # a write arrives while the first round is being replayed
+            if len(rounds) == 1:
+                source["d"] = {"id" : "d", "v" : 1}
+                log.record(["d"])
+            return [source[id] for id in ids if id in source]
+
+        def write(records):
+            for r in records:
+                target[r["id"]] = r
+            return [{"id" : r["id"], "error" : None} for r in records]
+
+        def delete(ids):
+            for id in ids:
+                target.pop(id, None)
+
+        def transform(r):
+            return None if r.get("drop") else r
+
+        # c was deleted from the source, b is now dropped by the transform
+        log.record(["a", "b", "c", "a"])
+        p = ReindexProgress("type1", "type2")
+        assert replay(log, fetch, write, delete, transform=transform, progress=p) == 4
+        assert rounds == [["a", "b", "c"], ["d"]]
+        assert target == {"a" : {"id" : "a", "v" : 2}, "d" : {"id" : "d", "v" : 1}}
+        assert p.as_dict()["replayed"] == 4
+        assert p.as_dict()["dropped"] == 1
+
+        # stops once a round is under the threshold, or after max_rounds
+        log.record(["a"])
+        assert replay(log, fetch, write, delete, threshold=5) == 1
+        assert replay(log, fetch, write, delete, max_rounds=1) == 0
@@ -0,0 +1,58 @@
+from unittest import TestCase
+from flask import Flask
+from octopus.core import app
+from octopus.modules.es import rolling
+import json, threading
+
+class FakeRolling(object):
+    __type__ = "fake"
+    running = False
+    reindexed = None
+
+    @classmethod
+    def reindex_running(cls):
+        return cls.running
+
+    @classmethod
+    def reindex(cls, slices=None, publish=True):
+        cls.reindexed.set()
+
+class TestRolling(TestCase):
+    def setUp(self):
+        self.old_plugins = app.config.get("ESDAO_ROLLING_PLUGINS")
+        self.old_refs = app.config.get("PLUGIN_CLASS_REFS")
+        app.config["ESDAO_ROLLING_PLUGINS"] = {"fake" : "tests.FakeRolling"}
+        app.config["PLUGIN_CLASS_REFS"] = {"tests.FakeRolling" : FakeRolling}
+        FakeRolling.running = False
+        FakeRolling.reindexed = threading.Event()
+
+        webapp = Flask(__name__)
+        webapp.register_blueprint(rolling.blueprint)
+        self.client = webapp.test_client()
+
+    def tearDown(self):
+        app.config["ESDAO_ROLLING_PLUGINS"] = self.old_plugins
+        app.config["PLUGIN_CLASS_REFS"] = self.old_refs
+
+    def _post(self, body):
+        return self.client.post("/reindex", data=body, content_type="application/json")
+
+    def test_01_reindex_bad_request(self):
+        assert self._post("").status_code == 400
+        assert self._post("[]").status_code == 400
+        assert self._post(json.dumps({"types" : "fake"})).status_code == 400
+
+        resp = self._post(json.dumps({"types" : ["fake", "other", {}]}))
+        assert resp.status_code == 400
+        assert json.loads(resp.data)["types"] == ["other", {}]
+        assert not FakeRolling.reindexed.is_set()
+
+    def test_02_reindex(self):
+        FakeRolling.running = True
+        assert self._post(json.dumps({"types" : ["fake"]})).status_code == 409
+
+        FakeRolling.running = False
+        resp = self._post(json.dumps({"types" : ["fake"]}))
+        assert resp.status_code == 202
+        assert json.loads(resp.data) == {"started" : ["fake"]}
+        assert FakeRolling.reindexed.wait(5)
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from octopus.modules.es import timebox
+from datetime import datetime
+
+class TestTimebox(TestCase):
+    def test_01_periods(self):
+        ts = datetime(2016, 3, 14, 15, 9, 26)
+        assert timebox.truncate(ts, "year") == datetime(2016, 1, 1)
+        assert timebox.truncate(ts, "month") == datetime(2016, 3, 1)
+        assert timebox.truncate(ts, "hour") == datetime(2016, 3, 14, 15)
+        assert timebox.truncate(ts, "second") == ts
+        assert timebox.parent("day") == "month"
+        assert timebox.parent("year") is None
+        assert datetime(2016, 3, 31) + timebox.step("month") == datetime(2016, 4, 30)
+
+        assert timebox.format_type("log", "day", ts) == "log20160314"
+        assert timebox.parse_type("log", "day", "log20160314") == datetime(2016, 3, 14)
+        assert timebox.parse_type("log", "day", "log201603") is None
+        assert timebox.parse_type("log", "day", "other20160314") is None
+
+    def test_02_patterns(self):
+        # days back to the 20th of the month before last
+        latest = datetime(2016, 3, 14)
+        tss = [latest - timebox.step("day", x) for x in range(55)]
+        assert tss[-1] == datetime(2016, 1, 20)
+        names = timebox.patterns("log", "day", tss, latest)
+        assert names == ["log201603*", "log201602*"] + ["log201601" + str(d) for d in range(31, 19, -1)]
+
+        # two whole years of months, and part of a third
+        latest = datetime(2016, 3, 1)
+        tss = [latest - timebox.step("month", x) for x in range(30)]
+        assert timebox.patterns("log", "month", tss, latest) == ["log2016*", "log2015*", "log2014*", "log201312", "log201311", "log201310"]
+
+        # nothing to compress
+        latest = datetime(2016, 3, 14)
+        tss = [latest - timebox.step("day", x) for x in range(3)]
+        assert timebox.patterns("log", "day", tss, latest) == ["log20160314", "log20160313", "log20160312"]
+        assert timebox.patterns("log", "year", [datetime(2016, 1, 1)], datetime(2016, 1, 1)) == ["log2016"]
+
+    def test_03_retention_plan(self):
+        latest = datetime(2016, 3, 14)
+        days = [latest - timebox.step("day", x) for x in range(120)]
+        names = [timebox.format_type("log", "day", ts) for ts in days] + ["log201510", "log201511", "other20160314"]
+
+        # keep 30 days (back to 2016-02-14), archive whole months before that, nothing older than 100 days (2015-12-06)
+        plan = timebox.retention_plan("log", "day", names, latest, keep=30, compact="month", horizon=100)
+        assert sorted(plan["compact"].keys()) == ["log201512", "log201601"]
+        assert plan["compact"]["log201601"] == ["log201601" + "%02d" % d for d in range(1, 32)]
+        assert plan["compact"]["log201512"] == ["log201512" + "%02d" % d for d in range(6, 32)]
+        assert plan["delete"] == ["log201510", "log201511"] + ["log201511" + "%02d" % d for d in range(16, 31)] + ["log201512" + "%02d" % d for d in range(1, 6)]
+
+        # nothing but a horizon
+        plan = timebox.retention_plan("log", "day", names, latest, horizon=100)
+        assert plan["compact"] == {}
+        assert len(plan["delete"]) == 20
+
+        with self.assertRaises(ValueError):
+            timebox.retention_plan("log", "month", names, latest, compact="day")
+
+    def test_04_retained_read_types(self):
+        latest = datetime(2016, 3, 14)
+        days = [latest - timebox.step("day", x) for x in range(120)]
+        names = timebox.retained_read_types("log", "day", days, latest, keep=30, compact="month", horizon=100)
+        assert names == ["log201603*", "log201602*", "log201601*", "log201512*"]
+        assert timebox.retained_read_types("log", "day", days[:3], latest, keep=30, compact="month") == ["log20160314", "log20160313", "log20160312"]
+
+    def test_05_retained_read_types_without_patterns(self):
+        # only the compacted months are read through a pattern
+        latest = datetime(2016, 3, 14)
+        days = [latest - timebox.step("day", x) for x in range(120)]
+        names = timebox.retained_read_types("log", "day", days, latest, keep=30, compact="month", horizon=100, use_patterns=False)
+        assert names[0] == "log20160314"
+        assert names[42] == "log20160201"
+        assert names[43:] == ["log201601*", "log201512*"]
+        assert len([n for n in names if n.endswith("*")]) == 2
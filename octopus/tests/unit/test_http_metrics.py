@@ -0,0 +1,64 @@
+from unittest import TestCase
+from unittest import mock
+from octopus.lib import http
+
+class TestHTTPMetrics(TestCase):
+    def setUp(self):
+        self.metrics = http.RequestMetrics(buckets=[0.1, 1])
+
+    def tearDown(self):
+        http.metrics.reset()
+
+    def test_01_record(self):
+        self.metrics.record_request("example.com", 200, 0.05, bytes_sent=10, bytes_received=100)
+        self.metrics.record_request("example.com", 503, 0.5)
+        self.metrics.record_retry("example.com")
+        self.metrics.record_backoff("example.com", 2)
+
+        snap = self.metrics.snapshot()
+        h = snap["example.com"]
+        assert h["latency"]["buckets"] == [[0.1, 1], [1, 2]]
+        assert h["latency"]["count"] == 2
+        assert h["status"] == {"200" : 1, "503" : 1}
+        assert h["retries"] == 1
+        assert h["backoff_seconds"] == 2
+        assert h["bytes_sent"] == 10
+        assert h["bytes_received"] == 100
+
+        self.metrics.reset()
+        assert self.metrics.snapshot() == {}
+
+    def test_02_prometheus(self):
+        self.metrics.record_request("example.com", 200, 0.5)
+        out = self.metrics.prometheus()
+        assert '# TYPE octopus_http_request_duration_seconds histogram' in out
+        assert 'octopus_http_request_duration_seconds_bucket{host="example.com",le="0.1"} 0' in out
+        assert 'octopus_http_request_duration_seconds_bucket{host="example.com",le="+Inf"} 1' in out
+        assert 'octopus_http_responses_total{host="example.com",status="200"} 1' in out
+        assert 'octopus_http_retries_total{host="example.com"} 0' in out
+
+    def test_03_make_request(self):
+        http.metrics.reset()
+        resps = [http.MockResponse(503, b""), http.MockResponse(200, b"hello", headers={"content-length" : "5"})]
+        with mock.patch("requests.get", side_effect=resps), mock.patch("time.sleep"):
+            r = http.get("http://example.com/thing", retries=2, back_off_factor=1, retry_codes=[503])
+        assert r.status_code == 200
+
+        h = http.metrics.snapshot()["example.com"]
+        assert h["status"] == {"503" : 1, "200" : 1}
+        assert h["retries"] == 1
+        assert h["backoff_seconds"] == 2
+        assert h["bytes_received"] == 5
+
+    def test_04_request_size(self):
+        assert http._request_size({}) == 0
+        assert http._request_size({"data" : b"abc"}) == 3
+        # strings are counted in bytes, not characters
+        assert http._request_size({"data" : "é"}) == 2
+        assert http._request_size({"json" : {"a" : "é"}}) == len('{"a": "\\u00e9"}')
+        assert http._request_size({"data" : {"a" : "b c"}}) == len("a=b+c")
+
+        # streamed bodies whose length is known without reading them
+        stream = http.MultipartStream(fields=[("meta", "meta.json", "application/json", b"{}")])
+        assert http._request_size({"data" : stream}) == len(stream.read())
+        assert http._request_size({"data" : (b"x" for i in range(3))}) == 0
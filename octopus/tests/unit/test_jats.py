@@ -0,0 +1,210 @@
+from unittest import TestCase
+from octopus.lib import xml as xutil
+from octopus.modules.epmc import models
+
+JATS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<article xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:ali="http://www.niso.org/schemas/ali/1.0/">
+  <front>
+    <journal-meta>
+      <journal-title-group><journal-title>Journal of Things</journal-title></journal-title-group>
+      <issn pub-type="ppub">1234-5678</issn>
+      <issn pub-type="epub">8765-4321</issn>
+      <publisher><publisher-name>Publisher Ltd</publisher-name></publisher>
+    </journal-meta>
+    <article-meta>
+      <article-id pub-id-type="doi">10.1234/abc.123</article-id>
+      <article-id pub-id-type="pmcid">1234567</article-id>
+      <article-categories><subj-group><subject>Research Article</subject></subj-group></article-categories>
+      <title-group><article-title>The <italic>Title</italic> of the Article</article-title></title-group>
+      <contrib-group>
+        <contrib contrib-type="author">
+          <name><surname>Smith</surname><given-names>Jane</given-names></name>
+          <contrib-id contrib-id-type="orcid">0000-0001-2345-6789</contrib-id>
+          <xref ref-type="aff" rid="aff1"/>
+          <email>jane@example.com</email>
+        </contrib>
+        <contrib contrib-type="author" rid="aff1 aff2">
+          <name><surname>Jones</surname><given-names>Bob</given-names></name>
+        </contrib>
+        <contrib contrib-type="editor">
+          <name><surname>Editor</surname><given-names>Ed</given-names></name>
+        </contrib>
+        <aff id="aff1"><label>1</label><institution-wrap><institution-id institution-id-type="Ringgold">12345</institution-id><institution>University of Somewhere</institution></institution-wrap>, Somewhere, UK</aff>
+        <aff id="aff2"><institution-wrap><institution-id institution-id-type="ROR">https://ror.org/0abcdef12</institution-id><institution>Institute of Elsewhere</institution></institution-wrap></aff>
+      </contrib-group>
+      <aff>Global Affiliation</aff>
+      <pub-date pub-type="epub"><day>5</day><month>Mar</month><year>2020</year></pub-date>
+      <pub-date pub-type="ppub"><month>4</month><year>2020</year></pub-date>
+      <volume>12</volume>
+      <issue>3</issue>
+      <fpage>100</fpage>
+      <lpage>110</lpage>
+      <history>
+        <date date-type="received"><day>01</day><month>01</month><year>2019</year></date>
+        <date date-type="accepted"><day>15</day><month>12</month><year>2019</year></date>
+      </history>
+      <permissions>
+        <copyright-statement>Copyright 2020 The Authors</copyright-statement>
+        <license license-type="open-access" xlink:href="https://creativecommons.org/licenses/by/4.0/">
+          <license-p>This is an open access article.</license-p>
+        </license>
+      </permissions>
+      <kwd-group><kwd>things</kwd><kwd>stuff</kwd></kwd-group>
+    </article-meta>
+  </front>
+  <body><sec><p>Body text</p></sec></body>
+</article>
+"""
+
+class TestJATS(TestCase):
+    def test_01_properties(self):
+        j = models.JATS(raw=JATS_XML.encode("utf-8"))
+        assert j.title == "The Title of the Article"
+        assert j.journal == "Journal of Things"
+        assert j.volume == "12"
+        assert j.issue == "3"
+        assert j.fpage == "100"
+        assert j.lpage == "110"
+        assert j.is_aam is False
+        assert j.copyright_statement == "Copyright 2020 The Authors"
+        assert j.categories == ["Research Article"]
+        assert j.emails == ["jane@example.com"]
+        assert j.keywords == ["things", "stuff"]
+        assert j.publisher == "Publisher Ltd"
+        assert j.publication_date == "2020-03-05"
+        assert j.date_accepted == "2019-12-15"
+        assert j.date_submitted == "2019-01-01"
+        assert j.issn == ["1234-5678", "8765-4321"]
+        assert j.pmcid == "PMC1234567"
+        assert j.doi == "10.1234/abc.123"
+
+        type, url, para = j.get_licence_details()
+        assert type == "open-access"
+        assert url == "https://creativecommons.org/licenses/by/4.0/"
+        assert "This is an open access article." in para
+
+    def test_02_contribs(self):
+        j = models.JATS(raw=JATS_XML.encode("utf-8"))
+        authors = j.authors
+        assert len(authors) == 2
+        assert len(j.contribs) == 3
+
+        smith = authors[0]
+        assert smith["surname"] == "Smith"
+        assert smith["given-names"] == "Jane"
+        assert smith["orcid"] == "0000-0001-2345-6789"
+        assert smith["email"] == "jane@example.com"
+        assert smith["affiliations"] == ["University of Somewhere , Somewhere, UK", "Global Affiliation"]
+        assert smith["ringgold"] == ["12345"]
+
+        jones = authors[1]
+        assert jones["affiliations"] == ["University of Somewhere , Somewhere, UK", "Institute of Elsewhere", "Global Affiliation"]
+        assert jones["ringgold"] == ["12345"]
+        assert jones["ror"] == ["0abcdef12"]
+
+    def test_03_compiled_xpath(self):
+        assert xutil.compile_xpath("//aff[@id=$rid]") is xutil.compile_xpath("//aff[@id=$rid]")
+        j = models.JATS(raw=JATS_XML.encode("utf-8"))
+        affs = xutil.xp(j.xml, "//aff[@id=$rid]", rid="aff2")
+        assert len(affs) == 1
+        assert xutil.xp_first_text(j.xml, "//article-meta/volume") == "12"
+        assert xutil.xp_first_text(j.xml, "string(//nothing)", default="none") == "none"
+
+    def test_04_extract_all(self):
+        j = models.JATS(raw=JATS_XML.encode("utf-8"))
+        md = j.extract_all()
+        for p in ["title", "journal", "volume", "issue", "fpage", "lpage", "is_aam", "copyright_statement",
+                  "categories", "authors", "contribs", "emails", "keywords", "publisher", "publication_date",
+                  "date_accepted", "date_submitted", "issn", "pmcid", "doi"]:
+            assert md[p] == getattr(j, p), p
+        assert md["licence"] == j.get_licence_details()
+
+        # memoised
+        assert j.extract_all() is md
+
+    def test_05_extract_all_empty(self):
+        j = models.JATS(raw=b"<article><front><article-meta><pub-date><year>2021</year></pub-date></article-meta></front></article>")
+        md = j.extract_all()
+        assert md["title"] == "no title"
+        assert md["journal"] == "no journal title"
+        assert md["licence"] == (None, None, None)
+        assert md["publication_date"] == "2021-01-01"
+        assert md["authors"] == []
+        assert md["doi"] is None
+
+    def test_06_shared_affiliations(self):
+        contribs = "".join(['<contrib contrib-type="author"><name><surname>A{x}</surname></name><xref ref-type="aff" rid="aff{y}"/></contrib>'.format(x=i, y=i % 3) for i in range(30)])
+        affs = "".join(['<aff id="aff{x}"><institution-wrap><institution-id institution-id-type="ringgold">{x}</institution-id><institution>Inst {x}</institution></institution-wrap></aff>'.format(x=i) for i in range(3)])
+        xml = "<article><front><article-meta><contrib-group>" + contribs + affs + "</contrib-group></article-meta></front></article>"
+
+        j = models.JATS(raw=xml.encode("utf-8"))
+        authors = j.authors
+        assert len(authors) == 30
+        for i, a in enumerate(authors):
+            assert a["affiliations"] == ["Inst {x}".format(x=i % 3)]
+            assert a["ringgold"] == [str(i % 3)]
+
+        # each affiliation is only processed once, however many authors reference it
+        assert len(j._aff_details) == 3
+
+    def test_07_from_stream(self):
+        from io import BytesIO
+        j = models.JATS.from_stream(BytesIO(JATS_XML.encode("utf-8")))
+        assert j.xml.find("body") is None
+        assert j.title == "The Title of the Article"
+        assert j.doi == "10.1234/abc.123"
+        assert len(j.authors) == 2
+        assert j.get_licence_details()[0] == "open-access"
+
+        md = models.JATS(raw=JATS_XML.encode("utf-8")).extract_all()
+        assert j.extract_all() == md
+
+        self.assertRaises(models.JATSException, models.JATS.from_stream, BytesIO(b"<article><front>"))
+
+    def test_08_extract_batch(self):
+        import os, tempfile, shutil
+        from io import BytesIO
+        from octopus.modules.epmc import extract
+
+        d = tempfile.mkdtemp()
+        try:
+            good = os.path.join(d, "good.xml")
+            bad = os.path.join(d, "bad.xml")
+            with open(good, "w", encoding="utf-8") as f:
+                f.write(JATS_XML)
+            with open(bad, "w") as f:
+                f.write("<article><front>")
+            stream = BytesIO(JATS_XML.encode("utf-8"))
+
+            expected = models.JATS(raw=JATS_XML.encode("utf-8")).extract_all()
+            sources = [good, bad, stream, good, good]
+            results = list(extract.extract_batch(sources, workers=2, max_pending=2))
+
+            assert [s for s, r in results] == sources
+            assert isinstance(results[1][1], extract.MetadataExtractionException)
+            for i in [0, 2, 3, 4]:
+                assert results[i][1] == expected
+
+            front = list(extract.extract_batch([good], workers=1, front_only=True))
+            assert front[0][1] == expected
+        finally:
+            shutil.rmtree(d)
+
+    def test_09_entities(self):
+        from lxml import etree
+        # entities declared in the document's own DTD are left in the tree as references, not expanded into text
+        raw = """<?xml version="1.0"?>
+<!DOCTYPE article [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;&lol;">]>
+<article><front><article-meta><title-group><article-title>A &lol2; title</article-title></title-group></article-meta></front></article>"""
+        title = models.JATS(raw=raw.encode("utf-8")).xml.find(".//article-title")
+        assert title.text == "A "
+        assert title[0].tag is etree.Entity and title[0].name == "lol2"
+
+        raw = """<!DOCTYPE result [<!ENTITY lol "lol">]><result><title>A &lol; title</title></result>"""
+        title = models.EPMCMetadataXML(raw=raw.encode("utf-8")).xml.find("title")
+        assert title.text == "A "
+        assert title[0].tag is etree.Entity
+
+        # but the space between inline elements is kept
+        raw = "<article><front><article-meta><title-group><article-title><italic>In</italic> <italic>vivo</italic></article-title></title-group></article-meta></front></article>"
+        assert models.JATS(raw=raw.encode("utf-8")).title == "In vivo"
@@ -0,0 +1,329 @@
+from unittest import TestCase
+from unittest import mock
+from octopus.core import app
+from octopus.lib import http, jsonstream
+from octopus.modules.jper import client, models
+import hashlib, json, os, re, requests, shutil, tempfile, threading, urllib.parse
+
+class RangeResponse(http.MockResponse):
+    # serves a byte range of some content, optionally dropping the connection after a number of bytes
+    def __init__(self, status, body, headers=None, drop_after=None):
+        super(RangeResponse, self).__init__(status, body, headers)
+        self.drop_after = drop_after
+
+    def iter_content(self, chunk_size=1024):
+        sent = 0
+        for chunk in super(RangeResponse, self).iter_content(chunk_size):
+            if self.drop_after is not None and sent + len(chunk) > self.drop_after:
+                yield chunk[:self.drop_after - sent]
+                raise requests.exceptions.ChunkedEncodingError("connection dropped")
+            sent += len(chunk)
+            yield chunk
+
+class TestJPERClient(TestCase):
+    def setUp(self):
+        self.jper = client.JPER(api_key="key", base_url="http://jper/api/v1")
+        self.notifications = [{"id" : str(i)} for i in range(250)]
+        self.pages = []
+        self.lock = threading.Lock()
+
+    def _responder(self, fail_page=None):
+        def get(url, *args, **kwargs):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            page = int(params["page"][0])
+            page_size = int(params["pageSize"][0])
+            with self.lock:
+                self.pages.append(page)
+            if page == fail_page:
+                return http.MockResponse(500, b"")
+            notes = self.notifications[(page - 1) * page_size:page * page_size]
+            body = {"since" : params["since"][0], "page" : page, "pageSize" : page_size,
+                    "total" : len(self.notifications), "notifications" : notes}
+            return http.MockResponse(200, json.dumps(body).encode("utf-8"))
+        return get
+
+    def _stream_responder(self):
+        get = self._responder()
+        def get_stream(url, *args, **kwargs):
+            return get(url), "", 0
+        return get_stream
+
+    def test_01_iterate_sequential(self):
+        with mock.patch("octopus.lib.http.get_stream", side_effect=self._stream_responder()):
+            ids = [n.id for n in self.jper.iterate_notifications("2016-01-01T00:00:00Z", page_size=100, workers=1)]
+        assert ids == [str(i) for i in range(250)]
+        assert self.pages == [1, 2, 3]
+
+    def test_02_iterate_concurrent(self):
+        with mock.patch("octopus.lib.http.get", side_effect=self._responder()):
+            ids = [n.id for n in self.jper.iterate_notifications("2016-01-01T00:00:00Z", page_size=10, workers=3)]
+        assert ids == [str(i) for i in range(250)]
+        assert sorted(self.pages) == list(range(1, 26))
+
+    def test_03_checkpoint(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        checkpoint = client.HarvestCheckpoint(path)
+        try:
+            # crash part way through the harvest
+            seen = []
+            with mock.patch("octopus.lib.http.get", side_effect=self._responder(fail_page=4)):
+                try:
+                    for n in self.jper.iterate_notifications("2016-01-01T00:00:00Z", page_size=50, workers=2, checkpoint=checkpoint):
+                        seen.append(n.id)
+                except client.JPERException:
+                    pass
+            assert seen == [str(i) for i in range(150)]
+            assert checkpoint.load()["page"] == 3
+
+            # resume, with a different since date and page size, which are overridden by the checkpoint
+            self.pages = []
+            with mock.patch("octopus.lib.http.get", side_effect=self._responder()):
+                for n in self.jper.iterate_notifications("2017-01-01T00:00:00Z", page_size=10, workers=2, checkpoint=checkpoint):
+                    seen.append(n.id)
+            assert seen == [str(i) for i in range(250)]
+            assert sorted(self.pages) == [4, 5]
+            assert checkpoint.load() is None
+
+            # a checkpoint for another repository's harvest is not resumed
+            checkpoint.save("2016-01-01T00:00:00Z", 3, 50, "repo1")
+            self.pages = []
+            with mock.patch("octopus.lib.http.get", side_effect=self._responder()):
+                with self.assertRaises(client.JPERException):
+                    list(self.jper.iterate_notifications("2016-01-01T00:00:00Z", repository_id="repo2", workers=2, checkpoint=checkpoint))
+            assert self.pages == []
+            assert checkpoint.load()["page"] == 3
+        finally:
+            checkpoint.clear()
+
+    def test_04_stream_notifications(self):
+        self.notifications[3]["provider"] = {"id" : "pub"}
+        header = {}
+        with mock.patch("octopus.lib.http.get_stream", side_effect=self._stream_responder()):
+            notes = list(self.jper.stream_notifications("2016-01-01T00:00:00Z", page=1, page_size=10, header=header, chunk_size=7))
+        assert [n.id for n in notes] == [str(i) for i in range(10)]
+        assert isinstance(notes[0], models.OutgoingNotification)
+        assert isinstance(notes[3], models.ProviderOutgoingNotification)
+        assert header["total"] == 250
+        assert header["page"] == 1
+
+        # the response is closed when the caller stops early, and when it can't be decoded
+        responses = []
+        def get_stream(url, *args, **kwargs):
+            resp, content, downloaded = self._stream_responder()(url)
+            responses.append(resp)
+            return resp, content, downloaded
+        with mock.patch("octopus.lib.http.get_stream", side_effect=get_stream):
+            notes = self.jper.stream_notifications("2016-01-01T00:00:00Z", page=1, page_size=10)
+            next(notes)
+            notes.close()
+        assert responses[-1].raw.closed
+
+        broken = http.MockResponse(200, b'{"notifications" : [{"id" : "1"}, {"id" : ')
+        with mock.patch("octopus.lib.http.get_stream", return_value=(broken, "", 0)):
+            with self.assertRaises(jsonstream.JSONStreamException):
+                list(self.jper.stream_notifications("2016-01-01T00:00:00Z", page=1, page_size=10))
+        assert broken.raw.closed
+
+    def _content_server(self, content, drops=None, ranges=True, etag=None, shift=0, short=0):
+        # drops is a list of byte counts after which successive responses are cut off; shift moves the start of
+        # the ranges served from where they were asked for, and short leaves that many bytes off the full content
+        drops = list(drops) if drops is not None else []
+        def get_stream(url, *args, **kwargs):
+            rng = kwargs.get("headers", {}).get("Range")
+            if_range = kwargs.get("headers", {}).get("If-Range")
+            with self.lock:
+                self.pages.append(rng)
+                drop = drops.pop(0) if len(drops) > 0 else None
+            headers = {"ETag" : etag} if etag is not None else {}
+            if rng is None or not ranges or (if_range is not None and if_range != etag):
+                headers["Content-Length"] = str(len(content))
+                return RangeResponse(200, content[:len(content) - short], headers, drop_after=drop), "", 0
+            start, end = re.match(r"bytes=(\d+)-(\d*)", rng).groups()
+            start = int(start) + shift
+            end = int(end) if end else len(content) - 1
+            if start >= len(content):
+                return RangeResponse(416, b""), "", 0
+            headers["Content-Range"] = "bytes {s}-{e}/{t}".format(s=start, e=end, t=len(content))
+            return RangeResponse(206, content[start:end + 1], headers, drop_after=drop), "", 0
+        return get_stream
+
+    def test_05_download_resume(self):
+        content = os.urandom(100000)
+        d = tempfile.mkdtemp()
+        old = app.config.get("JPER_DOWNLOAD_DIR")
+        app.config["JPER_DOWNLOAD_DIR"] = os.path.join(d, "work")
+        try:
+            target = os.path.join(d, "content.zip")
+            with mock.patch("octopus.lib.http.get_stream", side_effect=self._content_server(content, drops=[None, 90000, 5000], etag='"v1"')):
+                size, digest = self.jper.download_content("http://jper/content/1", target_path=target, segments=1,
+                                                          chunk_size=4096, checksum=hashlib.md5(content).hexdigest())
+            assert size == 100000
+            with open(target, "rb") as f:
+                assert f.read() == content
+            # after asking for the length, the first attempt got 90000 bytes, the second 5000 more, and the third
+            # finished it off
+            assert self.pages == ["bytes=0-0", None, "bytes=90000-", "bytes=95000-"]
+            assert os.listdir(os.path.join(d, "work")) == []
+        finally:
+            app.config["JPER_DOWNLOAD_DIR"] = old
+            shutil.rmtree(d)
+
+    def test_06_download_segments(self):
+        content = os.urandom(100003)
+        d = tempfile.mkdtemp()
+        old = app.config.get("JPER_DOWNLOAD_DIR")
+        app.config["JPER_DOWNLOAD_DIR"] = os.path.join(d, "work")
+        try:
+            store = mock.Mock()
+            stored = {}
+            def store_file(container_id, target_name, source_path=None, source_stream=None):
+                with open(source_path, "rb") as f:
+                    stored[(container_id, target_name)] = f.read()
+            store.store.side_effect = store_file
+
+            with mock.patch("octopus.lib.http.get_stream", side_effect=self._content_server(content, drops=[None, 1000])):
+                size, digest = self.jper.download_content("http://jper/content/1", store=store, container_id="abc",
+                                                          target_name="content.zip", segments=4, chunk_size=512)
+            assert size == 100003
+            assert digest == hashlib.md5(content).hexdigest()
+            assert stored[("abc", "content.zip")] == content
+            assert os.listdir(os.path.join(d, "work")) == []
+
+            # a bad checksum is not handed over
+            with mock.patch("octopus.lib.http.get_stream", side_effect=self._content_server(content, ranges=False)):
+                with self.assertRaises(client.JPERException):
+                    self.jper.download_content("http://jper/content/1", target_path=os.path.join(d, "bad.zip"),
+                                               segments=4, checksum="0000")
+            assert not os.path.exists(os.path.join(d, "bad.zip"))
+        finally:
+            app.config["JPER_DOWNLOAD_DIR"] = old
+            shutil.rmtree(d)
+
+    def test_07_download_resume_checks(self):
+        content = os.urandom(10000)
+        d = tempfile.mkdtemp()
+        old = app.config.get("JPER_DOWNLOAD_DIR")
+        work = os.path.join(d, "work")
+        app.config["JPER_DOWNLOAD_DIR"] = work
+        target = os.path.join(d, "content.zip")
+        def download(server, segments=1, retries=0):
+            with mock.patch("octopus.lib.http.get_stream", side_effect=server):
+                return self.jper.download_content("http://jper/content/1", target_path=target, segments=segments,
+                                                  chunk_size=512, retries=retries)
+        try:
+            # a download split 4 ways is interrupted, and the next is split 2 ways: the 4 partials are not used
+            with self.assertRaises(client.JPERConnectionException):
+                download(self._content_server(content, drops=[None, None, 100], etag='"v1"'), segments=4)
+            assert len(os.listdir(work)) > 1
+            assert download(self._content_server(content, etag='"v1"'), segments=2)[0] == 10000
+            with open(target, "rb") as f:
+                assert f.read() == content
+            assert os.listdir(work) == []
+
+            # the content changes between attempts: the partial file is not resumed
+            with self.assertRaises(client.JPERConnectionException):
+                download(self._content_server(content, drops=[None, 4000], etag='"v1"'))
+            changed = os.urandom(10000)
+            self.pages = []
+            download(self._content_server(changed, etag='"v2"'))
+            assert self.pages == ["bytes=0-0", None]
+            with open(target, "rb") as f:
+                assert f.read() == changed
+
+            # the content changes during an attempt: the server answers the If-Range with all of it, which replaces
+            # the partial file
+            self.pages = []
+            versions = [self._content_server(content, drops=[None, 4000], etag='"v1"'), self._content_server(changed, etag='"v2"')]
+            server = lambda url, *args, **kwargs: versions[0 if len(self.pages) < 2 else 1](url, *args, **kwargs)
+            download(server, retries=1)
+            assert self.pages == ["bytes=0-0", None, "bytes=4000-"]
+            with open(target, "rb") as f:
+                assert f.read() == changed
+
+            # a segment which has changed can't be fixed up, so the download fails
+            versions = [self._content_server(content, drops=[None, None, 100], etag='"v1"'), self._content_server(changed, etag='"v2"')]
+            self.pages = []
+            server = lambda url, *args, **kwargs: versions[0 if len(self.pages) < 5 else 1](url, *args, **kwargs)
+            with self.assertRaises(client.JPERException):
+                download(server, segments=4, retries=1)
+
+            # a range which doesn't start where it was asked to
+            with self.assertRaises(client.JPERException):
+                download(self._content_server(content, etag='"v1"', shift=1), segments=2)
+
+            # and with one segment, the length is still checked
+            with self.assertRaises(client.JPERException):
+                download(self._content_server(content, ranges=False, short=10))
+            assert os.listdir(work) == []
+        finally:
+            app.config["JPER_DOWNLOAD_DIR"] = old
+            shutil.rmtree(d)
+
+    def test_08_bulk_create(self):
+        d = tempfile.mkdtemp()
+        try:
+            zips = []
+            for i in range(3):
+                path = os.path.join(d, "{x}.zip".format(x=i))
+                with open(path, "wb") as f:
+                    f.write(os.urandom(1000 + i))
+                zips.append(path)
+
+            received = {}
+            sessions = set()
+            def post(url, *args, **kwargs):
+                sessions.add(id(kwargs.get("session")))
+                data = kwargs.get("data")
+                if isinstance(data, http.MultipartStream):
+                    body = data.read()
+                    meta = json.loads(body.split(b"\r\n\r\n", 1)[1].split(b"\r\n--", 1)[0])
+                else:
+                    body = None
+                    meta = json.loads(data)
+                if meta.get("bad"):
+                    return http.MockResponse(400, json.dumps({"error" : "bad notification"}).encode("utf-8"))
+                with self.lock:
+                    received[meta["n"]] = body
+                return http.MockResponse(202, json.dumps({"id" : str(meta["n"]), "location" : "http://jper/" + str(meta["n"])}).encode("utf-8"))
+
+            items = [({"n" : 0}, zips[0]), {"n" : 1}, {"n" : 2, "bad" : True}, ({"n" : 3}, zips[1]), ({"n" : 4}, zips[2])]
+            with mock.patch("octopus.lib.http.post", side_effect=post):
+                results = self.jper.bulk_create_notifications(iter(items), workers=2)
+
+            assert [r.get("id") for r in results] == ["0", "1", None, "3", "4"]
+            assert results[3]["location"] == "http://jper/3"
+            assert results[2]["error"] == "bad notification"
+            assert len(sessions) == 1
+            assert received[1] is None
+            with open(zips[1], "rb") as f:
+                assert f.read() in received[3]
+        finally:
+            shutil.rmtree(d)
+
+    def test_09_fake_server(self):
+        from octopus.modules.jper.fakeserver import FakeJPERServer
+        server = FakeJPERServer(notifications=30, payload_size=50000, api_key="key").start()
+        d = tempfile.mkdtemp()
+        try:
+            jper = client.JPER(api_key="key", base_url=server.url)
+            notes = list(jper.iterate_notifications("2016-01-01T00:00:00Z", page_size=7, workers=3))
+            assert len(notes) == 30
+
+            id, loc = jper.create_notification({"event" : "publication"})
+            assert loc.endswith("/notification/" + id)
+            assert jper.get_notification(id).id == id
+            assert len(list(jper.iterate_notifications("2016-01-01T00:00:00Z", page_size=7, workers=1))) == 31
+
+            target = os.path.join(d, "content.zip")
+            size, digest = jper.download_content(notes[0].links[0]["url"], target_path=target, segments=3)
+            assert size == 50000
+            with open(target, "rb") as f:
+                assert f.read() == server.fake.payload()
+
+            with self.assertRaises(client.JPERAuthException):
+                client.JPER(api_key="wrong", base_url=server.url).validate({"event" : "publication"})
+        finally:
+            server.stop()
+            shutil.rmtree(d)
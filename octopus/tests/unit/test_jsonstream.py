@@ -0,0 +1,38 @@
+from unittest import TestCase
+from octopus.lib import jsonstream
+import json
+
+DOC = {
+    "since" : "2016-01-01T00:00:00Z",
+    "page" : 1,
+    "notifications" : [{"id" : "1", "title" : "café \"quoted\" [brackets] {braces}"}, {"id" : "2", "n" : 12345}, [1, 2], 3.25, None],
+    "total" : 123456,
+    "nested" : {"notifications" : ["not", "these"]}
+}
+
+def _chunks(bs, size):
+    return [bs[i:i + size] for i in range(0, len(bs), size)]
+
+class TestJSONStream(TestCase):
+    def test_01_chunk_sizes(self):
+        raw = json.dumps(DOC, indent=2).encode("utf-8")
+        for size in range(1, 40):
+            header = {}
+            items = list(jsonstream.iter_array(_chunks(raw, size), "notifications", header=header))
+            assert items == DOC["notifications"], size
+            assert header["total"] == 123456, size
+            assert header["since"] == DOC["since"]
+            assert header["nested"] == DOC["nested"]
+
+    def test_02_empty_and_missing(self):
+        assert list(jsonstream.iter_array([b'{"notifications" : []}'], "notifications")) == []
+        assert list(jsonstream.iter_array([b'{}'], "notifications")) == []
+        header = {}
+        assert list(jsonstream.iter_array(['{"total" : 0}'], "notifications", header=header)) == []
+        assert header == {"total" : 0}
+
+    def test_03_malformed(self):
+        with self.assertRaises(jsonstream.JSONStreamException):
+            list(jsonstream.iter_array([b'{"notifications" : [{"id" : "1"}, {"id" : '], "notifications"))
+        with self.assertRaises(jsonstream.JSONStreamException):
+            list(jsonstream.iter_array([b'["notifications"]'], "notifications"))
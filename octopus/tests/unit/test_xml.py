@@ -0,0 +1,111 @@
+from unittest import TestCase
+from octopus.lib import xml as xutil
+from lxml import etree
+from io import BytesIO
+import os, tempfile
+
+class TestXML(TestCase):
+    def test_01_fromstring(self):
+        # unicode strings with and without a declaration or BOM
+        assert xutil.fromstring("<a><b>x</b></a>").find("b").text == "x"
+        assert xutil.fromstring('<?xml version="1.0" encoding="UTF-8"?>\n<a><b>é</b></a>').find("b").text == "é"
+        assert xutil.fromstring('﻿<?xml version="1.0" encoding="UTF-8"?><a/>').tag == "a"
+
+        # bytes in the declared encoding, with a BOM, in an encoding libxml2 only knows by another name, and
+        # with a junk encoding
+        assert xutil.fromstring('<?xml version="1.0" encoding="UTF-16"?><a/>'.encode("utf-16")).tag == "a"
+        assert xutil.fromstring(b'\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?><a/>').tag == "a"
+        latin = '<?xml version="1.0" encoding="latin-1"?><a><b>é</b></a>'.encode("latin-1")
+        assert xutil.fromstring(latin).find("b").text == "é"
+        junk = '<?xml version="1.0" encoding="junk"?><a><b>é</b></a>'.encode("utf-8")
+        assert xutil.fromstring(junk).find("b").text == "é"
+
+        self.assertRaises(etree.XMLSyntaxError, xutil.fromstring, b"<a>")
+
+    def test_02_parser(self):
+        assert xutil.get_parser() is xutil.get_parser()
+        assert xutil.get_parser() is not xutil.get_parser(remove_blank_text=False)
+
+        # blank text is removed by default, but can be kept
+        assert xutil.fromstring("<a>\n  <b>x</b>\n</a>")[0].tail is None
+        assert xutil.fromstring("<a>\n  <b>x</b>\n</a>", remove_blank_text=False)[0].tail == "\n"
+
+        # entities are not resolved
+        doc = '<!DOCTYPE a [<!ENTITY e "expanded">]><a>&e;</a>'
+        assert xutil.fromstring(doc).text is None
+
+    def test_03_fromfile(self):
+        junk = '<?xml version="1.0" encoding="junk"?><a><b>é</b></a>'.encode("utf-8")
+        assert xutil.fromfile(BytesIO(junk)).find("b").text == "é"
+
+        fd, path = tempfile.mkstemp(suffix=".xml")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write('<?xml version="1.0" encoding="latin-1"?><a><b>é</b></a>'.encode("latin-1"))
+            assert xutil.fromfile(path).find("b").text == "é"
+        finally:
+            os.remove(path)
+
+    def test_04_parse_until(self):
+        doc = b'<!DOCTYPE a [<!ENTITY e "expanded">]><a>\n  <b>&e;</b>\n  <c>x</c>\n  <d/></a>'
+        root = xutil.parse_until(BytesIO(doc), "c")
+        assert root.find("c").text == "x"
+
+        # with the same options as the parser, unless they are overridden
+        assert root.find("b").text is None
+        assert root.find("b").tail is None
+        root = xutil.parse_until(BytesIO(doc), "c", remove_blank_text=False)
+        assert root.find("b").tail == "\n  "
+
+    def test_05_objectify(self):
+        xml = xutil.fromstring("""<result>
+            <id>1</id>
+            <!-- a comment -->
+            <authorList>
+                <author seq="1"><fullName>Smith J</fullName></author>
+                <author seq="2"><fullName>Jones K</fullName></author>
+            </authorList>
+            <journalInfo><journal><title>Journal of Things</title><issn type="print">1234-5678</issn></journal><volume>3</volume></journalInfo>
+        </result>""")
+
+        # the default behaviour: last one wins, no attributes
+        ob = xutil.objectify(xml)
+        assert ob["id"] == "1"
+        assert ob["authorList"] == {"author" : {"fullName" : "Jones K"}}
+        assert ob["journalInfo"]["journal"]["issn"] == "1234-5678"
+
+        ob = xutil.objectify(xml, repeated=True, attributes=True)
+        assert ob["authorList"]["author"] == [{"@seq" : "1", "fullName" : "Smith J"}, {"@seq" : "2", "fullName" : "Jones K"}]
+        assert ob["journalInfo"]["journal"]["issn"] == {"@type" : "print", "#text" : "1234-5678"}
+
+        ob = xutil.objectify(xml, paths=["journalInfo/journal", "id"])
+        assert ob == {"id" : "1", "journalInfo" : {"journal" : {"title" : "Journal of Things", "issn" : "1234-5678"}}}
+
+    def test_06_objectify_deep(self):
+        # deeper than the default recursion limit
+        depth = 2000
+        xml = etree.fromstring("<a>" * depth + "x" + "</a>" * depth, etree.XMLParser(huge_tree=True))
+        ob = xutil.objectify(xml)
+        for i in range(depth - 2):
+            ob = ob["a"]
+        assert ob == {"a" : "x"}
+
+    def test_07_compile_xpath(self):
+        old = xutil.XPATH_CACHE_SIZE
+        xutil.XPATH_CACHE_SIZE = 3
+        try:
+            first = xutil.compile_xpath("//a")
+            assert xutil.compile_xpath("//a") is first
+            for tag in ["b", "c", "d"]:
+                xutil.compile_xpath("//" + tag)
+                # keep //a the most recently used
+                assert xutil.compile_xpath("//a") is first
+            assert len(xutil._xpath_local.cache) == 3
+
+            # //b was the least recently used, so has been dropped
+            assert ("//b", None) not in xutil._xpath_local.cache
+            for tag in ["e", "f", "g"]:
+                xutil.compile_xpath("//" + tag)
+            assert xutil.compile_xpath("//a") is not first
+        finally:
+            xutil.XPATH_CACHE_SIZE = old